@@ -0,0 +1,355 @@
+"""
+Columnar in-memory analytics over the sales history.
+
+Every line item is loaded once into NumPy arrays (one array per column,
+with the sale's time and cashier copied onto each item). Later refreshes
+only read items above the highest item id already loaded, so keeping the
+engine current costs one small query. Reports are computed with vectorized
+group-bys (bincount over dense keys) instead of SQL aggregates:
+
+    basket_pairs      products bought together (support, confidence, lift)
+    heatmap           revenue and sales per weekday x hour
+    cashier_stats     sales, basket size and pace per cashier
+    price_elasticity  log-log slope of daily quantity against price
+
+Items of one sale are loaded contiguously (each refresh orders by
+transaction), so the first item of every sale is flagged once at load time
+and per-sale figures never need a sort.
+"""
+import logging
+import os
+import threading
+import time
+import numpy as np
+from sqlalchemy import select
+from models import db, Transaction, TransactionItem
+
+# Seconds between refreshes triggered by report requests
+REFRESH_INTERVAL = float(os.environ.get('ANALYTICS_REFRESH_SECONDS', 30))
+
+# Item ids below the watermark that are re-read on every refresh. On Postgres
+# a sale can commit after a sale with higher item ids; re-reading this window
+# (and skipping rows already loaded) picks it up.
+WATERMARK_OVERLAP = 1000
+
+# Rows fetched from the database per round trip
+FETCH_SIZE = 10000
+
+# Gaps between two sales longer than this start a new stretch of work
+MAX_SALE_GAP = 30 * 60
+
+SECONDS_PER_DAY = 86400
+
+class _Column:
+    """Append-only NumPy array with amortized growth"""
+
+    def __init__(self, dtype):
+        self.data = np.empty(1024, dtype=dtype)
+        self.size = 0
+
+    def extend(self, values):
+        needed = self.size + len(values)
+        if needed > len(self.data):
+            grown = np.empty(max(needed, len(self.data) * 2), dtype=self.data.dtype)
+            grown[:self.size] = self.data[:self.size]
+            self.data = grown
+        self.data[self.size:needed] = values
+        self.size = needed
+
+    @property
+    def values(self):
+        return self.data[:self.size]
+
+class SalesAnalytics:
+    """Line items as columns, refreshed incrementally by item id"""
+
+    COLUMNS = {
+        'item_id': np.int64,
+        'timestamp': np.int64,      # seconds since the epoch, local time as stored
+        'cashier': np.int32,        # index into self.cashiers
+        'product': np.int32,        # index into self.products
+        'quantity': np.int32,
+        'price': np.float64,
+        'subtotal': np.float64,
+        'first_item': np.bool_,     # first item of its sale
+    }
+
+    def __init__(self):
+        self.columns = {name: _Column(dtype) for name, dtype in self.COLUMNS.items()}
+        self.cashiers = []
+        self.cashier_codes = {}
+        self.products = []          # (product id, name) per product code
+        self.product_codes = {}
+        self.watermark = 0
+        self.last_transaction = None
+        self.refreshed_at = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.columns['item_id'].size
+
+    def _cashier_code(self, name):
+        code = self.cashier_codes.get(name)
+        if code is None:
+            code = self.cashier_codes[name] = len(self.cashiers)
+            self.cashiers.append(name)
+        return code
+
+    def _product_code(self, product_id, name):
+        code = self.product_codes.get(product_id)
+        if code is None:
+            code = self.product_codes[product_id] = len(self.products)
+            self.products.append((product_id, name))
+        else:
+            self.products[code] = (product_id, name)
+        return code
+
+    def refresh(self, force=False):
+        """Load items added since the last refresh; returns the number of new items"""
+        with self.lock:
+            if not force and time.monotonic() - self.refreshed_at < REFRESH_INTERVAL:
+                return 0
+            started = time.perf_counter()
+            lower = max(0, self.watermark - WATERMARK_OVERLAP)
+            stmt = select(
+                TransactionItem.id, TransactionItem.transaction_id, Transaction.date, Transaction.cashier,
+                TransactionItem.product_id, TransactionItem.product_name, TransactionItem.quantity,
+                TransactionItem.price, TransactionItem.subtotal
+            ).join(Transaction, TransactionItem.transaction_id == Transaction.id).where(
+                TransactionItem.id > lower
+            ).order_by(TransactionItem.transaction_id, TransactionItem.id)
+
+            self.last_transaction = None
+            result = db.session.execute(stmt.execution_options(stream_results=True, yield_per=FETCH_SIZE))
+            loaded = 0
+            try:
+                for rows in result.partitions():
+                    loaded += self._append(rows)
+            finally:
+                result.close()
+
+            self.refreshed_at = time.monotonic()
+            if loaded:
+                logging.info(f"Analytics loaded {loaded} items in {time.perf_counter() - started:.2f}s "
+                             f"({len(self)} total)")
+            return loaded
+
+    def _append(self, rows):
+        """Append one batch of rows, skipping items that are already loaded"""
+        (item_ids, transaction_ids, dates, cashiers, products,
+         names, quantities, prices, subtotals) = zip(*rows)
+        item_ids = np.array(item_ids, dtype=np.int64)
+
+        keep = item_ids > self.watermark
+        if not keep.all() and len(self):
+            # Overlap window: drop what an earlier refresh already saw
+            loaded_ids = self.columns['item_id'].values
+            recent = loaded_ids[loaded_ids > self.watermark - WATERMARK_OVERLAP]
+            keep |= ~np.isin(item_ids, recent)
+        if not keep.any():
+            return 0
+
+        first_item = np.empty(len(transaction_ids), dtype=np.bool_)
+        previous = self.last_transaction
+        for index, transaction_id in enumerate(transaction_ids):
+            first_item[index] = transaction_id != previous
+            previous = transaction_id
+        self.last_transaction = previous
+
+        columns = {
+            'item_id': item_ids,
+            'timestamp': np.array(dates, dtype='datetime64[s]').astype(np.int64),
+            'cashier': np.array([self._cashier_code(name) for name in cashiers], dtype=np.int32),
+            'product': np.array([self._product_code(product_id, name)
+                                 for product_id, name in zip(products, names)], dtype=np.int32),
+            'quantity': np.array(quantities, dtype=np.int32),
+            'price': np.array(prices, dtype=np.float64),
+            'subtotal': np.array(subtotals, dtype=np.float64),
+            'first_item': first_item,
+        }
+        for name, values in columns.items():
+            self.columns[name].extend(values[keep])
+        self.watermark = max(self.watermark, int(item_ids.max()))
+        return int(keep.sum())
+
+    def _select(self, start=None, end=None):
+        """Column views for items sold in [start, end)"""
+        columns = {name: column.values for name, column in self.columns.items()}
+        if start is None and end is None:
+            return columns
+        timestamp = columns['timestamp']
+        mask = np.ones(len(timestamp), dtype=np.bool_)
+        if start is not None:
+            mask &= timestamp >= _epoch(start)
+        if end is not None:
+            mask &= timestamp < _epoch(end)
+        return {name: values[mask] for name, values in columns.items()}
+
+    def basket_pairs(self, start=None, end=None, limit=20, min_count=2):
+        """Pairs of products most often bought in the same sale"""
+        columns = self._select(start, end)
+        products = columns['product']
+        sale = np.cumsum(columns['first_item'])  # sale number per item (contiguous)
+        sales = int(sale[-1]) if len(sale) else 0
+        if sales == 0:
+            return {'sales': 0, 'pairs': []}
+        size = len(self.products)
+
+        # One row per (sale, product), then every pair within a sale: items
+        # i and i + d belong together when they carry the same sale number.
+        keys = np.sort(sale * size + products)
+        keys = keys[np.r_[True, keys[1:] != keys[:-1]]]
+        sale, products = keys // size, keys % size
+
+        product_sales = np.bincount(products, minlength=size)
+        together = []
+        offset = 1
+        while offset < len(sale):
+            same = sale[offset:] == sale[:-offset]
+            if not same.any():
+                break
+            together.append(products[:-offset][same] * size + products[offset:][same])
+            offset += 1
+        if not together:
+            return {'sales': sales, 'pairs': []}
+        pair_keys, pair_counts = np.unique(np.concatenate(together), return_counts=True)
+
+        top = np.argsort(pair_counts, kind='stable')[::-1][:limit]
+        pairs = []
+        for index in top:
+            count = int(pair_counts[index])
+            if count < min_count:
+                break
+            a, b = divmod(int(pair_keys[index]), size)
+            support = count / sales
+            pairs.append({
+                'products': [self.products[a][1], self.products[b][1]],
+                'product_ids': [self.products[a][0], self.products[b][0]],
+                'count': count,
+                'support': round(support, 4),
+                'confidence': round(count / product_sales[a], 4),
+                'lift': round(support / ((product_sales[a] / sales) * (product_sales[b] / sales)), 3),
+            })
+        return {'sales': sales, 'pairs': pairs}
+
+    def heatmap(self, start=None, end=None):
+        """Revenue and number of sales per weekday (Monday = 0) and hour"""
+        columns = self._select(start, end)
+        timestamp = columns['timestamp']
+        weekday = (timestamp // SECONDS_PER_DAY + 3) % 7  # 1970-01-01 was a Thursday
+        hour = (timestamp % SECONDS_PER_DAY) // 3600
+        cell = weekday * 24 + hour
+        revenue = np.bincount(cell, weights=columns['subtotal'], minlength=7 * 24).reshape(7, 24)
+        sales = np.bincount(cell[columns['first_item']], minlength=7 * 24).reshape(7, 24)
+        return {'revenue': revenue.round(2).tolist(), 'sales': sales.tolist()}
+
+    def cashier_stats(self, start=None, end=None):
+        """Per cashier: sales, items, revenue, average basket and pace"""
+        columns = self._select(start, end)
+        cashier = columns['cashier']
+        count = len(self.cashiers)
+        if not len(cashier):
+            return []
+        first = columns['first_item']
+        sale_cashier = cashier[first]
+        sale_time = columns['timestamp'][first]
+
+        revenue = np.bincount(cashier, weights=columns['subtotal'], minlength=count)
+        items = np.bincount(cashier, weights=columns['quantity'], minlength=count)
+        sales = np.bincount(sale_cashier, minlength=count)
+        hours = np.sort(sale_cashier.astype(np.int64) * 10 ** 7 + sale_time // 3600)
+        hours = hours[np.r_[True, hours[1:] != hours[:-1]]]
+        active_hours = np.bincount(hours // 10 ** 7, minlength=count)
+
+        # Seconds between consecutive sales of the same cashier, within a stretch of work
+        order = np.lexsort((sale_time, sale_cashier))
+        sale_cashier, sale_time = sale_cashier[order], sale_time[order]
+        gaps = np.diff(sale_time)
+        valid = (sale_cashier[1:] == sale_cashier[:-1]) & (gaps <= MAX_SALE_GAP)
+        gap_cashier, gaps = sale_cashier[1:][valid], gaps[valid]
+
+        stats = []
+        for code, name in enumerate(self.cashiers):
+            if not sales[code]:
+                continue
+            cashier_gaps = gaps[gap_cashier == code]
+            stats.append({
+                'cashier': name,
+                'sales': int(sales[code]),
+                'items': int(items[code]),
+                'revenue': round(float(revenue[code]), 2),
+                'average_basket': round(float(revenue[code] / sales[code]), 2),
+                'items_per_sale': round(float(items[code] / sales[code]), 2),
+                'active_hours': int(active_hours[code]),
+                'sales_per_active_hour': round(float(sales[code] / active_hours[code]), 2),
+                'median_seconds_between_sales': float(np.median(cashier_gaps)) if len(cashier_gaps) else None,
+            })
+        return sorted(stats, key=lambda row: row['revenue'], reverse=True)
+
+    def price_elasticity(self, start=None, end=None, min_days=5):
+        """Per product: slope of log(daily quantity) against log(average price).
+
+        Only products whose price changed over the period get an estimate;
+        -1 means revenue stays flat when the price changes.
+        """
+        columns = self._select(start, end)
+        products = columns['product']
+        if not len(products):
+            return []
+        day = columns['timestamp'] // SECONDS_PER_DAY
+        first_day = int(day.min())
+        days = int(day.max()) - first_day + 1
+        size = len(self.products)
+
+        # Quantity and revenue per (product, day)
+        key = products.astype(np.int64) * days + (day - first_day)
+        quantity = np.bincount(key, weights=columns['quantity'], minlength=size * days)
+        revenue = np.bincount(key, weights=columns['subtotal'], minlength=size * days)
+        sold = quantity > 0
+        cells = np.nonzero(sold)[0]
+        product = cells // days
+        x = np.log(revenue[sold] / quantity[sold])
+        y = np.log(quantity[sold])
+
+        # Per-product least squares from grouped sums
+        n = np.bincount(product, minlength=size)
+        sx = np.bincount(product, weights=x, minlength=size)
+        sy = np.bincount(product, weights=y, minlength=size)
+        sxx = np.bincount(product, weights=x * x, minlength=size)
+        sxy = np.bincount(product, weights=x * y, minlength=size)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            variance = n * sxx - sx * sx
+            slope = (n * sxy - sx * sy) / variance
+            average_price = np.exp(sx / n)  # geometric mean
+        low = np.full(size, np.inf)
+        high = np.full(size, -np.inf)
+        np.minimum.at(low, product, x)
+        np.maximum.at(high, product, x)
+
+        report = []
+        for code in np.nonzero(n)[0]:
+            product_id, name = self.products[code]
+            varies = n[code] >= min_days and high[code] - low[code] > 1e-9
+            report.append({
+                'product_id': product_id,
+                'product': name,
+                'days': int(n[code]),
+                'min_price': round(float(np.exp(low[code])), 2),
+                'max_price': round(float(np.exp(high[code])), 2),
+                'average_price': round(float(average_price[code]), 2),
+                'elasticity': round(float(slope[code]), 3) if varies else None,
+            })
+        return report
+
+def _epoch(moment):
+    """Seconds since the epoch for a naive datetime, matching the loaded timestamps"""
+    return int(np.datetime64(moment, 's').astype(np.int64))
+
+engine = SalesAnalytics()
+
+REPORTS = {
+    'basket': engine.basket_pairs,
+    'heatmap': engine.heatmap,
+    'cashiers': engine.cashier_stats,
+    'elasticity': engine.price_elasticity,
+}
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+Load test of the POS hot paths with many simulated terminals.
+
+Boots the Flask app against a throwaway database, seeds sales history and
+drives each scenario from concurrent terminals (threads with their own
+logged-in test client). Reports throughput, p50/p95/p99 latency and SQL
+statements per request, and writes everything as JSON so runs from
+different commits can be compared.
+
+    python benchmarks/bench_pos.py --terminals 10 --requests 50 --output bench.json
+    python benchmarks/bench_pos.py --database sqlite --database postgresql://localhost/kasir_bench
+    python benchmarks/bench_pos.py --compare before.json after.json
+
+Every --database runs in its own process, since the app binds its database
+at import. Postgres databases are emptied before seeding; never point this
+at production.
+"""
+import argparse
+import atexit
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+SCENARIOS = ('checkout', 'products', 'sales_history', 'chart_data', 'receipt_pdf')
+
+# Metrics compared by --compare, and whether higher is better
+COMPARED_METRICS = {
+    'throughput_rps': True,
+    'p50_ms': False,
+    'p95_ms': False,
+    'p99_ms': False,
+    'sql_per_request': False,
+}
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+def git_commit():
+    """Current commit hash, or None outside a git checkout"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=APP_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+class SqlCounter:
+    """Count statements executed by the current thread"""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.local = threading.local()
+        event.listen(engine, 'before_cursor_execute', self.on_execute)
+
+    def on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.local.count = getattr(self.local, 'count', 0) + 1
+
+    def reset(self):
+        self.local.count = 0
+
+    @property
+    def count(self):
+        return getattr(self.local, 'count', 0)
+
+def reset_database(main):
+    """Drop and recreate every table so each run starts from the same state"""
+    with main.app.app_context():
+        main.db.drop_all()
+    main.init_database()
+
+def seed(main, sales, days, rng):
+    """Give every product plenty of stock and record `sales` past sales"""
+    import checkout
+    from models import db, Product, User
+
+    with main.app.app_context():
+        Product.query.update({Product.stock: 10 ** 9})
+        db.session.commit()
+        products = [(p.id, p.name, p.price) for p in Product.query.all()]
+        cashiers = [u.username for u in User.query.filter_by(role='cashier')]
+        now = datetime.now()
+        for number in range(sales):
+            cart = random_cart(products, rng)
+            sold_at = now - timedelta(days=rng.random() * days)
+            checkout.record_checkout(cart, 10 ** 7, rng.choice(cashiers), sold_at=sold_at)
+            if number % 200 == 199:
+                db.session.commit()
+        db.session.commit()
+        return products
+
+def random_cart(products, rng):
+    """A cart of one to four products"""
+    cart = []
+    for product_id, name, price in rng.sample(products, rng.randint(1, min(4, len(products)))):
+        cart.append({'id': product_id, 'name': name, 'price': price, 'quantity': rng.randint(1, 3)})
+    return cart
+
+def terminal_client(main, user):
+    """Test client with a logged-in session, like a terminal after login"""
+    client = main.app.test_client()
+    with client.session_transaction() as sess:
+        sess['username'] = user.username
+        sess['user_id'] = user.id
+        sess['user_role'] = user.role
+        sess['user_version'] = user.session_version or 0
+    return client
+
+def scenario_requests(name, products, transaction_ids, rng):
+    """Endless stream of (method, path, json) for a scenario"""
+    while True:
+        if name == 'checkout':
+            yield 'POST', '/api/checkout', {'cart_items': random_cart(products, rng), 'payment_amount': 10 ** 7}
+        elif name == 'products':
+            yield 'GET', '/api/products', None
+        elif name == 'sales_history':
+            yield 'GET', '/sales-history', None
+        elif name == 'chart_data':
+            yield 'GET', f"/api/sales-chart-data?type={rng.choice(['daily', 'hourly', 'products'])}", None
+        elif name == 'receipt_pdf':
+            yield 'GET', f"/receipt/pdf/{rng.choice(transaction_ids)}", None
+
+def run_scenario(main, counter, users, name, terminals, requests, products, transaction_ids, seed_value):
+    """Drive one scenario from `terminals` threads; returns its statistics"""
+    latencies = []
+    statements = []
+    errors = [0]
+    lock = threading.Lock()
+    start_barrier = threading.Barrier(terminals + 1)
+
+    def terminal(index):
+        rng = random.Random(f"{seed_value}-{name}-{index}")
+        client = terminal_client(main, users[index % len(users)])
+        stream = scenario_requests(name, products, transaction_ids, rng)
+        own_latencies, own_statements, own_errors = [], [], 0
+        start_barrier.wait()
+        for _ in range(requests):
+            method, path, body = next(stream)
+            counter.reset()
+            started = time.perf_counter()
+            response = client.open(path, method=method, json=body)
+            response.get_data()
+            elapsed = time.perf_counter() - started
+            response.close()
+            own_latencies.append(elapsed)
+            own_statements.append(counter.count)
+            if response.status_code >= 400:
+                own_errors += 1
+        with lock:
+            latencies.extend(own_latencies)
+            statements.extend(own_statements)
+            errors[0] += own_errors
+
+    threads = [threading.Thread(target=terminal, args=(index,)) for index in range(terminals)]
+    for thread in threads:
+        thread.start()
+    start_barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'wall_seconds': round(wall, 3),
+        'throughput_rps': round(len(latencies) / wall, 1) if wall else 0.0,
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'max_ms': round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        'sql_per_request': round(sum(statements) / len(statements), 2) if statements else 0.0,
+    }
+
+def run_single(args):
+    """Benchmark one database in this process and return the results dict"""
+    workdir = tempfile.mkdtemp(prefix='kasir-bench-')
+    atexit.register(shutil.rmtree, workdir, ignore_errors=True)
+    database_url = args.single
+    if database_url == 'sqlite':
+        database_url = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ['DATABASE_URL'] = database_url
+    os.environ['RECEIPTS_DIR'] = os.path.join(workdir, 'receipts')
+    sys.path.insert(0, APP_DIR)
+    logging.disable(logging.INFO)
+
+    import main
+    from models import db, Transaction, User
+
+    rng = random.Random(args.seed)
+    reset_database(main)
+    seed_started = time.perf_counter()
+    products = seed(main, args.seed_sales, args.seed_days, rng)
+    seed_seconds = time.perf_counter() - seed_started
+
+    with main.app.app_context():
+        counter = SqlCounter(db.engine)
+        users = User.query.filter_by(role='cashier', is_active=True).all()
+        for user in users:
+            db.session.expunge(user)
+        transaction_ids = [row.id for row in db.session.query(Transaction.id)
+                           .order_by(Transaction.date.desc()).limit(200)]
+        dialect = db.engine.dialect.name
+
+    results = {}
+    for name in args.scenarios:
+        # One untimed round first so caches and the render pool are warm
+        run_scenario(main, counter, users, name, args.terminals, args.warmup,
+                     products, transaction_ids, args.seed)
+        results[name] = run_scenario(main, counter, users, name, args.terminals, args.requests,
+                                     products, transaction_ids, args.seed)
+    return {
+        'database': dialect,
+        'seed_sales': args.seed_sales,
+        'seed_seconds': round(seed_seconds, 2),
+        'scenarios': results,
+    }
+
+def print_results(results):
+    """Human-readable summary of a results document"""
+    print(f"commit {results['commit']}  terminals {results['terminals']}  "
+          f"requests/terminal {results['requests_per_terminal']}")
+    for run in results['runs']:
+        print(f"\n[{run['database']}] seeded {run['seed_sales']} sales in {run['seed_seconds']}s")
+        print(f"{'scenario':<14}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'sql/req':>9}{'errors':>8}")
+        for name, stats in run['scenarios'].items():
+            print(f"{name:<14}{stats['throughput_rps']:>9}{stats['p50_ms']:>9}{stats['p95_ms']:>9}"
+                  f"{stats['p99_ms']:>9}{stats['sql_per_request']:>9}{stats['errors']:>8}")
+
+def compare(before_path, after_path, threshold):
+    """Print per-metric changes between two result files; returns 1 on regressions"""
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+
+    regressions = 0
+    before_runs = {run['database']: run for run in before['runs']}
+    for run in after['runs']:
+        old_run = before_runs.get(run['database'])
+        if old_run is None:
+            continue
+        print(f"[{run['database']}] {before['commit']} -> {after['commit']}")
+        for name, stats in run['scenarios'].items():
+            old = old_run['scenarios'].get(name)
+            if old is None:
+                continue
+            for metric, higher_is_better in COMPARED_METRICS.items():
+                if not old[metric]:
+                    continue
+                change = (stats[metric] - old[metric]) / old[metric]
+                worse = change < -threshold if higher_is_better else change > threshold
+                regressions += worse
+                print(f"  {name:<14}{metric:<16}{old[metric]:>10} -> {stats[metric]:<10}"
+                      f"{change:+.1%}{'  REGRESSION' if worse else ''}")
+    return 1 if regressions else 0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', action='append',
+                        help="'sqlite' (temporary file) or a database URL; repeatable (default: sqlite)")
+    parser.add_argument('--terminals', type=int, default=10, help='Concurrent simulated terminals')
+    parser.add_argument('--requests', type=int, default=50, help='Measured requests per terminal and scenario')
+    parser.add_argument('--warmup', type=int, default=5, help='Unmeasured requests per terminal and scenario')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--seed-sales', type=int, default=2000, help='Past sales recorded before the run')
+    parser.add_argument('--seed-days', type=int, default=30, help='Days of history the seeded sales span')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'),
+                        help='Compare two result files instead of running')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='Relative change reported as a regression by --compare')
+    parser.add_argument('--single', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        return compare(args.compare[0], args.compare[1], args.threshold)
+
+    if args.single:
+        json.dump(run_single(args), sys.stdout)
+        return 0
+
+    runs = []
+    forwarded = ['--terminals', str(args.terminals), '--requests', str(args.requests),
+                 '--warmup', str(args.warmup), '--seed-sales', str(args.seed_sales),
+                 '--seed-days', str(args.seed_days), '--seed', str(args.seed),
+                 '--scenarios', *args.scenarios]
+    for database in args.database or ['sqlite']:
+        completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--single', database, *forwarded],
+                                   stdout=subprocess.PIPE, check=True)
+        runs.append(json.loads(completed.stdout.decode().strip().splitlines()[-1]))
+
+    results = {
+        'commit': git_commit(),
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'terminals': args.terminals,
+        'requests_per_terminal': args.requests,
+        'runs': runs,
+    }
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
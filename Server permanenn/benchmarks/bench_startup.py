@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Startup time of the app: `import main` and a worker's first request.
+
+Each sample runs in a fresh interpreter, like a newly forked gunicorn worker
+without preload: it imports main, then serves GET /login through the test
+client. Also reports whether ReportLab and NumPy were loaded and how many
+SQL statements ran during the import.
+
+    python benchmarks/bench_startup.py --repeat 10
+    python benchmarks/bench_startup.py --source /tmp/kasir-before --output before.json
+
+--source points at another checkout of this directory (e.g. a git worktree
+of an older commit) to measure before/after on the same machine.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Runs in the child interpreter; prints one JSON line
+SAMPLE = r'''
+import json, sys, time
+started = time.perf_counter()
+import sqlalchemy
+statements = []
+sqlalchemy.event.listen(sqlalchemy.engine.Engine, 'before_cursor_execute',
+                        lambda *args: statements.append(1))
+import_started = time.perf_counter()
+import main
+imported = time.perf_counter()
+client = main.app.test_client()
+status = client.get('/login').status_code
+served = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - import_started) * 1000,
+    'first_request_ms': (served - imported) * 1000,
+    'boot_ms': (served - started) * 1000,
+    'statements': len(statements),
+    'status': status,
+    'reportlab_loaded': 'reportlab' in sys.modules,
+    'numpy_loaded': 'numpy' in sys.modules,
+}))
+'''
+
+INIT = r'''
+import main
+if hasattr(main, 'init_database'):
+    main.init_database()
+'''
+
+def run_child(source, code, env):
+    result = subprocess.run([sys.executable, '-c', code], cwd=source, env=env,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise SystemExit(f"Child process failed:\n{result.stderr[-2000:]}")
+    return result.stdout.strip().splitlines()[-1] if result.stdout.strip() else ''
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', default=APP_DIR, help='App directory to measure (default: this checkout)')
+    parser.add_argument('--repeat', type=int, default=10, help='Fresh interpreters to sample')
+    parser.add_argument('--output', help='Write the results as JSON')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='kasir-startup-')
+    try:
+        env = dict(os.environ, LOG_LEVEL='WARNING', RECEIPTS_DIR=os.path.join(workdir, 'receipts'),
+                   DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+        # The schema exists before timing, as in a deployment after init-db
+        run_child(args.source, INIT, env)
+        samples = [json.loads(run_child(args.source, SAMPLE, env)) for _ in range(args.repeat)]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    summary = {'source': os.path.abspath(args.source), 'repeat': args.repeat}
+    for key in ('import_ms', 'first_request_ms', 'boot_ms'):
+        values = [sample[key] for sample in samples]
+        summary[key] = {'median': round(statistics.median(values), 1), 'min': round(min(values), 1)}
+    for key in ('statements', 'reportlab_loaded', 'numpy_loaded'):
+        summary[key] = samples[-1][key]
+
+    print(f"{'':18}{'median':>10}{'min':>10}")
+    for key in ('import_ms', 'first_request_ms', 'boot_ms'):
+        print(f"{key:18}{summary[key]['median']:>10.1f}{summary[key]['min']:>10.1f}")
+    print(f"SQL statements during boot: {summary['statements']}")
+    print(f"ReportLab loaded: {summary['reportlab_loaded']}, NumPy loaded: {summary['numpy_loaded']}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Benchmark transaction ID generation across processes.
+
+Each forked process generates IDs with its own generator, leasing its worker
+slot as in production, and the parent checks the combined output for
+duplicates, per-process ordering and distinct worker ids. This runs twice:
+without WORKER_ID (host id from the hostname), and with the same WORKER_ID
+in every process, like gunicorn workers forked on one configured host.
+
+    python benchmarks/bench_transaction_ids.py --processes 8 --count 200000
+"""
+import argparse
+import os
+import sys
+import time
+from multiprocessing import Manager, get_context
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+def generate(args):
+    count, barrier = args
+    import transaction_ids
+    generator = transaction_ids.TransactionIdGenerator()
+    generator.next_id()
+    # Hold every lease at once, as long-lived gunicorn workers do
+    barrier.wait()
+    started = time.perf_counter()
+    ids = [generator.next_id() for _ in range(count)]
+    elapsed = time.perf_counter() - started
+    barrier.wait()
+    generator.release()
+    return generator.worker_id, ids, elapsed
+
+def run(processes, count, worker_id):
+    if worker_id is None:
+        os.environ.pop('WORKER_ID', None)
+    else:
+        os.environ['WORKER_ID'] = str(worker_id)
+    barrier = Manager().Barrier(processes)
+    started = time.perf_counter()
+    with get_context('fork').Pool(processes) as pool:
+        results = pool.map(generate, [(count, barrier)] * processes, chunksize=1)
+    wall = time.perf_counter() - started
+
+    all_ids = [transaction_id for _, ids, _ in results for transaction_id in ids]
+    duplicates = len(all_ids) - len(set(all_ids))
+    unordered = sum(1 for _, ids, _ in results if ids != sorted(ids))
+    shared_workers = processes - len({worker for worker, _, _ in results})
+    per_process = [count / elapsed for _, _, elapsed in results]
+
+    print(f"WORKER_ID:            {'unset' if worker_id is None else worker_id}")
+    print(f"processes:            {processes}")
+    print(f"ids generated:        {len(all_ids)}")
+    print(f"duplicates:           {duplicates}")
+    print(f"unsorted processes:   {unordered}")
+    print(f"shared worker ids:    {shared_workers}")
+    print(f"ids/s per process:    {min(per_process):,.0f} - {max(per_process):,.0f}")
+    print(f"ids/s aggregate:      {len(all_ids) / wall:,.0f} (including process startup)")
+    print()
+    return not (duplicates or unordered or shared_workers)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 4)
+    parser.add_argument('--count', type=int, default=100000, help='IDs per process')
+    parser.add_argument('--worker-id', type=int, default=7, help='WORKER_ID shared by the processes in the second run')
+    args = parser.parse_args()
+
+    passed = [run(args.processes, args.count, worker_id) for worker_id in (None, args.worker_id)]
+    return 0 if all(passed) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Compare gunicorn worker classes on the checkout path.
+
+For every worker class, starts gunicorn with gunicorn.conf.py against a
+throwaway database, then logs in `--terminals` HTTP clients that post
+checkouts as fast as they can. Optionally each terminal also keeps a
+catalog event stream open (--streams), as the POS page does. That is
+where the classes differ most: a sync worker is fully occupied by one
+stream. The gevent class needs the optional gevent dependency
+(`uv sync --extra gevent`).
+
+    python benchmarks/bench_workers.py --classes sync gthread gevent --workers 2 --terminals 10
+    python benchmarks/bench_workers.py --streams --output workers.json
+
+Results on a 1-core sandbox (SQLite, 2 workers, --threads 4, 10 terminals x
+30 checkouts; receipt prerendering included, so absolute numbers are low):
+
+    class      streams  requests  errors     rps   p50 ms   p95 ms   p99 ms
+    sync            no       299       1    28.9    135.0    968.9   2496.0
+    gthread         no       300       0    28.4    175.7   1187.8   2724.8
+    gevent          no       300       0    58.6    121.3    391.9    526.3
+    sync           yes         0      30       -        -        -        -
+    gthread        yes       289      11     7.4    153.5   1295.4  14637.1
+    gevent         yes       300       0    41.6    200.3    484.5    655.7
+
+(sync with streams: 3 checkouts per terminal, all timed out.) Ten open
+streams take every sync worker and 8 of 8 gthread threads, so checkouts
+queue behind them. gunicorn.conf.py therefore sizes gthread workers to
+POS_TERMINALS + 4 threads by default; the same runs with that default
+(14 threads):
+
+    class      streams  requests  errors     rps   p50 ms   p95 ms   p99 ms
+    gthread         no       300       0    31.2    224.6    927.0   1084.4
+    gthread        yes       300       0    31.0    257.4    704.1    883.8
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_pos import percentile
+
+CASHIER = ('Haris', '110405')
+
+SEED_STOCK = r'''
+import main
+from models import db, Product
+main.init_database()
+with main.app.app_context():
+    Product.query.update({Product.stock: 10 ** 9})
+    db.session.commit()
+    print(__import__('json').dumps([[p.id, p.name, p.price] for p in Product.query.all()]))
+'''
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_server(worker_class, args, env, port):
+    env = dict(env, PORT=str(port), GUNICORN_WORKER_CLASS=worker_class,
+               WEB_CONCURRENCY=str(args.workers), POS_TERMINALS=str(args.terminals))
+    if args.threads:
+        env['GUNICORN_THREADS'] = str(args.threads)
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}',
+                                '--access-logfile', os.devnull],
+                               cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/login', timeout=1).read()
+            return process
+        except (urllib.error.URLError, ConnectionError, socket.timeout):
+            if process.poll() is not None:
+                raise SystemExit(f"gunicorn ({worker_class}) exited:\n{process.stderr.read().decode()[-2000:]}")
+            time.sleep(0.2)
+    process.kill()
+    raise SystemExit(f"gunicorn ({worker_class}) did not start within 30s")
+
+def stop_server(process):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+def logged_in_opener(base_url):
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    data = urllib.parse.urlencode({'username': CASHIER[0], 'password': CASHIER[1]}).encode()
+    opener.open(f'{base_url}/login', data=data, timeout=30).read()
+    return opener
+
+def hold_stream(opener, base_url, stop):
+    """Keep a catalog event stream open until `stop` is set"""
+    try:
+        response = opener.open(f'{base_url}/api/catalog/stream', timeout=60)
+        while not stop.is_set() and response.readline():
+            pass
+    except (urllib.error.URLError, OSError, ValueError):
+        pass
+
+def run_class(worker_class, args, env, products):
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    server = start_server(worker_class, args, env, port)
+    stop = threading.Event()
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    try:
+        openers = [logged_in_opener(base_url) for _ in range(args.terminals)]
+        if args.streams:
+            for opener in openers:
+                threading.Thread(target=hold_stream, args=(opener, base_url, stop), daemon=True).start()
+            time.sleep(1)
+
+        def terminal(index):
+            rng = random.Random(index)
+            own, failed = [], 0
+            for _ in range(args.requests):
+                cart = [{'id': p[0], 'name': p[1], 'price': p[2], 'quantity': rng.randint(1, 3)}
+                        for p in rng.sample(products, rng.randint(1, 4))]
+                body = json.dumps({'cart_items': cart, 'payment_amount': 10 ** 7}).encode()
+                request = urllib.request.Request(f'{base_url}/api/checkout', data=body,
+                                                 headers={'Content-Type': 'application/json'})
+                started = time.perf_counter()
+                try:
+                    openers[index].open(request, timeout=args.request_timeout).read()
+                    own.append(time.perf_counter() - started)
+                except (urllib.error.URLError, ConnectionError, socket.timeout):
+                    failed += 1
+            with lock:
+                latencies.extend(own)
+                errors[0] += failed
+
+        threads = [threading.Thread(target=terminal, args=(index,)) for index in range(args.terminals)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+    finally:
+        stop.set()
+        stop_server(server)
+
+    latencies.sort()
+    return {
+        'worker_class': worker_class,
+        'streams': args.streams,
+        'requests': len(latencies),
+        'errors': errors[0],
+        'throughput_rps': round(len(latencies) / wall, 1) if wall else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--classes', nargs='+', default=['sync', 'gthread', 'gevent'])
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, help='Threads per gthread worker (default: gunicorn.conf.py, from --terminals)')
+    parser.add_argument('--terminals', type=int, default=10)
+    parser.add_argument('--requests', type=int, default=30, help='Checkouts per terminal')
+    parser.add_argument('--streams', action='store_true', help='Hold a catalog event stream per terminal')
+    parser.add_argument('--request-timeout', type=float, default=15)
+    parser.add_argument('--database', help='Database URL (default: a temporary SQLite file)')
+    parser.add_argument('--output', help='Write the results as JSON')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='kasir-workers-')
+    try:
+        env = dict(os.environ, LOG_LEVEL='WARNING', RECEIPTS_DIR=os.path.join(workdir, 'receipts'),
+                   DATABASE_URL=args.database or f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+                   CATALOG_STREAM_SECONDS='3600')
+        seeded = subprocess.run([sys.executable, '-c', SEED_STOCK], cwd=APP_DIR, env=env,
+                                capture_output=True, text=True, check=True)
+        products = json.loads(seeded.stdout.strip().splitlines()[-1])
+        results = [run_class(worker_class, args, env, products) for worker_class in args.classes]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{'class':10}{'streams':>8}{'requests':>10}{'errors':>8}{'rps':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for row in results:
+        print(f"{row['worker_class']:10}{'yes' if row['streams'] else 'no':>8}{row['requests']:>10}{row['errors']:>8}"
+              f"{row['throughput_rps']:>8}{row['p50_ms']:>9}{row['p95_ms']:>9}{row['p99_ms']:>9}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'workers': args.workers, 'threads': args.threads, 'terminals': args.terminals,
+                       'results': results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
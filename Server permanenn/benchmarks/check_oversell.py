@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Concurrency check: parallel checkouts of the last unit never oversell.
+
+Sets the stock of `--rounds` products to 1, then for each product fires
+`--terminals` checkouts of one unit at the same moment (a barrier releases
+them together), spread over `--processes` processes like gunicorn workers.
+Passes when every round has exactly one successful checkout, every other
+terminal got "Stok ... tidak mencukupi", the stock ends at 0 and exactly one
+transaction item was recorded per product.
+
+    python benchmarks/check_oversell.py --terminals 20 --processes 4
+    python benchmarks/check_oversell.py --no-queue                   # SQLite without the write queue
+    python benchmarks/check_oversell.py --database postgresql://...  # a scratch database
+
+Result in this sandbox (SQLite, 20 terminals, 4 processes, 5 rounds), with
+and without --no-queue: 5 of 5 rounds with 1 sale and 19 conflicts, final
+stock 0, one transaction item per product.
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+def configure(args, database_url, receipts_dir):
+    os.environ.update(DATABASE_URL=database_url, RECEIPTS_DIR=receipts_dir, LOG_LEVEL='WARNING',
+                      RECEIPT_RENDER_WORKERS='0', SQLITE_WRITE_QUEUE='0' if args.no_queue else '1')
+    sys.path.insert(0, APP_DIR)
+
+def run_process(index, args, database_url, receipts_dir, products, barrier, queue):
+    configure(args, database_url, receipts_dir)
+    import main
+    from models import User
+
+    with main.app.app_context():
+        cashier = User.query.filter_by(role='cashier').first()
+        user = (cashier.username, cashier.id, cashier.role, cashier.session_version or 0)
+
+    outcomes = []
+    lock = threading.Lock()
+
+    def terminal():
+        client = main.app.test_client()
+        with client.session_transaction() as sess:
+            sess['username'], sess['user_id'], sess['user_role'], sess['user_version'] = user
+        for product_id, name, price in products:
+            cart = [{'id': product_id, 'name': name, 'price': price, 'quantity': 1}]
+            barrier.wait()
+            response = client.post('/api/checkout', json={'cart_items': cart, 'payment_amount': price})
+            message = (response.get_json(silent=True) or {}).get('message', '')
+            with lock:
+                outcomes.append((product_id, response.status_code, message))
+
+    threads = [threading.Thread(target=terminal)
+               for number in range(args.terminals) if number % args.processes == index]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    queue.put(outcomes)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--terminals', type=int, default=20)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--rounds', type=int, default=5, help='Products sold out one after the other')
+    parser.add_argument('--no-queue', action='store_true', help='Write from request threads (SQLITE_WRITE_QUEUE=0)')
+    parser.add_argument('--database', help='Database URL (default: a temporary SQLite file)')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='kasir-oversell-')
+    try:
+        database_url = args.database or f"sqlite:///{os.path.join(workdir, 'oversell.db')}"
+        receipts_dir = os.path.join(workdir, 'receipts')
+        configure(args, database_url, receipts_dir)
+        import main as app_main
+        from models import db, Product, TransactionItem
+        app_main.init_database()
+        with app_main.app.app_context():
+            chosen = Product.query.order_by(Product.id).limit(args.rounds).all()
+            if len(chosen) < args.rounds:
+                raise SystemExit(f"Only {len(chosen)} products to sell out")
+            products = [(p.id, p.name, p.price) for p in chosen]
+            ids = [p[0] for p in products]
+            Product.query.filter(Product.id.in_(ids)).update({Product.stock: 1})
+            db.session.commit()
+            items_before = {product_id: TransactionItem.query.filter_by(product_id=product_id).count()
+                            for product_id in ids}
+
+        context = multiprocessing.get_context('spawn')
+        manager = context.Manager()
+        barrier = manager.Barrier(args.terminals)
+        queue = context.Queue()
+        processes = [context.Process(target=run_process,
+                                     args=(index, args, database_url, receipts_dir, products, barrier, queue))
+                     for index in range(args.processes)]
+        for process in processes:
+            process.start()
+        outcomes = [outcome for _ in processes for outcome in queue.get()]
+        for process in processes:
+            process.join()
+
+        with app_main.app.app_context():
+            db.session.expire_all()
+            stock = {p.id: p.stock for p in Product.query.filter(Product.id.in_(ids))}
+            items = {product_id: TransactionItem.query.filter_by(product_id=product_id).count() - items_before[product_id]
+                     for product_id in ids}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    failed = False
+    for product_id, name, _ in products:
+        statuses = [(status, message) for sold, status, message in outcomes if sold == product_id]
+        sold = sum(1 for status, _ in statuses if status == 200)
+        conflicts = sum(1 for status, message in statuses if status == 400 and 'tidak mencukupi' in message)
+        others = len(statuses) - sold - conflicts
+        ok = sold == 1 and others == 0 and stock[product_id] == 0 and items[product_id] == 1
+        failed = failed or not ok
+        print(f"{name:24} checkouts {len(statuses):3}  sold {sold}  conflicts {conflicts:3}  other {others}  "
+              f"stock {stock[product_id]}  items {items[product_id]}  {'ok' if ok else 'FAIL'}")
+    if failed:
+        raise SystemExit(1)
+    print(f"{len(products)} of {len(products)} rounds with exactly 1 sale, final stock 0")
+
+if __name__ == '__main__':
+    main()
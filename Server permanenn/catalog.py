@@ -0,0 +1,185 @@
+"""
+Versioned product catalog.
+
+Every change to a product (add, edit, delete, stock movement) bumps a single
+catalog version counter and stamps the changed product with it. Terminals
+can then ask for "everything since version N", and each process keeps an
+in-memory snapshot of the full catalog that is rebuilt only when the version
+moves.
+
+Terminals learn about changes by push instead of reloading: wait_for_change()
+blocks until the version moves, and event_stream() turns that into a
+server-sent event stream of changed products. Commits in this process wake
+waiters immediately; changes made by other processes are noticed by reading
+the version row at most every POLL_INTERVAL seconds (shared by all waiters).
+Waiters always learn the version from that row, never from the committing
+session, so a bump undone by a rolled-back savepoint is never announced.
+"""
+import json
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from models import db, Product, CatalogState, CatalogDeletion
+
+# Seconds between reads of the version row while terminals are waiting
+POLL_INTERVAL = 2.0
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+_changed = threading.Condition()
+_read_lock = threading.Lock()
+_latest_version = 0
+_generation = 0     # incremented by every local commit that bumped the version
+_checked_at = 0.0
+
+def current_version():
+    """Current catalog version (0 for an untouched catalog)"""
+    state = db.session.get(CatalogState, 1)
+    return state.version if state else 0
+
+def bump_version():
+    """Increment the catalog version inside the current transaction and return it"""
+    table = CatalogState.__table__
+    result = db.session.execute(
+        table.update().where(table.c.id == 1).values(version=table.c.version + 1)
+    )
+    if result.rowcount == 0:
+        db.session.execute(table.insert().values(id=1, version=1))
+    version = db.session.execute(
+        db.select(table.c.version).where(table.c.id == 1)
+    ).scalar_one()
+    # Wake waiting terminals once the transaction commits
+    db.session.info['catalog_changed'] = True
+    return version
+
+def mark_changed(*products):
+    """Stamp products with a new catalog version; call before committing"""
+    version = bump_version()
+    for product in products:
+        product.catalog_version = version
+    return version
+
+def stamp_changed(product_ids):
+    """Stamp products by id with a new catalog version.
+
+    Call it last, just before committing: the version row is a single hot
+    row, so its lock should be held for as short a time as possible.
+    """
+    version = bump_version()
+    db.session.execute(
+        db.update(Product).where(Product.id.in_(list(product_ids))).values(catalog_version=version)
+        .execution_options(synchronize_session=False)
+    )
+    return version
+
+def mark_deleted(product_id):
+    """Record a tombstone so delta sync can tell terminals to drop a product"""
+    version = bump_version()
+    db.session.merge(CatalogDeletion(product_id=product_id, version=version))
+    return version
+
+class Snapshot:
+    """Immutable view of the whole catalog at one version"""
+
+    def __init__(self, version, products):
+        self.version = version
+        self.products = products
+        self.etag = f'"catalog-{version}"'
+        self.body = json.dumps(products)
+
+    def by_category(self, category):
+        return [p for p in self.products if p['category'] == category]
+
+    def low_stock(self, threshold):
+        return [p for p in self.products if p['stock'] <= threshold]
+
+def get_snapshot():
+    """Full catalog snapshot, rebuilt only when the catalog version changed"""
+    global _snapshot
+    version = current_version()
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+
+    with _snapshot_lock:
+        if _snapshot is None or _snapshot.version != version:
+            products = [p.to_dict() for p in Product.query.order_by(Product.id).all()]
+            _snapshot = Snapshot(version, products)
+        return _snapshot
+
+def changes_since(version):
+    """Products changed and product ids deleted after the given version"""
+    changed = Product.query.filter(Product.catalog_version > version).order_by(Product.id).all()
+    deleted = [row.product_id for row in CatalogDeletion.query.filter(CatalogDeletion.version > version)]
+    return [p.to_dict() for p in changed], deleted
+
+def _wake():
+    global _generation, _checked_at
+    with _changed:
+        _generation += 1
+        _checked_at = 0.0
+        _changed.notify_all()
+
+@event.listens_for(Session, 'after_commit')
+def _after_commit(session):
+    if session.info.pop('catalog_changed', False):
+        _wake()
+
+@event.listens_for(Session, 'after_rollback')
+def _after_rollback(session):
+    session.info.pop('catalog_changed', None)
+
+def latest_version():
+    """Catalog version, read from the database at most every POLL_INTERVAL per process"""
+    global _latest_version, _checked_at
+    with _read_lock:
+        now = time.monotonic()
+        if now - _checked_at >= POLL_INTERVAL:
+            version = current_version()
+            # Don't hold a pooled connection (or an SQLite read snapshot) while waiting
+            db.session.close()
+            _latest_version = max(_latest_version, version)
+            _checked_at = now
+        return _latest_version
+
+def wait_for_change(since, timeout):
+    """Block until the catalog moves past `since` or `timeout` seconds pass.
+
+    Returns the latest known version, which is <= since on timeout.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        generation = _generation
+        version = latest_version()
+        remaining = deadline - time.monotonic()
+        if version > since or remaining <= 0:
+            return version
+        with _changed:
+            if _generation == generation:
+                _changed.wait(min(remaining, POLL_INTERVAL))
+
+def event_stream(since, duration, keepalive=15):
+    """Server-sent events with the products changed after `since`.
+
+    Each event carries the same payload as /api/products?since= and the new
+    version as its id, so a reconnecting EventSource resumes from
+    Last-Event-ID. The stream ends after `duration` seconds to free the
+    worker; browsers reconnect on their own.
+    """
+    yield 'retry: 3000\n\n'
+    deadline = time.monotonic() + duration
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        version = wait_for_change(since, min(keepalive, remaining))
+        if version <= since:
+            yield ': keepalive\n\n'
+            continue
+        products, deleted = changes_since(since)
+        db.session.close()
+        payload = json.dumps({'version': version, 'products': products, 'deleted': deleted})
+        yield f'id: {version}\nevent: catalog\ndata: {payload}\n\n'
+        since = version
@@ -0,0 +1,221 @@
+"""
+Checkout processing shared by the single-sale and batch sync endpoints.
+
+Functions here only stage changes in the current session; callers decide
+when to commit or roll back.
+"""
+import logging
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import case, update, insert
+from sqlalchemy.exc import IntegrityError
+import catalog
+import db_writer
+import rollups
+import transaction_ids
+from models import db, Product, Transaction, TransactionItem, TransactionKey
+
+# Maximum number of queued sales accepted by one batch sync request
+MAX_BATCH_SIZE = 100
+
+class CheckoutError(Exception):
+    """A sale that cannot be recorded.
+
+    status is 'rejected' for invalid input (empty cart, underpayment) and
+    'conflict' when the sale is valid but stock has run out.
+    """
+
+    def __init__(self, message, status='rejected'):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+def calculate_totals(cart_items):
+    """Return (subtotal, discount, total) for a cart"""
+    subtotal = sum(item['price'] * item['quantity'] for item in cart_items)
+    discount = 0
+    if subtotal >= 100000:  # 10% discount for orders >= 100k
+        discount = subtotal * 0.1
+    return subtotal, discount, subtotal - discount
+
+def decrement_stock(quantities):
+    """Atomically subtract {product_id: quantity} from stock in a single UPDATE.
+
+    The WHERE clause only matches products with enough stock, so concurrent
+    checkouts cannot oversell. Returns False (nothing should be committed)
+    when any product is short.
+    """
+    amount = case(quantities, value=Product.id)
+    result = db.session.execute(
+        update(Product)
+        .where(Product.id.in_(list(quantities)), Product.stock >= amount)
+        .values(stock=Product.stock - amount)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == len(quantities)
+
+def record_checkout(cart_items, payment_amount, cashier, sold_at=None, idempotency_key=None):
+    """Stage a sale: stock decrement, transaction, items and rollups.
+
+    Raises CheckoutError when the sale cannot be recorded; the caller must
+    then roll back (stock may already be partially decremented).
+    """
+    if not cart_items:
+        raise CheckoutError('Keranjang kosong')
+
+    subtotal, discount, total = calculate_totals(cart_items)
+    if payment_amount < total:
+        raise CheckoutError('Pembayaran kurang')
+    change = payment_amount - total
+
+    # Load all products in the cart with a single query
+    quantities = {}
+    for cart_item in cart_items:
+        quantities[cart_item['id']] = quantities.get(cart_item['id'], 0) + cart_item['quantity']
+    products = {p.id: p for p in Product.query.filter(Product.id.in_(list(quantities))).all()}
+
+    if any(product_id not in products for product_id in quantities):
+        raise CheckoutError('Produk tidak ditemukan')
+
+    # Decrement stock for every product in one guarded statement
+    if not decrement_stock(quantities):
+        short = next((p for p in products.values() if p.stock < quantities[p.id]), None)
+        name = short.name if short else 'produk'
+        raise CheckoutError(f'Stok {name} tidak mencukupi', status='conflict')
+
+    # Create transaction record
+    sold_at = sold_at or datetime.now()
+    transaction_id = transaction_ids.next_id()
+    receipt_number = None
+    if current_app.config.get("OUTLET_CODE"):
+        receipt_number = transaction_ids.next_receipt_number(current_app.config["OUTLET_CODE"], sold_at.date())
+
+    # The unique indexes of the partitioned transactions table only cover one
+    # month; this unpartitioned table keeps the keys unique across all of them
+    if receipt_number or idempotency_key:
+        db.session.execute(insert(TransactionKey).values(
+            transaction_id=transaction_id, idempotency_key=idempotency_key, receipt_number=receipt_number))
+
+    new_transaction = Transaction(
+        id=transaction_id,
+        date=sold_at,
+        cashier=cashier,
+        receipt_number=receipt_number,
+        idempotency_key=idempotency_key,
+        subtotal=subtotal,
+        discount=discount,
+        total=total,
+        payment=payment_amount,
+        change=change
+    )
+    db.session.add(new_transaction)
+    db.session.flush()
+
+    # Insert all transaction items in one executemany
+    item_rows = [{
+        'transaction_id': transaction_id,
+        'product_id': cart_item['id'],
+        'product_name': cart_item['name'],
+        'category': products[cart_item['id']].category,
+        'price': cart_item['price'],
+        'quantity': cart_item['quantity'],
+        'subtotal': cart_item['price'] * cart_item['quantity']
+    } for cart_item in cart_items]
+    db.session.execute(insert(TransactionItem), item_rows)
+
+    # Update dashboard rollups in the same database transaction
+    rollups.record_sale(new_transaction, item_rows)
+
+    # Bump the catalog version last: its row is shared by every checkout, so
+    # taking it after the stock locks keeps sales of other products parallel
+    catalog.stamp_changed(quantities)
+
+    # Receipt data for the background renderer, built without reloading the sale
+    receipt = new_transaction.to_dict(items=[])
+    receipt['items'] = [dict(row, id=None) for row in item_rows]
+
+    return {
+        'transaction_id': transaction_id,
+        'receipt_number': receipt_number,
+        'total': total,
+        'payment': payment_amount,
+        'change': change,
+        'receipt': receipt
+    }
+
+def parse_sold_at(value):
+    """Parse a client ISO timestamp into naive local time, never in the future"""
+    if not value:
+        return None
+    sold_at = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if sold_at.tzinfo is not None:
+        sold_at = sold_at.astimezone().replace(tzinfo=None)
+    return min(sold_at, datetime.now())
+
+def record_batch(sales, cashier):
+    """Apply queued offline sales in one database transaction.
+
+    Each sale runs in its own savepoint, so a conflict only discards that
+    sale. Sales whose idempotency key was already recorded, even in an
+    archived month, are reported as 'duplicate' with the original
+    transaction id. Every sale carries the cashier who rang it up; a sale of
+    another cashier than the logged-in one is reported as 'wrong_cashier'
+    and left for that cashier's next login, so a shared terminal never books
+    sales under the wrong name. Returns (results, receipts): one result dict
+    per sale, in order, and the receipt data of the sales that were created.
+    The caller commits (see db_writer.run).
+    """
+    keys = [sale.get('idempotency_key') for sale in sales if sale.get('idempotency_key')]
+    recorded = dict(db.session.query(TransactionKey.idempotency_key, TransactionKey.transaction_id).filter(
+        TransactionKey.idempotency_key.in_(keys)
+    ).all()) if keys else {}
+
+    db_writer.begin_immediate(db.session)
+    results = []
+    receipts = []
+    for sale in sales:
+        key = sale.get('idempotency_key')
+        if not key:
+            results.append({'idempotency_key': None, 'status': 'rejected', 'message': 'Idempotency key wajib diisi'})
+            continue
+        if key in recorded:
+            results.append({'idempotency_key': key, 'status': 'duplicate', 'transaction_id': recorded[key]})
+            continue
+        if not sale.get('cashier'):
+            results.append({'idempotency_key': key, 'status': 'rejected', 'message': 'Kasir transaksi tidak diketahui'})
+            continue
+        if sale['cashier'] != cashier:
+            results.append({'idempotency_key': key, 'status': 'wrong_cashier', 'cashier': sale['cashier'],
+                            'message': f"Transaksi milik kasir {sale['cashier']}"})
+            continue
+
+        savepoint = db.session.begin_nested()
+        try:
+            result = record_checkout(
+                sale.get('cart_items', []),
+                sale.get('payment_amount', 0),
+                cashier,
+                sold_at=parse_sold_at(sale.get('created_at')),
+                idempotency_key=key
+            )
+            savepoint.commit()
+            recorded[key] = result['transaction_id']
+            receipts.append(result.pop('receipt'))
+            results.append(dict(result, idempotency_key=key, status='created'))
+        except CheckoutError as e:
+            savepoint.rollback()
+            results.append({'idempotency_key': key, 'status': e.status, 'message': e.message})
+        except (KeyError, TypeError, ValueError):
+            savepoint.rollback()
+            results.append({'idempotency_key': key, 'status': 'rejected', 'message': 'Data transaksi tidak valid'})
+        except IntegrityError:
+            # Another request recorded the same key concurrently
+            savepoint.rollback()
+            existing = TransactionKey.query.filter_by(idempotency_key=key).first()
+            if existing:
+                results.append({'idempotency_key': key, 'status': 'duplicate', 'transaction_id': existing.transaction_id})
+            else:
+                logging.error(f"Batch checkout integrity error for {key}")
+                results.append({'idempotency_key': key, 'status': 'error', 'message': 'Terjadi kesalahan sistem'})
+
+    return results, receipts
@@ -0,0 +1,8 @@
+"""
+Rupiah formatting shared by the web pages, the PDF receipt and the thermal
+receipt. It imports neither Flask nor ReportLab, so every renderer can use it.
+"""
+
+def format_currency(amount):
+    """Format currency to Indonesian Rupiah format, e.g. Rp 12.500"""
+    return f"Rp {amount:,.0f}".replace(",", ".")
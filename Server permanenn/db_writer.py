@@ -0,0 +1,159 @@
+"""
+SQLite multi-terminal mode: connection tuning and a serialized write queue.
+
+SQLite allows one writer at a time. With the default rollback journal and
+no busy timeout, two terminals checking out at once fail with "database is
+locked". Worse, a transaction that reads before it writes cannot take the
+write lock once another writer has committed, however long it waits. So on
+SQLite:
+
+* every connection runs in WAL mode (readers never block the writer or each
+  other) with synchronous=NORMAL, a busy timeout and memory-mapped reads;
+* writes go through run(), which hands them to one writer thread per
+  process. The writer takes the lock up front (BEGIN IMMEDIATE), applies
+  whatever jobs are queued in one transaction (each in its own savepoint,
+  so a failing job only discards itself) and commits once.
+
+Reads stay in the request threads and run concurrently. Several gunicorn
+workers still mean one writer per process; those wait for each other
+through the busy timeout, which is safe since every write begins
+immediately.
+
+On other databases, or with SQLITE_WRITE_QUEUE=0, run() executes the job
+in the caller's session and commits it.
+"""
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from sqlalchemy import event
+from models import db
+
+BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+
+# Jobs applied per transaction, and how long a caller waits for its job
+MAX_BATCH = 64
+WRITE_TIMEOUT = float(os.environ.get('SQLITE_WRITE_TIMEOUT', 30))
+
+_writer = None
+
+def _tune_connection(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+        cursor.execute(f'PRAGMA mmap_size={MMAP_SIZE}')
+    finally:
+        cursor.close()
+
+def begin_immediate(session):
+    """Open the session's transaction with BEGIN IMMEDIATE on SQLite.
+
+    pysqlite only emits BEGIN before DML, so a SAVEPOINT issued first would
+    start its own transaction and its RELEASE would commit it. BEGIN
+    IMMEDIATE also takes the write lock up front, avoiding lock-upgrade
+    failures with concurrent writers.
+    """
+    connection = session.connection()
+    if connection.dialect.name == 'sqlite' and not connection.connection.dbapi_connection.in_transaction:
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+
+class WriteQueue:
+    """One thread applying queued write jobs in batched transactions"""
+
+    def __init__(self, app, max_batch=MAX_BATCH):
+        self.app = app
+        self.max_batch = max_batch
+        self.jobs = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def _ensure_thread(self):
+        # Started on first use, so each forked worker gets its own thread
+        if self.thread is None or not self.thread.is_alive():
+            with self.lock:
+                if self.thread is None or not self.thread.is_alive():
+                    self.thread = threading.Thread(target=self._loop, name='db-writer', daemon=True)
+                    self.thread.start()
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue fn(*args, **kwargs) and return a Future with its result"""
+        future = Future()
+        self._ensure_thread()
+        self.jobs.put((future, fn, args, kwargs))
+        return future
+
+    def _loop(self):
+        with self.app.app_context():
+            while True:
+                jobs = [self.jobs.get()]
+                while len(jobs) < self.max_batch:
+                    try:
+                        jobs.append(self.jobs.get_nowait())
+                    except queue.Empty:
+                        break
+                self._apply(jobs)
+
+    def _apply(self, jobs):
+        session = db.session
+        outcomes = []
+        try:
+            begin_immediate(session)
+            for future, fn, args, kwargs in jobs:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                savepoint = session.begin_nested()
+                try:
+                    outcomes.append((future, True, fn(*args, **kwargs)))
+                    savepoint.commit()
+                except Exception as e:
+                    savepoint.rollback()
+                    outcomes.append((future, False, e))
+            session.commit()
+        except Exception as e:
+            # The whole batch is lost (lock timeout, disk full): every job fails
+            logging.error(f"Write batch of {len(jobs)} jobs failed: {str(e)}")
+            session.rollback()
+            errors = {future: value for future, ok, value in outcomes if not ok}
+            outcomes = [(future, False, errors.get(future, e)) for future, _, _, _ in jobs if not future.cancelled()]
+        finally:
+            session.close()
+
+        for future, ok, value in outcomes:
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+def init_app(app):
+    """Tune SQLite connections and start queueing writes (no-op on other databases)"""
+    global _writer
+    with app.app_context():
+        engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        return
+    event.listen(engine, 'connect', _tune_connection)
+    if os.environ.get('SQLITE_WRITE_QUEUE', '1') == '1':
+        _writer = WriteQueue(app)
+
+def run(fn, *args, **kwargs):
+    """Apply a write job and return its result, re-raising its exception.
+
+    The job stages changes in db.session and must not commit. It may run in
+    another thread: pass it plain values, not request state or ORM objects
+    loaded by the caller, and return plain data.
+    """
+    if _writer is not None:
+        return _writer.submit(fn, *args, **kwargs).result(timeout=WRITE_TIMEOUT)
+
+    begin_immediate(db.session)
+    try:
+        result = fn(*args, **kwargs)
+        db.session.commit()
+        return result
+    except Exception:
+        db.session.rollback()
+        raise
@@ -0,0 +1,130 @@
+"""
+Streaming export of the transaction history as CSV or NDJSON.
+
+Rows are read from `transactions` joined with `transaction_items` through a
+server-side cursor and written out chunk by chunk, so memory use stays
+constant regardless of how much history is exported. Months moved to the
+sales archive (sales_archive.py) are streamed from there and merged in by
+date, so an export covers the whole range either way.
+"""
+import csv
+import heapq
+import io
+import json
+import zlib
+from collections import namedtuple
+from itertools import groupby
+from sqlalchemy import select
+from models import db, Transaction, TransactionItem
+
+FORMATS = ('csv', 'ndjson')
+
+# Rows fetched from the database per round trip
+FETCH_SIZE = 1000
+
+# Approximate size of each chunk handed to the response/file
+CHUNK_SIZE = 64 * 1024
+
+CSV_COLUMNS = [
+    'transaction_id', 'date', 'cashier', 'subtotal', 'discount', 'total', 'payment', 'change',
+    'product_id', 'product_name', 'price', 'quantity', 'item_subtotal'
+]
+
+TRANSACTION_FIELDS = ['id', 'date', 'cashier', 'subtotal', 'discount', 'total', 'payment', 'change']
+ITEM_FIELDS = ['product_id', 'product_name', 'price', 'quantity', 'item_subtotal']
+
+# Shape of the joined rows, for rows read from the archive
+ExportRow = namedtuple('ExportRow', TRANSACTION_FIELDS + ITEM_FIELDS)
+
+def _rows(start=None, end=None):
+    """Stream joined transaction/item rows in the half-open range [start, end)"""
+    stmt = select(
+        Transaction.id, Transaction.date, Transaction.cashier, Transaction.subtotal,
+        Transaction.discount, Transaction.total, Transaction.payment, Transaction.change,
+        TransactionItem.product_id, TransactionItem.product_name, TransactionItem.price,
+        TransactionItem.quantity, TransactionItem.subtotal.label('item_subtotal')
+    ).join(TransactionItem, TransactionItem.transaction_id == Transaction.id)
+    if start:
+        stmt = stmt.where(Transaction.date >= start)
+    if end:
+        stmt = stmt.where(Transaction.date < end)
+    stmt = stmt.order_by(Transaction.date, Transaction.id, TransactionItem.id)
+
+    result = db.session.execute(stmt.execution_options(stream_results=True, yield_per=FETCH_SIZE))
+    try:
+        for row in result:
+            yield row
+    finally:
+        result.close()
+
+def _archived_rows(archive, start=None, end=None):
+    """Joined rows of the archived transactions in [start, end)"""
+    for transaction in archive.iter_sales(start, end):
+        values = transaction.values
+        for item in transaction.items:
+            yield ExportRow(values['id'], transaction.date, values['cashier'], values['subtotal'],
+                            values['discount'], values['total'], values['payment'], values['change'],
+                            item['product_id'], item['product_name'], item['price'], item['quantity'],
+                            item['subtotal'])
+
+def _all_rows(start=None, end=None, archive=None):
+    """Live and archived rows merged in (date, id) order"""
+    if archive is None:
+        return _rows(start, end)
+    return heapq.merge(_archived_rows(archive, start, end), _rows(start, end), key=lambda row: (row.date, row.id))
+
+def _csv_lines(rows):
+    """One CSV row per transaction item"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    for row in rows:
+        writer.writerow([row.date.isoformat() if name == 'date' else value
+                         for name, value in zip(CSV_COLUMNS, row)])
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def _ndjson_lines(rows):
+    """One JSON object per transaction, with its items nested"""
+    chunk = []
+    size = 0
+    for transaction_id, group in groupby(rows, key=lambda row: row.id):
+        items = list(group)
+        first = items[0]
+        record = dict(zip(TRANSACTION_FIELDS, first[:8]))
+        record['date'] = first.date.isoformat()
+        record['items'] = [dict(zip(ITEM_FIELDS, item[8:])) for item in items]
+        line = json.dumps(record) + '\n'
+        chunk.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+            size = 0
+    yield ''.join(chunk)
+
+def _gzip(chunks):
+    """Compress a stream of bytes chunks into a gzip stream"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 writes a gzip header
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def export_transactions(fmt='csv', start=None, end=None, compress=False, archive=None):
+    """Generate the export as a stream of bytes chunks; archive is the sales ArchiveStore"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+
+    rows = _all_rows(start, end, archive)
+    lines = _csv_lines(rows) if fmt == 'csv' else _ndjson_lines(rows)
+    chunks = (text.encode('utf-8') for text in lines if text)
+    return _gzip(chunks) if compress else chunks
+
+def content_type(fmt):
+    """MIME type of an export format"""
+    return 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
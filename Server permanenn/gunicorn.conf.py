@@ -0,0 +1,85 @@
+"""
+Production gunicorn profile, loaded automatically when gunicorn is started
+from this directory:
+
+    flask --app main init-db        # once per deployment
+    gunicorn                        # reads this file
+
+Defaults suit the POS workload: short database-bound requests plus one
+long-lived catalog event stream per terminal. Threaded workers (gthread)
+keep those streams from pinning whole processes, and their heartbeat runs
+apart from request threads, so a stream is not killed by `timeout`. Each
+open stream still holds one thread, and nothing spreads the streams evenly
+over the workers, so every worker gets a thread per expected terminal
+(POS_TERMINALS) plus REQUEST_THREADS for ordinary requests. With the sync
+class every open stream occupies a worker; use gthread or gevent.
+
+Environment:
+    PORT                    listen port (default 5000)
+    WEB_CONCURRENCY         worker processes (default 2 x cores + 1)
+    GUNICORN_WORKER_CLASS   gthread (default), sync or gevent (an optional
+                            dependency: `uv sync --extra gevent` or
+                            `pip install '.[gevent]'`)
+    POS_TERMINALS           POS terminals with an open catalog stream
+                            (default 10)
+    GUNICORN_THREADS        threads per gthread worker (default
+                            POS_TERMINALS + 4)
+    GUNICORN_PRELOAD        "0" to import the app in each worker instead
+                            of once in the master (gevent never preloads)
+    GUNICORN_TIMEOUT        seconds before a silent worker is restarted
+
+Streams release their database connection while they wait, so size the
+database pool (DB_POOL_SIZE / DB_MAX_OVERFLOW in main.py) to the request
+threads, not to GUNICORN_THREADS: each worker has its own pool, so the
+database sees up to workers x (pool size + overflow) connections.
+
+benchmarks/bench_workers.py compares the worker classes on the checkout
+path. With this file's defaults (gthread, 14 threads) on a 1-core sandbox,
+SQLite, 2 workers and 10 terminals each holding a stream: 300 of 300
+checkouts, 0 errors, 31 rps, p99 884 ms (4 threads: 11 errors, p99 14.6 s).
+"""
+import multiprocessing
+import os
+
+wsgi_app = 'main:wsgi_application()'
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+# Threads for ordinary requests, on top of one per terminal's catalog stream
+REQUEST_THREADS = 4
+terminals = int(os.environ.get('POS_TERMINALS', 10))
+threads = int(os.environ.get('GUNICORN_THREADS', terminals + REQUEST_THREADS))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 200))
+
+# Import the app (Flask, SQLAlchemy, models) once in the master and fork;
+# importing main does no database I/O (see main.wsgi_application). gevent must
+# patch the standard library before the app is imported, so it never preloads.
+preload_app = worker_class != 'gevent' and os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers now and then to bound memory growth (analytics columns, caches)
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 5000))
+max_requests_jitter = max_requests // 10
+
+accesslog = '-'
+loglevel = os.environ.get('LOG_LEVEL', 'info').lower()
+
+def post_fork(server, worker):
+    """Drop connections inherited from the master.
+
+    With preload_app the engine (and, if anything touched the database
+    before forking, its pooled connections) is created in the master. A
+    socket shared by two processes corrupts both sessions, so each worker
+    discards the inherited pool without closing the master's connections
+    and opens its own.
+    """
+    from main import app
+    from models import db
+
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
@@ -0,0 +1,241 @@
+"""
+Bulk product import and stock receiving from CSV.
+
+A CSV with the columns name, category, price, stock_delta and optionally
+sku is validated against the current catalog into a plan: one entry per
+row with the before/after values and any errors. The plan is shown as a
+preview, and applying it re-validates against the database and writes the
+rows with set-based upserts keyed on the product name (one statement per
+thousand rows), in one transaction. An import with errors is never
+partially applied.
+
+For existing products an empty category, price or sku keeps the current
+value; new products need a category and a price, the SKU/barcode is
+optional. A SKU may not be used twice in the file or by another product.
+stock_delta is added to the current stock (it may be negative to write
+off stock, but stock can never drop below zero).
+"""
+import csv
+import io
+from datetime import datetime
+from sqlalchemy import case
+from models import db, Product
+import catalog
+import product_search
+
+COLUMNS = ('name', 'category', 'price', 'stock_delta', 'sku')
+
+# Accepted alternative header names
+HEADER_ALIASES = {'stock': 'stock_delta', 'delta': 'stock_delta', 'qty': 'stock_delta', 'barcode': 'sku'}
+
+MAX_ROWS = 5000
+
+# Rows per INSERT statement (SQLite allows at most 32766 bound parameters)
+UPSERT_CHUNK_SIZE = 1000
+
+class ImportFileError(Exception):
+    """The file itself cannot be read (as opposed to errors in single rows)"""
+
+class ImportConflict(Exception):
+    """Stock changed between validation and the upsert"""
+
+def parse_csv(text):
+    """Parse CSV text into a list of (line number, {column: value}) pairs"""
+    reader = csv.reader(io.StringIO(text.lstrip('\ufeff')))
+    try:
+        header = next(reader)
+    except StopIteration:
+        raise ImportFileError('File CSV kosong')
+
+    columns = [HEADER_ALIASES.get(name.strip().lower(), name.strip().lower()) for name in header]
+    missing = [column for column in ('name', 'stock_delta') if column not in columns]
+    if missing:
+        raise ImportFileError(f"Kolom wajib tidak ada: {', '.join(missing)}")
+
+    rows = []
+    for values in reader:
+        if not any(value.strip() for value in values):
+            continue
+        if len(rows) >= MAX_ROWS:
+            raise ImportFileError(f'Maksimal {MAX_ROWS} baris per import')
+        record = {column: value.strip() for column, value in zip(columns, values) if column in COLUMNS}
+        rows.append((reader.line_num, record))
+    return rows
+
+def plan_import(rows, valid_categories):
+    """Validate parsed rows against the catalog.
+
+    Returns a list of dicts with line, name, action ('create', 'update' or
+    'error'), errors and the before/after category, price and stock.
+    """
+    names = {record.get('name', '') for _, record in rows}
+    existing = {p.name: p for p in Product.query.filter(Product.name.in_(names)).all()} if names else {}
+    skus = {product_search.normalize_sku(record.get('sku')) for _, record in rows} - {None}
+    sku_owners = dict(db.session.query(Product.sku, Product.name).filter(Product.sku.in_(skus)).all()) if skus else {}
+
+    plan = []
+    seen = {}
+    seen_skus = {}
+    for line, record in rows:
+        name = record.get('name', '')
+        product = existing.get(name)
+        errors = []
+        entry = {
+            'line': line,
+            'name': name,
+            'product_id': product.id if product else None,
+            'category_before': product.category if product else None,
+            'price_before': product.price if product else None,
+            'stock_before': product.stock if product else 0,
+            'sku_before': product.sku if product else None,
+        }
+
+        if not name:
+            errors.append('Nama produk tidak boleh kosong')
+        elif len(name) > Product.__table__.c.name.type.length:
+            errors.append('Nama produk terlalu panjang')
+        elif name in seen:
+            errors.append(f'Nama produk duplikat (baris {seen[name]})')
+        else:
+            seen[name] = line
+
+        category = record.get('category', '').lower()
+        if category and category not in valid_categories:
+            errors.append(f"Kategori tidak valid: {record['category']}")
+        elif not category and not product:
+            errors.append('Kategori wajib untuk produk baru')
+
+        price = None
+        if record.get('price'):
+            try:
+                price = float(record['price'])
+                if price <= 0:
+                    errors.append('Harga harus lebih dari 0')
+            except ValueError:
+                errors.append(f"Harga tidak valid: {record['price']}")
+        elif not product:
+            errors.append('Harga wajib untuk produk baru')
+
+        sku = product_search.normalize_sku(record.get('sku'))
+        if sku and len(sku) > product_search.SKU_MAX_LENGTH:
+            errors.append('SKU/barcode terlalu panjang')
+        elif sku and sku in seen_skus:
+            errors.append(f'SKU/barcode duplikat (baris {seen_skus[sku]})')
+        elif sku and sku_owners.get(sku, name) != name:
+            errors.append(f'SKU/barcode sudah dipakai produk {sku_owners[sku]}')
+        if sku:
+            seen_skus.setdefault(sku, line)
+
+        delta = 0
+        try:
+            delta = int(record.get('stock_delta') or 0)
+        except ValueError:
+            errors.append(f"Jumlah stok tidak valid: {record.get('stock_delta')}")
+        if entry['stock_before'] + delta < 0:
+            errors.append(f"Stok tidak boleh negatif (stok sekarang {entry['stock_before']})")
+
+        entry.update({
+            'category': category or entry['category_before'],
+            'price': price if price is not None else entry['price_before'],
+            'sku': sku or entry['sku_before'],
+            'stock_delta': delta,
+            'stock': entry['stock_before'] + delta,
+            'errors': errors,
+            'action': 'error' if errors else ('update' if product else 'create'),
+        })
+        plan.append(entry)
+    return plan
+
+def summarize(plan):
+    """Counts of rows per action"""
+    counts = {'create': 0, 'update': 0, 'error': 0}
+    for entry in plan:
+        counts[entry['action']] += 1
+    return counts
+
+def _upsert_statement(dialect, rows, version, now):
+    """INSERT ... ON CONFLICT (name) DO UPDATE for a chunk of rows"""
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        from sqlalchemy.dialects.postgresql import insert
+
+    table = Product.__table__
+    stmt = insert(table).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=['name'],
+        set_={
+            'category': stmt.excluded.category,
+            'price': stmt.excluded.price,
+            'sku': stmt.excluded.sku,
+            # stock in the inserted row is the delta
+            'stock': table.c.stock + stmt.excluded.stock,
+            'catalog_version': version,
+            'updated_at': now,
+        },
+        where=table.c.stock + stmt.excluded.stock >= 0
+    ).returning(table.c.id)
+
+def apply_import(plan):
+    """Write a validated plan in the current transaction; the caller commits.
+
+    Raises ValueError if the plan has errors and ImportConflict if stock
+    changed so that a product would go negative.
+    """
+    if any(entry['errors'] for entry in plan):
+        raise ValueError('Import has errors')
+    if not plan:
+        return 0
+
+    version = catalog.bump_version()
+    now = datetime.utcnow()
+    rows = [{
+        'name': entry['name'],
+        'category': entry['category'],
+        'price': entry['price'],
+        'sku': entry['sku'],
+        'stock': entry['stock_delta'],
+        'catalog_version': version,
+        'created_at': now,
+        'updated_at': now,
+    } for entry in plan]
+
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        written = []
+        for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+            chunk = rows[start:start + UPSERT_CHUNK_SIZE]
+            written.extend(db.session.execute(_upsert_statement(dialect, chunk, version, now)).fetchall())
+        if len(written) != len(rows):
+            raise ImportConflict('Stok berubah saat import, silakan ulangi')
+        return len(written)
+
+    # Generic fallback: one guarded UPDATE for existing products, then INSERT the new ones
+    table = Product.__table__
+    updates = {entry['name']: entry for entry in plan if entry['action'] == 'update'}
+    if updates:
+        names = list(updates)
+        delta = case({name: updates[name]['stock_delta'] for name in names}, value=table.c.name)
+        result = db.session.execute(
+            table.update()
+            .where(table.c.name.in_(names), table.c.stock + delta >= 0)
+            .values(
+                category=case({name: updates[name]['category'] for name in names}, value=table.c.name),
+                price=case({name: updates[name]['price'] for name in names}, value=table.c.name),
+                sku=case({name: updates[name]['sku'] for name in names}, value=table.c.name),
+                stock=table.c.stock + delta,
+                catalog_version=version,
+                updated_at=now,
+            )
+        )
+        if result.rowcount != len(names):
+            raise ImportConflict('Stok berubah saat import, silakan ulangi')
+    inserts = [row for row, entry in zip(rows, plan) if entry['action'] == 'create']
+    if inserts:
+        db.session.execute(table.insert(), inserts)
+    return len(rows)
+
+def template_csv():
+    """Example file for the import form"""
+    return ('name,category,price,stock_delta,sku\nGacoan Level 1,makanan,10000,50,8991234500011\n'
+            'Es Teh Manis,,,24,\n')
@@ -4,18 +4,40 @@ KASIR GACOAN - SISTEM POS SEDERHANA
 Enhanced with Receipt Printing Functionality, Database Integration, and User Management
 """
 import os
+import base64
 import logging
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, send_file, flash
+import click
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, send_file, flash, Response, stream_with_context
+import csv
 import json
+import tempfile
 from datetime import datetime
-from receipt_generator import ReceiptGenerator
-from models import db, Product, Transaction, TransactionItem, User
-from sqlalchemy import func
+import receipt_renderer
+import receipt_store
+from thermal_receipt import ThermalReceiptRenderer, send_to_printer
+from currency import format_currency
+from models import db, Product, Transaction, TransactionItem, User, SalesRollup
+import rollups
+import migrations
+import exports
+import inventory_import
+import synthetic_data
+import checkout
+import catalog
+import principals
+import metrics
+import db_writer
+import replicas
+import partitions
+import sales_archive
+import transaction_ids
+import product_search
+from sqlalchemy import or_, and_
 from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
 
 # Configure logging
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "DEBUG").upper())
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "gacoan_pos_secret_key_2024")
@@ -24,27 +46,82 @@ app.secret_key = os.environ.get("SESSION_SECRET", "gacoan_pos_secret_key_2024")
 database_url = os.environ.get("DATABASE_URL")
 if database_url:
     app.config["SQLALCHEMY_DATABASE_URI"] = database_url
+    # Per-process pool: size it to the threads of one worker (see gunicorn.conf.py).
+    # pool_recycle replaces pool_pre_ping, which costs a round trip per checkout.
     app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-        "pool_recycle": 300,
-        "pool_pre_ping": True,
+        "pool_size": int(os.environ.get("DB_POOL_SIZE", 5)),
+        "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", 5)),
+        "pool_timeout": float(os.environ.get("DB_POOL_TIMEOUT", 10)),
+        "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE", 300)),
+        "pool_pre_ping": os.environ.get("DB_POOL_PRE_PING") == "1",
     }
+    statement_timeout = int(os.environ.get("DB_STATEMENT_TIMEOUT_MS", 0))
+    if statement_timeout and database_url.startswith("postgres"):
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"]["connect_args"] = {
+            "options": f"-c statement_timeout={statement_timeout}"
+        }
 else:
     # Fallback for development
     app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///kasir_gacoan.db"
 
+# Optional read replica for history and chart routes (see replicas.py);
+# same pool settings as the primary
+replica_url = os.environ.get("DATABASE_REPLICA_URL")
+if replica_url:
+    app.config["SQLALCHEMY_BINDS"] = {
+        replicas.REPLICA_BIND: dict(app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}), url=replica_url)
+    }
+
 db.init_app(app)
+replicas.init_app(app, db)
+
+# Request/SQL metrics for /metrics (optionally protected by a bearer token)
+app.config["METRICS_TOKEN"] = os.environ.get("METRICS_TOKEN")
+metrics.init_app(app, db)
+
+# SQLite: WAL and busy timeout on every connection, writes serialized through one thread
+db_writer.init_app(app)
+
+# Outlet code for human-friendly daily receipt numbers (disabled when unset)
+app.config["OUTLET_CODE"] = os.environ.get("OUTLET_CODE")
+
+# Receipt PDF store: root directory, size cap (0 = unlimited), gzip and daily zip archives
+app.config["RECEIPTS_DIR"] = receipt_store.DEFAULT_ROOT
+app.config["RECEIPT_STORE_MAX_MB"] = int(os.environ.get("RECEIPT_STORE_MAX_MB", 500))
+app.config["RECEIPT_STORE_COMPRESS"] = os.environ.get("RECEIPT_STORE_COMPRESS") == "1"
+app.config["RECEIPT_STORE_ARCHIVE"] = os.environ.get("RECEIPT_STORE_ARCHIVE") == "1"
+receipt_storage = receipt_store.ReceiptStore.from_config(app.config)
+
+# Cold archive of months moved out of the live sales tables (`flask partitions-maintain`)
+app.config["SALES_ARCHIVE_DIR"] = sales_archive.DEFAULT_ROOT
+app.config["SALES_ARCHIVE_CACHE_MONTHS"] = int(os.environ.get("SALES_ARCHIVE_CACHE_MONTHS", 12))
+sales_archive_store = sales_archive.ArchiveStore.from_config(app.config)
+
+# Thermal printer: tcp://host:port, a spool directory or a device path such as /dev/usb/lp0
+app.config["RECEIPT_PRINTER"] = os.environ.get("RECEIPT_PRINTER")
+app.config["RECEIPT_PAPER_MM"] = int(os.environ.get("RECEIPT_PAPER_MM", 58))
 
 # Stock alerts threshold
 STOCK_ALERT_THRESHOLD = 10
 
+# Catalog push to POS terminals: seconds before an event stream is recycled,
+# and the longest wait of the long-poll fallback
+app.config["CATALOG_STREAM_SECONDS"] = int(os.environ.get("CATALOG_STREAM_SECONDS", 300))
+CATALOG_LONG_POLL_SECONDS = 25
+
+# Page size limits for /api/transactions
+TRANSACTIONS_PAGE_SIZE = 50
+TRANSACTIONS_MAX_PAGE_SIZE = 200
+
 # Valid categories (removed 'main' and 'appetizer')
 VALID_CATEGORIES = ['makanan', 'snack', 'minuman']
 
-# Initialize database and default data
+# Initialize database and default data (run by `flask init-db`, never at import)
 def init_database():
     """Initialize database with tables and default data"""
     with app.app_context():
         db.create_all()
+        migrations.run_migrations()
         
         # Check if users exist, if not create default users
         if User.query.count() == 0:
@@ -85,25 +162,42 @@ def init_database():
                 db.session.add(product)
             db.session.commit()
             logging.info("Default products created")
+        
+        # Backfill rollups for databases created before the rollup tables existed
+        if SalesRollup.query.first() is None and Transaction.query.first() is not None:
+            rollups.rebuild_rollups()
 
-def format_currency(amount):
-    """Format currency to Indonesian Rupiah format"""
-    return f"Rp {amount:,}".replace(",", ".")
+def wsgi_application(init_db=False):
+    """Entry point for WSGI servers, e.g. gunicorn 'main:wsgi_application()'.
 
-def generate_transaction_id():
-    """Generate unique transaction ID"""
-    return f"TRX-{int(datetime.now().timestamp())}"
+    Not an application factory: the app is built once when this module is
+    imported and every call returns that same object. Importing does no
+    database I/O, so workers boot without touching the database. The schema
+    is created by `flask --app main init-db` (once per deployment); init_db
+    runs that initialization first, as a hook for single-node setups.
+    """
+    if init_db:
+        init_database()
+    return app
 
 def get_low_stock_products():
     """Get products with low stock"""
     return Product.query.filter(Product.stock <= STOCK_ALERT_THRESHOLD).all()
 
+def end_revoked_session():
+    """Log out a session whose user was deactivated, edited or changed password"""
+    session.clear()
+    flash('Sesi Anda telah berakhir. Silakan login kembali.', 'error')
+    return redirect(url_for('login'))
+
 def require_login(f):
     """Decorator to require login for routes"""
     @wraps(f)
     def wrapper(*args, **kwargs):
         if 'username' not in session:
             return redirect(url_for('login'))
+        if principals.current_principal(session) is None:
+            return end_revoked_session()
         return f(*args, **kwargs)
     return wrapper
 
@@ -114,8 +208,10 @@ def require_admin(f):
         if 'username' not in session:
             return redirect(url_for('login'))
         
-        user = User.query.filter_by(username=session['username']).first()
-        if not user or user.role != 'admin':
+        user = principals.current_principal(session)
+        if user is None:
+            return end_revoked_session()
+        if user.role != 'admin':
             flash('Akses ditolak. Hanya admin yang dapat mengakses halaman ini.', 'error')
             return redirect(url_for('pos'))
         return f(*args, **kwargs)
@@ -128,6 +224,14 @@ def index():
         return redirect(url_for('pos'))
     return redirect(url_for('login'))
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    token = app.config["METRICS_TOKEN"]
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     """Handle user login"""
@@ -140,6 +244,7 @@ def login():
             session['username'] = username
             session['user_id'] = user.id
             session['user_role'] = user.role
+            session['user_version'] = user.session_version or 0
             session['login_time'] = datetime.now().isoformat()
             flash('Login berhasil!', 'success')
             return redirect(url_for('pos'))
@@ -175,7 +280,10 @@ def change_password():
             flash('Password minimal 4 karakter!', 'error')
         else:
             user.password_hash = generate_password_hash(new_password)
+            # Log out other sessions of this user but keep the current one
+            session['user_version'] = principals.revoke_sessions(user)
             db.session.commit()
+            principals.cache.invalidate(user.id)
             flash('Password berhasil diubah!', 'success')
             return redirect(url_for('pos'))
     
@@ -185,23 +293,97 @@ def change_password():
 @require_login
 def pos():
     """Main POS interface"""
-    products = Product.query.all()
-    low_stock = get_low_stock_products()
+    snapshot = catalog.get_snapshot()
     return render_template('pos.html', 
-                         products=products, 
+                         products=snapshot.products, 
+                         catalog_version=snapshot.version,
                          format_currency=format_currency,
-                         low_stock=low_stock)
+                         low_stock=snapshot.low_stock(STOCK_ALERT_THRESHOLD))
 
 @app.route('/api/products')
 @require_login
 def api_products():
-    """API endpoint to get products"""
+    """API endpoint to get products.
+    
+    Supports If-None-Match against the catalog version, and ?since=<version>
+    to return only products changed (and ids deleted) after that version.
+    """
     category = request.args.get('category')
-    if category and category != 'all':
-        products = Product.query.filter_by(category=category).all()
+    since = request.args.get('since', type=int)
+    
+    if since is not None:
+        version = catalog.current_version()
+        etag = f'"catalog-{version}-since-{since}"'
+        if request.if_none_match.contains(etag.strip('"')):
+            return Response(status=304, headers={'ETag': etag})
+        products, deleted = catalog.changes_since(since)
+        response = jsonify({'version': version, 'products': products, 'deleted': deleted})
     else:
-        products = Product.query.all()
-    return jsonify([p.to_dict() for p in products])
+        snapshot = catalog.get_snapshot()
+        etag = snapshot.etag if not category or category == 'all' else f'"catalog-{snapshot.version}-{category}"'
+        if request.if_none_match.contains(etag.strip('"')):
+            return Response(status=304, headers={'ETag': etag})
+        if category and category != 'all':
+            response = jsonify(snapshot.by_category(category))
+        else:
+            response = Response(snapshot.body, mimetype='application/json')
+        version = snapshot.version
+    
+    response.headers['ETag'] = etag
+    response.headers['X-Catalog-Version'] = str(version)
+    return response
+
+@app.route('/api/products/search')
+@require_login
+def api_products_search():
+    """Prefix and typo-tolerant product search for the POS search box"""
+    query = request.args.get('q', '')
+    limit = min(max(request.args.get('limit', product_search.DEFAULT_LIMIT, type=int), 1), product_search.MAX_LIMIT)
+    category = request.args.get('category')
+    if category == 'all':
+        category = None
+    
+    products = product_search.index.search(query, limit, category)
+    return jsonify({'version': product_search.index.version, 'products': products})
+
+@app.route('/api/products/lookup')
+@require_login
+def api_products_lookup():
+    """Exact SKU/barcode lookup for barcode scanners"""
+    product = product_search.index.lookup(request.args.get('code', ''))
+    if product is None:
+        return jsonify({'success': False, 'message': 'Produk tidak ditemukan'}), 404
+    return jsonify({'success': True, 'product': product})
+
+@app.route('/api/catalog/stream')
+@require_login
+def api_catalog_stream():
+    """Server-sent events with stock and product changes for POS terminals"""
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', type=int)
+    if since is None:
+        since = catalog.current_version()
+    db.session.close()
+
+    response = Response(stream_with_context(catalog.event_stream(since, app.config["CATALOG_STREAM_SECONDS"])),
+                        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/catalog/changes')
+@require_login
+def api_catalog_changes():
+    """Long-poll fallback for the event stream: waits until the catalog moves past ?since="""
+    since = request.args.get('since', type=int)
+    if since is None:
+        return jsonify({'success': False, 'message': 'Parameter since wajib diisi'}), 400
+    timeout = min(max(request.args.get('timeout', CATALOG_LONG_POLL_SECONDS, type=float), 0), CATALOG_LONG_POLL_SECONDS)
+
+    version = catalog.wait_for_change(since, timeout)
+    products, deleted = catalog.changes_since(since) if version > since else ([], [])
+    return jsonify({'version': max(version, since), 'products': products, 'deleted': deleted})
 
 @app.route('/api/checkout', methods=['POST'])
 @require_login
@@ -209,90 +391,58 @@ def api_checkout():
     """Process checkout and create transaction"""
     try:
         data = request.get_json()
-        cart_items = data.get('cart_items', [])
-        payment_amount = data.get('payment_amount', 0)
-        
-        if not cart_items:
-            return jsonify({'success': False, 'message': 'Keranjang kosong'}), 400
-        
-        # Calculate totals
-        subtotal = sum(item['price'] * item['quantity'] for item in cart_items)
-        discount = 0
-        if subtotal >= 100000:  # 10% discount for orders >= 100k
-            discount = subtotal * 0.1
-        
-        total = subtotal - discount
-        
-        if payment_amount < total:
-            return jsonify({'success': False, 'message': 'Pembayaran kurang'}), 400
-        
-        change = payment_amount - total
-        
-        # Create transaction
-        transaction = {
-            'id': generate_transaction_id(),
-            'date': datetime.now().isoformat(),
-            'cashier': session['username'],
-            'items': cart_items,
-            'subtotal': subtotal,
-            'discount': discount,
-            'total': total,
-            'payment': payment_amount,
-            'change': change
-        }
-        
-        # Create transaction record
-        new_transaction = Transaction(
-            id=transaction['id'],
-            date=datetime.now(),
-            cashier=session['username'],
-            subtotal=subtotal,
-            discount=discount,
-            total=total,
-            payment=payment_amount,
-            change=change
+        result = db_writer.run(
+            checkout.record_checkout,
+            data.get('cart_items', []),
+            data.get('payment_amount', 0),
+            session['username']
         )
-        db.session.add(new_transaction)
-        
-        # Create transaction items and update stock immediately
-        for cart_item in cart_items:
-            # Update product stock first (before creating transaction item)
-            product = Product.query.get(cart_item['id'])
-            if product:
-                if product.stock < cart_item['quantity']:
-                    return jsonify({'success': False, 'message': f'Stok {product.name} tidak mencukupi'}), 400
-                product.stock -= cart_item['quantity']
-            
-            # Create transaction item
-            transaction_item = TransactionItem(
-                transaction_id=transaction['id'],
-                product_id=cart_item['id'],
-                product_name=cart_item['name'],
-                price=cart_item['price'],
-                quantity=cart_item['quantity'],
-                subtotal=cart_item['price'] * cart_item['quantity']
-            )
-            db.session.add(transaction_item)
-        
-        db.session.commit()
+        receipt = result.pop('receipt')
         
-        return jsonify({
-            'success': True,
-            'transaction_id': transaction['id'],
-            'total': total,
-            'payment': payment_amount,
-            'change': change
-        })
+        receipt_renderer.prerender(receipt_storage, receipt)
+        return jsonify(dict(result, success=True))
         
+    except checkout.CheckoutError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': e.message}), 400
     except Exception as e:
+        db.session.rollback()
         logging.error(f"Checkout error: {str(e)}")
         return jsonify({'success': False, 'message': 'Terjadi kesalahan sistem'}), 500
 
+@app.route('/api/checkout/batch', methods=['POST'])
+@require_login
+def api_checkout_batch():
+    """Apply sales queued offline by a terminal, idempotently and in one transaction"""
+    data = request.get_json(silent=True) or {}
+    sales = data.get('sales')
+    if not isinstance(sales, list) or not sales:
+        return jsonify({'success': False, 'message': 'Tidak ada transaksi'}), 400
+    if len(sales) > checkout.MAX_BATCH_SIZE:
+        return jsonify({'success': False, 'message': f'Maksimal {checkout.MAX_BATCH_SIZE} transaksi per batch'}), 400
+    
+    try:
+        results, receipts = db_writer.run(checkout.record_batch, sales, session['username'])
+        for receipt in receipts:
+            receipt_renderer.prerender(receipt_storage, receipt)
+        return jsonify({'success': True, 'results': results})
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Batch checkout error: {str(e)}")
+        return jsonify({'success': False, 'message': 'Terjadi kesalahan sistem'}), 500
+
+def find_transaction(transaction_id):
+    """A live sale by id, else an archived one (see sales_archive.py), or None"""
+    transaction = db.session.get(Transaction, transaction_id)
+    if transaction is None:
+        transaction = sales_archive_store.get(transaction_id, transaction_ids.created_at(transaction_id))
+    return transaction
+
 @app.route('/receipt/preview/<transaction_id>')
 @require_login
 def receipt_preview(transaction_id):
     """Show receipt preview"""
-    transaction = Transaction.query.get(transaction_id)
+    transaction = find_transaction(transaction_id)
     if not transaction:
         flash('Transaksi tidak ditemukan', 'error')
         return redirect(url_for('pos'))
@@ -305,33 +455,200 @@ def receipt_preview(transaction_id):
 @require_login
 def receipt_pdf(transaction_id):
     """Generate and download receipt as PDF"""
-    transaction = Transaction.query.get(transaction_id)
+    transaction = find_transaction(transaction_id)
     if not transaction:
         flash('Transaksi tidak ditemukan', 'error')
         return redirect(url_for('pos'))
     
     try:
-        receipt_generator = ReceiptGenerator()
-        pdf_path = receipt_generator.generate_pdf(transaction.to_dict())
+        pdf = receipt_renderer.get_pdf(receipt_storage, transaction.to_dict())
         
-        return send_file(pdf_path, 
+        return send_file(pdf, 
                         as_attachment=True, 
                         download_name=f"receipt_{transaction_id}.pdf",
                         mimetype='application/pdf')
+    except receipt_renderer.RenderTimeout:
+        flash('Struk sedang dibuat, silakan coba lagi', 'error')
+        return redirect(url_for('pos'))
     except Exception as e:
         logging.error(f"PDF generation error: {str(e)}")
         flash('Gagal membuat PDF', 'error')
         return redirect(url_for('pos'))
 
+def encode_cursor(transaction):
+    """Encode the keyset position (date, id) of a transaction as an opaque cursor"""
+    raw = f"{transaction.date.isoformat()}|{transaction.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor):
+    """Decode a cursor created by encode_cursor into (date, id)"""
+    raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+    date_part, transaction_id = raw.split('|', 1)
+    return datetime.fromisoformat(date_part), transaction_id
+
+def parse_date_range(start, end):
+    """Turn inclusive YYYY-MM-DD query args into a half-open datetime range"""
+    start_at = datetime.strptime(start, '%Y-%m-%d') if start else None
+    end_at = rollups.day_range(datetime.strptime(end, '%Y-%m-%d').date())[1] if end else None
+    return start_at, end_at
+
+@app.route('/receipt/thermal/<transaction_id>')
+@require_login
+def receipt_thermal(transaction_id):
+    """Receipt for thermal printers as plain text or raw ESC/POS bytes"""
+    transaction = find_transaction(transaction_id)
+    if not transaction:
+        return jsonify({'success': False, 'message': 'Transaksi tidak ditemukan'}), 404
+    
+    try:
+        renderer = ThermalReceiptRenderer(request.args.get('paper', app.config["RECEIPT_PAPER_MM"], type=int))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Ukuran kertas tidak valid'}), 400
+    
+    if request.args.get('format') == 'escpos':
+        return Response(renderer.render_escpos(transaction.to_dict()),
+                        mimetype='application/octet-stream',
+                        headers={'Content-Disposition': f'attachment; filename="receipt_{transaction_id}.bin"'})
+    return Response(renderer.render_text(transaction.to_dict()), mimetype='text/plain')
+
+@app.route('/api/receipt/<transaction_id>/print', methods=['POST'])
+@require_login
+def api_print_receipt(transaction_id):
+    """Send an ESC/POS receipt to the configured thermal printer"""
+    printer = app.config["RECEIPT_PRINTER"]
+    if not printer:
+        return jsonify({'success': False, 'message': 'Printer belum dikonfigurasi'}), 400
+    
+    transaction = find_transaction(transaction_id)
+    if not transaction:
+        return jsonify({'success': False, 'message': 'Transaksi tidak ditemukan'}), 404
+    
+    try:
+        renderer = ThermalReceiptRenderer(app.config["RECEIPT_PAPER_MM"])
+        send_to_printer(renderer.render_escpos(transaction.to_dict()), printer, job_name=f"receipt_{transaction_id}")
+        return jsonify({'success': True})
+    except OSError as e:
+        logging.error(f"Receipt print error: {str(e)}")
+        return jsonify({'success': False, 'message': 'Gagal mencetak struk'}), 502
+
 @app.route('/api/transactions')
 @require_login
+@replicas.read_only(max_staleness=30)
 def api_transactions():
-    """API endpoint to get transaction history"""
-    transactions = Transaction.query.order_by(Transaction.date.desc()).all()
-    return jsonify([t.to_dict() for t in transactions])
+    """API endpoint to get transaction history, newest first, one page at a time"""
+    try:
+        limit = min(max(int(request.args.get('limit', TRANSACTIONS_PAGE_SIZE)), 1), TRANSACTIONS_MAX_PAGE_SIZE)
+        start_at, end_at = parse_date_range(request.args.get('start'), request.args.get('end'))
+        cursor = request.args.get('cursor')
+        after = decode_cursor(cursor) if cursor else None
+        product_id = request.args.get('product_id', type=int)
+    except (ValueError, UnicodeDecodeError):
+        return jsonify({'success': False, 'message': 'Parameter tidak valid'}), 400
+    
+    query = Transaction.query
+    if start_at:
+        query = query.filter(Transaction.date >= start_at)
+    if end_at:
+        query = query.filter(Transaction.date < end_at)
+    if request.args.get('cashier'):
+        query = query.filter(Transaction.cashier == request.args['cashier'])
+    if product_id:
+        query = query.filter(db.session.query(TransactionItem.id).filter(
+            TransactionItem.transaction_id == Transaction.id,
+            TransactionItem.product_id == product_id
+        ).exists())
+    if after:
+        after_date, after_id = after
+        query = query.filter(or_(
+            Transaction.date < after_date,
+            and_(Transaction.date == after_date, Transaction.id < after_id)
+        ))
+    
+    # Fetch one extra row to know whether there is a next page
+    transactions = query.order_by(Transaction.date.desc(), Transaction.id.desc()).limit(limit + 1).all()
+    
+    # Archived months only matter when the page reaches below the live rows
+    floor = transactions[-1].date if len(transactions) > limit else None
+    archived = sales_archive_store.find_transactions(start_at, end_at, cashier=request.args.get('cashier'),
+                                                     product_id=product_id, after=after, limit=limit + 1, floor=floor)
+    if archived:
+        transactions = sorted(transactions + archived, key=lambda t: (t.date, t.id), reverse=True)
+    has_more = len(transactions) > limit
+    transactions = transactions[:limit]
+    
+    # Load items for the whole page in a single query
+    items_by_transaction = {t.id: [] for t in transactions if isinstance(t, Transaction)}
+    if items_by_transaction:
+        for item in TransactionItem.query.filter(
+            TransactionItem.transaction_id.in_(list(items_by_transaction))
+        ).order_by(TransactionItem.id):
+            items_by_transaction[item.transaction_id].append(item)
+    
+    return jsonify({
+        'transactions': [t.to_dict(items=items_by_transaction.get(t.id)) for t in transactions],
+        'next_cursor': encode_cursor(transactions[-1]) if has_more else None
+    })
+
+@app.route('/api/transactions/export')
+@require_admin
+@replicas.read_only(max_staleness=300)
+def api_transactions_export():
+    """Stream the transaction history as CSV or NDJSON (optionally gzip-compressed)"""
+    fmt = request.args.get('format', 'csv')
+    compress = request.args.get('gzip') in ('1', 'true')
+    if fmt not in exports.FORMATS:
+        return jsonify({'success': False, 'message': 'Format tidak valid'}), 400
+    try:
+        start_at, end_at = parse_date_range(request.args.get('start'), request.args.get('end'))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Tanggal tidak valid'}), 400
+    
+    filename = f"transactions.{fmt}" + ('.gz' if compress else '')
+    headers = {'Content-Disposition': f'attachment; filename="{filename}"'}
+    if compress:
+        mimetype = 'application/gzip'
+    else:
+        mimetype = exports.content_type(fmt)
+    
+    return Response(stream_with_context(exports.export_transactions(fmt, start_at, end_at, compress,
+                                                                          archive=sales_archive_store)),
+                    mimetype=mimetype, headers=headers)
+
+@app.route('/reports/z-report')
+@require_login
+def z_report_pdf():
+    """End-of-day Z-report with every receipt of the period as one PDF"""
+    from datetime import date
+    
+    try:
+        day = request.args.get('start') or date.today().isoformat()
+        start_at, end_at = parse_date_range(day, request.args.get('end') or day)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Tanggal tidak valid'}), 400
+    
+    # Cashiers can only close their own shift
+    cashier = request.args.get('cashier') or None
+    if session.get('user_role') != 'admin':
+        cashier = session['username']
+    
+    import z_report
+    try:
+        output = tempfile.TemporaryFile()
+        z_report.ZReportGenerator().generate_report(start_at, end_at, output, cashier=cashier,
+                                                    archive=sales_archive_store)
+        output.seek(0)
+        return send_file(output,
+                        as_attachment=True,
+                        download_name=f"z-report_{start_at:%Y%m%d}.pdf",
+                        mimetype='application/pdf')
+    except Exception as e:
+        logging.error(f"Z-report generation error: {str(e)}")
+        flash('Gagal membuat laporan', 'error')
+        return redirect(url_for('sales_history'))
 
 @app.route('/sales-history')
 @require_login
+@replicas.read_only(max_staleness=60)
 def sales_history():
     """Sales history page with analytics"""
     from datetime import date, timedelta
@@ -339,74 +656,41 @@ def sales_history():
     # Get recent transactions
     transactions = Transaction.query.order_by(Transaction.date.desc()).limit(50).all()
     
-    # Calculate sales metrics
-    today = date.today()
+    # Calculate sales metrics from the pre-aggregated rollups
+    today, tomorrow = rollups.day_range(date.today())
     yesterday = today - timedelta(days=1)
     week_ago = today - timedelta(days=7)
     month_ago = today.replace(day=1)
     
     # Today's sales
-    today_sales = db.session.query(func.sum(Transaction.total)).filter(
-        func.date(Transaction.date) == today
-    ).scalar() or 0
+    today_sales = rollups.sales_total(today, tomorrow)
     
     # Yesterday's sales
-    yesterday_sales = db.session.query(func.sum(Transaction.total)).filter(
-        func.date(Transaction.date) == yesterday
-    ).scalar() or 0
+    yesterday_sales = rollups.sales_total(yesterday, today)
     
     # This week's sales
-    week_sales = db.session.query(func.sum(Transaction.total)).filter(
-        Transaction.date >= week_ago
-    ).scalar() or 0
+    week_sales = rollups.sales_total(week_ago)
     
     # This month's sales
-    month_sales = db.session.query(func.sum(Transaction.total)).filter(
-        Transaction.date >= month_ago
-    ).scalar() or 0
+    month_sales = rollups.sales_total(month_ago)
     
     # Get top selling products
-    top_products = db.session.query(
-        TransactionItem.product_name,
-        func.sum(TransactionItem.quantity).label('total_quantity'),
-        func.sum(TransactionItem.subtotal).label('total_revenue')
-    ).group_by(TransactionItem.product_name).order_by(
-        func.sum(TransactionItem.quantity).desc()
-    ).limit(10).all()
+    top_products = rollups.top_products(10)
     
     # Sales by day for last 7 days
-    daily_sales = []
-    for i in range(7):
-        day = today - timedelta(days=i)
-        sales = db.session.query(func.sum(Transaction.total)).filter(
-            func.date(Transaction.date) == day
-        ).scalar() or 0
-        daily_sales.append({
-            'date': day.strftime('%d/%m'),
-            'sales': sales
-        })
-    daily_sales.reverse()  # Show oldest to newest
+    daily_sales = [{
+        'date': day.strftime('%d/%m'),
+        'sales': sales
+    } for day, sales in rollups.daily_series(7)]
     
     # Sales by hour for today
-    hourly_sales = []
-    for hour in range(24):
-        sales = db.session.query(func.sum(Transaction.total)).filter(
-            func.date(Transaction.date) == today,
-            func.extract('hour', Transaction.date) == hour
-        ).scalar() or 0
-        hourly_sales.append({
-            'hour': f"{hour:02d}:00",
-            'sales': sales
-        })
+    hourly_sales = [{
+        'hour': f"{hour:02d}:00",
+        'sales': sales
+    } for hour, sales in rollups.hourly_series()]
     
     # Category performance
-    category_sales = db.session.query(
-        Product.category,
-        func.sum(TransactionItem.subtotal).label('total_sales'),
-        func.sum(TransactionItem.quantity).label('total_quantity')
-    ).join(TransactionItem, Product.id == TransactionItem.product_id).group_by(
-        Product.category
-    ).order_by(func.sum(TransactionItem.subtotal).desc()).all()
+    category_sales = rollups.category_sales()
     
     return render_template('sales_history.html',
                          transactions=transactions,
@@ -422,61 +706,55 @@ def sales_history():
 
 @app.route('/api/sales-chart-data')
 @require_login
+@replicas.read_only(max_staleness=60)
 def api_sales_chart_data():
     """API endpoint for sales chart data"""
-    from datetime import date, timedelta
-    
     chart_type = request.args.get('type', 'daily')
     
     if chart_type == 'daily':
         # Last 30 days
-        data = []
-        today = date.today()
-        for i in range(30):
-            day = today - timedelta(days=i)
-            sales = db.session.query(func.sum(Transaction.total)).filter(
-                func.date(Transaction.date) == day
-            ).scalar() or 0
-            data.append({
-                'label': day.strftime('%d/%m'),
-                'value': sales
-            })
-        data.reverse()
+        data = [{
+            'label': day.strftime('%d/%m'),
+            'value': sales
+        } for day, sales in rollups.daily_series(30)]
         
     elif chart_type == 'hourly':
         # Today by hour
-        data = []
-        today = date.today()
-        for hour in range(24):
-            sales = db.session.query(func.sum(Transaction.total)).filter(
-                func.date(Transaction.date) == today,
-                func.extract('hour', Transaction.date) == hour
-            ).scalar() or 0
-            data.append({
-                'label': f"{hour:02d}:00",
-                'value': sales
-            })
+        data = [{
+            'label': f"{hour:02d}:00",
+            'value': sales
+        } for hour, sales in rollups.hourly_series()]
             
     elif chart_type == 'products':
         # Top 10 products
-        data = []
-        top_products = db.session.query(
-            TransactionItem.product_name,
-            func.sum(TransactionItem.quantity).label('total_quantity')
-        ).group_by(TransactionItem.product_name).order_by(
-            func.sum(TransactionItem.quantity).desc()
-        ).limit(10).all()
-        
-        for product in top_products:
-            data.append({
-                'label': product.product_name,
-                'value': product.total_quantity
-            })
+        data = [{
+            'label': product.product_name,
+            'value': product.total_quantity
+        } for product in rollups.top_products(10)]
     else:
         data = []
     
     return jsonify(data)
 
+@app.route('/api/analytics/<report>')
+@require_admin
+def api_analytics(report):
+    """Basket, heatmap, cashier and price elasticity reports from the in-memory columns"""
+    import analytics
+    
+    build = analytics.REPORTS.get(report)
+    if build is None:
+        return jsonify({'success': False, 'message': 'Laporan tidak ditemukan'}), 404
+    try:
+        start_at, end_at = parse_date_range(request.args.get('start'), request.args.get('end'))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Tanggal tidak valid'}), 400
+
+    analytics.engine.refresh(force=request.args.get('refresh') == '1')
+    with analytics.engine.lock:
+        data = build(start_at, end_at)
+    return jsonify({'success': True, 'report': report, 'data': data})
+
 @app.route('/inventory')
 @require_admin
 def inventory():
@@ -498,6 +776,7 @@ def add_product():
         price = float(request.form['price'])
         stock = int(request.form['stock'])
         category = request.form['category']
+        sku = product_search.normalize_sku(request.form.get('sku'))
         
         # Validation
         if not name:
@@ -522,15 +801,26 @@ def add_product():
             flash('Produk dengan nama tersebut sudah ada', 'error')
             return redirect(url_for('inventory'))
         
+        if sku and len(sku) > product_search.SKU_MAX_LENGTH:
+            flash('SKU/barcode terlalu panjang', 'error')
+            return redirect(url_for('inventory'))
+        
+        if sku and Product.query.filter_by(sku=sku).first():
+            flash('Produk dengan SKU/barcode tersebut sudah ada', 'error')
+            return redirect(url_for('inventory'))
+        
         # Create new product
-        product = Product(
-            name=name,
-            price=price,
-            stock=stock,
-            category=category
-        )
-        db.session.add(product)
-        db.session.commit()
+        def create_product():
+            product = Product(
+                name=name,
+                price=price,
+                stock=stock,
+                category=category,
+                sku=sku
+            )
+            db.session.add(product)
+            catalog.mark_changed(product)
+        db_writer.run(create_product)
         
         flash('Produk berhasil ditambahkan', 'success')
         
@@ -542,6 +832,55 @@ def add_product():
     
     return redirect(url_for('inventory'))
 
+@app.route('/inventory/import', methods=['POST'])
+@require_admin
+def import_inventory():
+    """Preview or apply a CSV of products and stock deltas"""
+    upload = request.files.get('csv_file')
+    if upload and upload.filename:
+        csv_text = upload.read().decode('utf-8-sig', errors='replace')
+    else:
+        csv_text = request.form.get('csv_text', '')
+    
+    try:
+        plan = inventory_import.plan_import(inventory_import.parse_csv(csv_text), VALID_CATEGORIES)
+    except inventory_import.ImportFileError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('inventory'))
+    except csv.Error:
+        flash('File CSV tidak valid', 'error')
+        return redirect(url_for('inventory'))
+    
+    summary = inventory_import.summarize(plan)
+    if request.form.get('action') == 'apply' and not summary['error']:
+        try:
+            count = db_writer.run(inventory_import.apply_import, plan)
+            flash(f"Import berhasil: {summary['create']} produk baru, {summary['update']} produk diperbarui", 'success')
+            logging.info(f"Inventory import applied: {count} rows")
+            return redirect(url_for('inventory'))
+        except inventory_import.ImportConflict as e:
+            db.session.rollback()
+            flash(str(e), 'error')
+            plan = inventory_import.plan_import(inventory_import.parse_csv(csv_text), VALID_CATEGORIES)
+            summary = inventory_import.summarize(plan)
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Inventory import error: {str(e)}")
+            flash('Terjadi kesalahan sistem', 'error')
+    
+    return render_template('inventory_import.html',
+                         plan=plan,
+                         summary=summary,
+                         csv_text=csv_text,
+                         format_currency=format_currency)
+
+@app.route('/inventory/import/template')
+@require_admin
+def import_inventory_template():
+    """Example CSV for the inventory import"""
+    return Response(inventory_import.template_csv(), mimetype='text/csv',
+                    headers={'Content-Disposition': 'attachment; filename="inventory_import.csv"'})
+
 @app.route('/inventory/edit/<int:product_id>', methods=['GET', 'POST'])
 @require_admin
 def edit_product(product_id):
@@ -554,6 +893,7 @@ def edit_product(product_id):
             product.price = float(request.form['price'])
             product.stock = int(request.form['stock'])
             product.category = request.form['category']
+            product.sku = product_search.normalize_sku(request.form.get('sku'))
             
             # Validation
             if not product.name:
@@ -573,12 +913,32 @@ def edit_product(product_id):
                 return render_template('edit_product.html', product=product, categories=VALID_CATEGORIES)
             
             # Check if another product with same name exists
-            existing_product = Product.query.filter(Product.name == product.name, Product.id != product_id).first()
+            with db.session.no_autoflush:
+                existing_product = Product.query.filter(Product.name == product.name, Product.id != product_id).first()
             if existing_product:
                 flash('Produk dengan nama tersebut sudah ada', 'error')
                 return render_template('edit_product.html', product=product, categories=VALID_CATEGORIES)
             
-            db.session.commit()
+            if product.sku and len(product.sku) > product_search.SKU_MAX_LENGTH:
+                flash('SKU/barcode terlalu panjang', 'error')
+                return render_template('edit_product.html', product=product, categories=VALID_CATEGORIES)
+            
+            if product.sku:
+                with db.session.no_autoflush:
+                    existing_product = Product.query.filter(Product.sku == product.sku, Product.id != product_id).first()
+                if existing_product:
+                    flash('Produk dengan SKU/barcode tersebut sudah ada', 'error')
+                    return render_template('edit_product.html', product=product, categories=VALID_CATEGORIES)
+            
+            values = {'name': product.name, 'price': product.price, 'stock': product.stock,
+                      'category': product.category, 'sku': product.sku}
+            
+            def save_product():
+                stored = db.session.get(Product, product_id)
+                for field, value in values.items():
+                    setattr(stored, field, value)
+                catalog.mark_changed(stored)
+            db_writer.run(save_product)
             flash('Produk berhasil diperbarui', 'success')
             return redirect(url_for('inventory'))
             
@@ -599,11 +959,13 @@ def delete_product(product_id):
         
         # Check if product has been used in transactions
         transaction_items = TransactionItem.query.filter_by(product_id=product_id).first()
-        if transaction_items:
+        if transaction_items or sales_archive_store.product_sold(product_id):
             flash('Tidak dapat menghapus produk yang sudah pernah dijual', 'error')
         else:
-            db.session.delete(product)
-            db.session.commit()
+            def remove_product():
+                Product.query.filter_by(id=product_id).delete()
+                catalog.mark_deleted(product_id)
+            db_writer.run(remove_product)
             flash('Produk berhasil dihapus', 'success')
             
     except Exception as e:
@@ -625,9 +987,19 @@ def delete_stock(product_id):
         elif quantity > product.stock:
             flash('Jumlah yang dihapus tidak boleh lebih dari stok tersedia', 'error')
         else:
-            product.stock -= quantity
-            db.session.commit()
-            flash(f'Berhasil menghapus {quantity} stok dari {product.name}', 'success')
+            # Re-checked in the write, since a checkout may have sold stock meanwhile
+            def remove_stock():
+                stored = db.session.get(Product, product_id)
+                if stored is None or stored.stock < quantity:
+                    return False
+                stored.stock -= quantity
+                catalog.mark_changed(stored)
+                return True
+            
+            if db_writer.run(remove_stock):
+                flash(f'Berhasil menghapus {quantity} stok dari {product.name}', 'success')
+            else:
+                flash('Jumlah yang dihapus tidak boleh lebih dari stok tersedia', 'error')
             
     except ValueError:
         flash('Jumlah tidak valid', 'error')
@@ -682,7 +1054,16 @@ def edit_user(user_id):
                     return redirect(url_for('edit_user', user_id=user_id))
                 user.password_hash = generate_password_hash(new_password)
             
+            user_version = principals.revoke_sessions(user)
             db.session.commit()
+            principals.cache.invalidate(user.id)
+            
+            # Keep the admin logged in when editing their own account
+            if user.id == session.get('user_id'):
+                session['username'] = user.username
+                session['user_role'] = user.role
+                session['user_version'] = user_version
+            
             flash('Data user berhasil diubah', 'success')
             return redirect(url_for('user_management'))
             
@@ -750,7 +1131,9 @@ def toggle_user_status(user_id):
             flash('Tidak dapat menonaktifkan akun sendiri', 'error')
         else:
             user.is_active = not user.is_active
+            principals.revoke_sessions(user)
             db.session.commit()
+            principals.cache.invalidate(user.id)
             status = 'diaktifkan' if user.is_active else 'dinonaktifkan'
             flash(f'User {user.username} berhasil {status}', 'success')
             
@@ -760,15 +1143,147 @@ def toggle_user_status(user_id):
     
     return redirect(url_for('user_management'))
 
+@app.cli.command('rebuild-rollups')
+@click.option('--start', type=click.DateTime(formats=['%Y-%m-%d']), help='First day to rebuild (default: all history)')
+@click.option('--end', type=click.DateTime(formats=['%Y-%m-%d']), help='Day after the last day to rebuild')
+def rebuild_rollups_command(start, end):
+    """Rebuild/backfill the sales rollup tables from transaction history"""
+    sales_rows, product_rows = rollups.rebuild_rollups(start, end)
+    click.echo(f"Rollups rebuilt: {sales_rows} sales rows, {product_rows} product rows")
+
+@app.cli.command('export-transactions')
+@click.option('--format', 'fmt', type=click.Choice(exports.FORMATS), default='csv')
+@click.option('--start', help='First day to export (YYYY-MM-DD)')
+@click.option('--end', help='Last day to export (YYYY-MM-DD)')
+@click.option('--gzip', 'compress', is_flag=True, help='Compress the output with gzip')
+@click.option('--output', type=click.File('wb'), default='-', help='Output file (default: stdout)')
+def export_transactions_command(fmt, start, end, compress, output):
+    """Export transactions with their items as CSV or NDJSON"""
+    start_at, end_at = parse_date_range(start, end)
+    for chunk in exports.export_transactions(fmt, start_at, end_at, compress, archive=sales_archive_store):
+        output.write(chunk)
+
+@app.cli.command('z-report')
+@click.option('--start', help='First day of the report (YYYY-MM-DD, default: today)')
+@click.option('--end', help='Last day of the report (default: same as --start)')
+@click.option('--cashier', help='Only include sales by this cashier')
+@click.option('--output', type=click.Path(dir_okay=False), required=True, help='PDF file to write')
+def z_report_command(start, end, cashier, output):
+    """Write the end-of-day Z-report and all receipts of the period to one PDF"""
+    from datetime import date
+    import z_report
+    
+    start = start or date.today().isoformat()
+    start_at, end_at = parse_date_range(start, end or start)
+    summary = z_report.ZReportGenerator().generate_report(start_at, end_at, output, cashier=cashier,
+                                                          archive=sales_archive_store)
+    click.echo(f"Z-report written to {output}: {summary['transaction_count']} transactions, "
+               f"total {format_currency(summary['total'])}")
+
+@app.cli.command('receipts-maintain')
+def receipts_maintain_command():
+    """Pack finished days into archives (if enabled) and evict old receipt PDFs"""
+    packed, evicted = receipt_storage.maintain()
+    click.echo(f"Receipt store: {packed} files archived, {evicted} files evicted")
+
+@app.cli.command('generate-sales')
+@click.option('--start', type=click.DateTime(formats=['%Y-%m-%d']), required=True, help='First day to generate')
+@click.option('--days', type=int, default=365, show_default=True, help='Number of days to generate')
+@click.option('--per-day', type=int, default=300, show_default=True, help='Average sales per day')
+@click.option('--seed', type=int, help='Random seed for reproducible data')
+@click.option('--batch-size', type=int, default=50000, show_default=True, help='Item rows per insert batch')
+def generate_sales_command(start, days, per_day, seed, batch_size):
+    """Bulk-generate synthetic sales history for scale testing"""
+    def progress(day, transactions, items):
+        click.echo(f"{day.isoformat()}: {transactions} transactions, {items} items")
+    
+    transactions, items = synthetic_data.generate_sales(start.date(), days, per_day, seed=seed,
+                                                        batch_size=batch_size, progress=progress)
+    click.echo(f"Generated {transactions} transactions with {items} items")
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create missing tables, apply migrations and seed default users and products"""
+    try:
+        init_database()
+    except migrations.MigrationError as e:
+        click.echo(f"Migration failed: {e}", err=True)
+        raise SystemExit(1)
+    click.echo("Database initialized")
+
+@app.cli.command('partitions-maintain')
+@click.option('--keep-months', type=int, default=partitions.KEEP_MONTHS, show_default=True,
+              help='Full months kept in the live tables before the current one')
+@click.option('--ahead', type=int, default=partitions.MONTHS_AHEAD, show_default=True,
+              help='Months of partitions created in advance (PostgreSQL)')
+def partitions_maintain_command(keep_months, ahead):
+    """Create upcoming sales partitions and move old months to the archive"""
+    result = partitions.maintain(sales_archive_store, keep_months=keep_months, ahead=ahead)
+    for name in result['created']:
+        click.echo(f"Created partition {name}")
+    for name in result['dropped']:
+        click.echo(f"Detached and dropped partition {name}")
+    for month, count in sorted(result['archived'].items()):
+        click.echo(f"Archived {month}: {count} transactions")
+    if not any(result.values()):
+        click.echo("Nothing to do")
+
+@app.cli.command('replica-status')
+def replica_status_command():
+    """Show whether a read replica is configured and how far it lags"""
+    state = replicas.status()
+    if not state['configured']:
+        click.echo("No read replica configured (DATABASE_REPLICA_URL); reads use the primary")
+    elif state['lag_seconds'] is None:
+        click.echo("Read replica unavailable; reads use the primary")
+    else:
+        click.echo(f"Read replica lag: {state['lag_seconds']:.1f}s")
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Apply pending schema migrations"""
+    db.create_all()
+    try:
+        applied = migrations.run_migrations()
+    except migrations.MigrationError as e:
+        click.echo(f"Migration failed: {e}", err=True)
+        raise SystemExit(1)
+    for version, name in applied:
+        click.echo(f"Applied migration {version}: {name}")
+    if not applied:
+        click.echo("Database schema is up to date")
+
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    """Fail if a dashboard query falls back to a sequential scan"""
+    admin = User.query.filter_by(role='admin', is_active=True).first()
+    
+    def render_dashboard():
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess['username'] = admin.username
+                sess['user_id'] = admin.id
+                sess['user_version'] = admin.session_version
+            for path in ('/sales-history', '/api/sales-chart-data?type=daily',
+                         '/api/sales-chart-data?type=hourly', '/api/sales-chart-data?type=products'):
+                client.get(path)
+
+    offenders = migrations.find_sequential_scans(render_dashboard)
+    for statement, line in offenders:
+        click.echo(f"{line}\n    {' '.join(statement.split())}")
+    if offenders:
+        raise SystemExit(1)
+    click.echo("All dashboard queries use indexes")
+    if Transaction.query.first() is None:
+        click.echo("No sales in this database, so the plans prove little: "
+                   "benchmarks/check_query_plans.py checks a seeded one")
+
 # Template filters
 @app.template_filter('currency')
 def currency_filter(amount):
     """Template filter for currency formatting"""
     return format_currency(amount)
 
-# Initialize database when module is imported
-with app.app_context():
-    init_database()
-
 if __name__ == '__main__':
+    init_database()
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,223 @@
+"""
+In-process metrics exposed in the Prometheus text format.
+
+init_app() hooks Flask's before/after request and SQLAlchemy's cursor
+events to record, per endpoint, request latency, the number of SQL
+statements and the time spent in them. It also times connection pool
+checkouts and logs statements slower than SLOW_QUERY_THRESHOLD_MS.
+Receipt rendering reports into RECEIPT_RENDER_SECONDS.
+
+Metrics live in the memory of each process: under gunicorn every worker
+reports its own numbers, so scrape the workers individually or sum them
+in Prometheus.
+"""
+import logging
+import os
+import re
+import threading
+import time
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+# Histogram bucket upper bounds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+SLOW_QUERY_THRESHOLD_MS = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 200))
+
+slow_query_log = logging.getLogger('kasir.slow_query')
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = dict(self.values)
+        for label_values, value in sorted(values.items()):
+            yield self.name, _format_labels(self.labels, label_values), value
+
+class Histogram:
+    """Cumulative histogram with optional labels"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self.values = {}  # label values -> [bucket counts..., sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, *label_values, value):
+        with self.lock:
+            entry = self.values.get(label_values)
+            if entry is None:
+                entry = self.values[label_values] = [0] * len(self.buckets) + [0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[index] += 1
+                    break
+            entry[-2] += value
+            entry[-1] += 1
+
+    def samples(self):
+        with self.lock:
+            values = {key: list(entry) for key, entry in self.values.items()}
+        for label_values, entry in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry):
+                cumulative += count
+                labels = _format_labels(self.labels + ('le',), label_values + (_format_number(bound),))
+                yield f'{self.name}_bucket', labels, cumulative
+            labels = _format_labels(self.labels, label_values)
+            yield f'{self.name}_sum', labels, entry[-2]
+            yield f'{self.name}_count', labels, entry[-1]
+
+class Registry:
+    """The set of metrics rendered by /metrics"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {_format_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.register(Histogram(
+    'kasir_http_request_duration_seconds', 'Request latency by endpoint',
+    labels=('endpoint', 'method', 'status')))
+REQUEST_QUERIES = registry.register(Histogram(
+    'kasir_http_request_queries', 'SQL statements executed per request',
+    labels=('endpoint',), buckets=COUNT_BUCKETS))
+REQUEST_QUERY_SECONDS = registry.register(Histogram(
+    'kasir_http_request_query_duration_seconds', 'Time spent in SQL per request',
+    labels=('endpoint',)))
+QUERY_SECONDS = registry.register(Histogram(
+    'kasir_db_query_duration_seconds', 'Latency of single SQL statements'))
+SLOW_QUERIES = registry.register(Counter(
+    'kasir_db_slow_queries_total', 'Statements slower than the slow query threshold',
+    labels=('endpoint',)))
+POOL_CHECKOUT_SECONDS = registry.register(Histogram(
+    'kasir_db_pool_checkout_duration_seconds', 'Time spent waiting for a pooled connection'))
+RECEIPT_RENDER_SECONDS = registry.register(Histogram(
+    'kasir_receipt_render_duration_seconds', 'Receipt PDF render time',
+    labels=('mode',)))
+REPLICA_REQUESTS = registry.register(Counter(
+    'kasir_db_replica_requests_total', 'Requests of read-only routes by the database that served them',
+    labels=('endpoint', 'target')))
+
+def _endpoint():
+    """Endpoint of the current request, or 'none' outside of requests"""
+    if has_request_context():
+        return request.endpoint or 'unmatched'
+    return 'none'
+
+def _before_request():
+    g.metrics_started = time.perf_counter()
+    g.metrics_queries = 0
+    g.metrics_query_seconds = 0.0
+
+def _after_request(response):
+    started = g.pop('metrics_started', None)
+    if started is not None:
+        endpoint = _endpoint()
+        REQUEST_SECONDS.observe(endpoint, request.method, response.status_code,
+                                value=time.perf_counter() - started)
+        REQUEST_QUERIES.observe(endpoint, value=g.pop('metrics_queries', 0))
+        REQUEST_QUERY_SECONDS.observe(endpoint, value=g.pop('metrics_query_seconds', 0.0))
+    return response
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stack = conn.info.get('metrics_started')
+    if not stack:
+        return
+    elapsed = time.perf_counter() - stack.pop()
+    QUERY_SECONDS.observe(value=elapsed)
+
+    endpoint = _endpoint()
+    if has_request_context() and 'metrics_started' in g:
+        g.metrics_queries += 1
+        g.metrics_query_seconds += elapsed
+
+    if SLOW_QUERY_THRESHOLD_MS and elapsed * 1000 >= SLOW_QUERY_THRESHOLD_MS:
+        SLOW_QUERIES.inc(endpoint)
+        statement = re.sub(r'\s+', ' ', statement)[:1000]
+        slow_query_log.warning(f"{elapsed * 1000:.1f} ms [{endpoint}] {statement}")
+
+def _handle_error(exception_context):
+    # A failed statement never reaches after_cursor_execute
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('metrics_started'):
+        connection.info['metrics_started'].pop()
+
+def _time_pool_checkout(engine):
+    """Wrap engine.raw_connection, which every new Connection goes through.
+
+    Wrapping the engine rather than its pool survives engine.dispose().
+    """
+    raw_connection = engine.raw_connection
+
+    def timed_raw_connection(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return raw_connection(*args, **kwargs)
+        finally:
+            POOL_CHECKOUT_SECONDS.observe(value=time.perf_counter() - started)
+
+    engine.raw_connection = timed_raw_connection
+
+def init_app(app, db):
+    """Install the request hooks and the SQLAlchemy listeners"""
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    with app.app_context():
+        engines = list(db.engines.values())
+    # The primary and, if configured, the read replica
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(engine, 'handle_error', _handle_error)
+        _time_pool_checkout(engine)
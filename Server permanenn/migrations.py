@@ -0,0 +1,195 @@
+"""
+Versioned schema migrations.
+
+`db.create_all()` only creates missing tables, so changes to existing tables
+(new indexes, new columns) are applied here. Each migration runs once, in
+order, and is recorded in the `schema_migrations` table.
+"""
+import logging
+from datetime import datetime
+from sqlalchemy import event, func, inspect, select
+from models import db, User, Product, Transaction, TransactionItem, TransactionKey, ProductSalesRollup, SchemaMigration
+import partitions
+
+class MigrationError(Exception):
+    """The data does not allow a migration yet; the message says what to fix"""
+
+def _require_unique(table, name):
+    """Build a migration step that stops while a column holds duplicate values"""
+    def migrate(connection):
+        column = table.c[name]
+        duplicates = connection.execute(
+            select(column, func.count()).where(column.isnot(None))
+            .group_by(column).having(func.count() > 1).order_by(column)
+        ).all()
+        if duplicates:
+            listed = ', '.join(f"'{value}' ({count}x)" for value, count in duplicates)
+            raise MigrationError(f"Rename or merge the duplicate {table.name}.{name} values "
+                                 f"before the unique index can be created: {listed}")
+    return migrate
+
+def _create_indexes(*names):
+    """Build a migration that creates the named model indexes if they are missing"""
+    tables = (Product.__table__, Transaction.__table__, TransactionItem.__table__)
+
+    def migrate(connection):
+        indexes = {index.name: index for table in tables for index in table.indexes}
+        for name in names:
+            indexes[name].create(bind=connection, checkfirst=True)
+    return migrate
+
+def _add_column(table, name):
+    """Build a migration that adds a model column to an existing table if it is missing"""
+    def migrate(connection):
+        existing = {column['name'] for column in inspect(connection).get_columns(table.name)}
+        if name in existing:
+            return
+        column = table.c[name]
+        ddl = f'ALTER TABLE {table.name} ADD COLUMN {name} {column.type.compile(dialect=connection.dialect)}'
+        if column.server_default is not None:
+            ddl += f" DEFAULT '{column.server_default.arg}'"
+        connection.exec_driver_sql(ddl)
+    return migrate
+
+def _backfill_transaction_keys(connection):
+    """Copy the keys of the sales already recorded into transaction_keys"""
+    TransactionKey.__table__.create(bind=connection, checkfirst=True)
+    connection.exec_driver_sql(
+        'INSERT INTO transaction_keys (transaction_id, idempotency_key, receipt_number) '
+        'SELECT id, idempotency_key, receipt_number FROM transactions '
+        'WHERE (idempotency_key IS NOT NULL OR receipt_number IS NOT NULL) '
+        'AND id NOT IN (SELECT transaction_id FROM transaction_keys)')
+
+def _key_product_rollups_by_category(connection):
+    """Add the category to the unique key of product_sales_rollups, keeping its rows"""
+    table = ProductSalesRollup.__table__
+    constraint = next(c for c in table.constraints if c.name == 'uq_product_sales_rollups_bucket_category')
+    existing = {c['name'] for c in inspect(connection).get_unique_constraints(table.name)}
+    if constraint.name in existing:
+        return
+    columns = ', '.join(column.name for column in constraint.columns)
+    if connection.dialect.name == 'sqlite':
+        # SQLite cannot drop a constraint: copy the rows into a new table
+        connection.exec_driver_sql(f'ALTER TABLE {table.name} RENAME TO {table.name}_old')
+        table.create(bind=connection)
+        copied = ', '.join(column.name for column in table.columns if column.name != 'id')
+        connection.exec_driver_sql(f'INSERT INTO {table.name} ({copied}) SELECT {copied} FROM {table.name}_old')
+        connection.exec_driver_sql(f'DROP TABLE {table.name}_old')
+    else:
+        connection.exec_driver_sql(f'ALTER TABLE {table.name} DROP CONSTRAINT uq_product_sales_rollups_bucket')
+        connection.exec_driver_sql(f'ALTER TABLE {table.name} ADD CONSTRAINT {constraint.name} UNIQUE ({columns})')
+
+def _steps(*steps):
+    """Combine several migration functions into one migration"""
+    def migrate(connection):
+        for step in steps:
+            step(connection)
+    return migrate
+
+# (version, name, function taking a connection), in the order they must run
+MIGRATIONS = [
+    (1, 'add_query_indexes', _create_indexes(
+        'ix_products_category',
+        'ix_transactions_date_cashier',
+        'ix_transactions_cashier_date',
+        'ix_transaction_items_transaction_id',
+        'ix_transaction_items_product_id',
+    )),
+    (2, 'add_transactions_keyset_index', _create_indexes('ix_transactions_date_id')),
+    (3, 'add_transactions_receipt_number', _steps(
+        _add_column(Transaction.__table__, 'receipt_number'),
+        _create_indexes('ix_transactions_receipt_number'),
+    )),
+    (4, 'add_transactions_idempotency_key', _steps(
+        _add_column(Transaction.__table__, 'idempotency_key'),
+        _create_indexes('ix_transactions_idempotency_key'),
+    )),
+    (5, 'add_products_catalog_version', _steps(
+        _add_column(Product.__table__, 'catalog_version'),
+        _create_indexes('ix_products_catalog_version'),
+    )),
+    (6, 'add_users_session_version', _add_column(User.__table__, 'session_version')),
+    (7, 'add_products_name_unique_index', _steps(
+        _require_unique(Product.__table__, 'name'),
+        _create_indexes('ix_products_name'),
+    )),
+    (8, 'partition_sales_tables', partitions.partition_tables),
+    (9, 'add_products_sku', _steps(
+        _add_column(Product.__table__, 'sku'),
+        _create_indexes('ix_products_sku'),
+    )),
+    (10, 'add_transaction_keys', _backfill_transaction_keys),
+    (11, 'add_transaction_items_category', _add_column(TransactionItem.__table__, 'category')),
+    (12, 'key_product_rollups_by_category', _key_product_rollups_by_category),
+]
+
+def applied_versions():
+    """Versions already recorded in schema_migrations"""
+    SchemaMigration.__table__.create(bind=db.engine, checkfirst=True)
+    return {version for (version,) in db.session.query(SchemaMigration.version).all()}
+
+def pending_migrations():
+    """Migrations that have not been applied yet"""
+    applied = applied_versions()
+    return [migration for migration in MIGRATIONS if migration[0] not in applied]
+
+def run_migrations():
+    """Apply all pending migrations, each in its own transaction"""
+    pending = pending_migrations()
+    for version, name, migrate in pending:
+        try:
+            migrate(db.session.connection())
+            db.session.add(SchemaMigration(version=version, name=name, applied_at=datetime.utcnow()))
+            db.session.commit()
+            logging.info(f"Migration {version} ({name}) applied")
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Migration {version} ({name}) failed: {str(e)}")
+            raise
+    return [(version, name) for version, name, _ in pending]
+
+def _explain(connection, statement, parameters):
+    """Return the query plan lines for a raw SQL statement"""
+    if connection.dialect.name == 'postgresql':
+        # Tiny test tables are always cheaper to scan, so force the planner to
+        # show whether an index *can* be used.
+        connection.exec_driver_sql('SET LOCAL enable_seqscan = off')
+        rows = connection.exec_driver_sql('EXPLAIN ' + statement, parameters).fetchall()
+        return [row[0] for row in rows]
+
+    rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+    return [row[-1] for row in rows]
+
+def _is_sequential_scan(line):
+    """True when a plan line reads a whole table without an index"""
+    if 'Seq Scan' in line:
+        return True
+    # SQLite: "SCAN transactions" is a full scan, "SCAN ... USING INDEX" is not
+    return line.startswith('SCAN ') and 'USING' not in line and 'CONSTANT ROW' not in line
+
+def find_sequential_scans(callback):
+    """Run callback() and EXPLAIN every SELECT it issues.
+
+    Returns a list of (statement, plan line) pairs for queries that fall back
+    to a sequential scan.
+    """
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            captured.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', capture)
+    try:
+        callback()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', capture)
+
+    offenders = []
+    with db.engine.connect() as connection:
+        for statement, parameters in captured:
+            with connection.begin():
+                for line in _explain(connection, statement, parameters):
+                    if _is_sequential_scan(line):
+                        offenders.append((statement, line))
+    return offenders
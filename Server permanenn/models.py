@@ -1,7 +1,9 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+from replicas import RoutingSession
 
-db = SQLAlchemy()
+# RoutingSession sends the reads of @replicas.read_only routes to the replica bind
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class User(db.Model):
     """User model for authentication and role management"""
@@ -12,6 +14,7 @@ class User(db.Model):
     password_hash = db.Column(db.String(256), nullable=False)
     role = db.Column(db.String(20), nullable=False, default='cashier')  # 'admin' or 'cashier'
     is_active = db.Column(db.Boolean, default=True)
+    session_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Bumped to revoke sessions
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     def to_dict(self):
@@ -26,12 +29,18 @@ class User(db.Model):
 class Product(db.Model):
     """Product model for inventory management"""
     __tablename__ = 'products'
+    __table_args__ = (
+        db.Index('ix_products_name', 'name', unique=True),
+        db.Index('ix_products_sku', 'sku', unique=True),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
+    sku = db.Column(db.String(64))  # SKU or barcode, unique when set (see product_search.py)
     price = db.Column(db.Float, nullable=False)
     stock = db.Column(db.Integer, nullable=False, default=0)
-    category = db.Column(db.String(50), nullable=False)
+    category = db.Column(db.String(50), nullable=False, index=True)
+    catalog_version = db.Column(db.Integer, nullable=False, default=0, server_default='0', index=True)  # See catalog.py
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -42,6 +51,7 @@ class Product(db.Model):
         return {
             'id': self.id,
             'name': self.name,
+            'sku': self.sku,
             'price': self.price,
             'stock': self.stock,
             'category': self.category,
@@ -52,10 +62,19 @@ class Product(db.Model):
 class Transaction(db.Model):
     """Transaction model for sales records"""
     __tablename__ = 'transactions'
+    __table_args__ = (
+        db.Index('ix_transactions_date_cashier', 'date', 'cashier'),
+        db.Index('ix_transactions_cashier_date', 'cashier', 'date'),
+        db.Index('ix_transactions_date_id', 'date', 'id'),
+        db.Index('ix_transactions_receipt_number', 'receipt_number', unique=True),
+        db.Index('ix_transactions_idempotency_key', 'idempotency_key', unique=True),
+    )
     
     id = db.Column(db.String(50), primary_key=True)
     date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     cashier = db.Column(db.String(64), nullable=False)
+    receipt_number = db.Column(db.String(40))  # Per-outlet daily number, e.g. GCN-20241017-0042
+    idempotency_key = db.Column(db.String(64))  # Client key for sales synced from the offline queue
     subtotal = db.Column(db.Float, nullable=False)
     discount = db.Column(db.Float, default=0)
     total = db.Column(db.Float, nullable=False)
@@ -65,27 +84,44 @@ class Transaction(db.Model):
     # Relationship with transaction items
     items = db.relationship('TransactionItem', backref='transaction', lazy=True, cascade='all, delete-orphan')
     
-    def to_dict(self):
+    def to_dict(self, items=None):
+        # Pass pre-fetched items to avoid lazy loading them one transaction at a time
+        if items is None:
+            items = self.items
         return {
             'id': self.id,
             'date': self.date.isoformat() if self.date else None,
             'cashier': self.cashier,
+            'receipt_number': self.receipt_number,
             'subtotal': self.subtotal,
             'discount': self.discount,
             'total': self.total,
             'payment': self.payment,
             'change': self.change,
-            'items': [item.to_dict() for item in self.items]
+            'items': [item.to_dict() for item in items]
         }
 
+class TransactionKey(db.Model):
+    """Idempotency key and receipt number of a sale, unique across all months.
+
+    Not partitioned and not archived (see partitions.py), so these stay
+    unique after the sale's month is moved to the archive.
+    """
+    __tablename__ = 'transaction_keys'
+    
+    transaction_id = db.Column(db.String(50), primary_key=True)
+    idempotency_key = db.Column(db.String(64), unique=True)
+    receipt_number = db.Column(db.String(40), unique=True)
+
 class TransactionItem(db.Model):
     """Transaction item model for individual product sales within a transaction"""
     __tablename__ = 'transaction_items'
     
     id = db.Column(db.Integer, primary_key=True)
-    transaction_id = db.Column(db.String(50), db.ForeignKey('transactions.id'), nullable=False)
-    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    transaction_id = db.Column(db.String(50), db.ForeignKey('transactions.id'), nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False, index=True)
     product_name = db.Column(db.String(100), nullable=False)  # Store name for historical records
+    category = db.Column(db.String(50))  # Category at time of sale (empty for sales before it was stored)
     price = db.Column(db.Float, nullable=False)  # Store price at time of sale
     quantity = db.Column(db.Integer, nullable=False)
     subtotal = db.Column(db.Float, nullable=False)
@@ -96,7 +132,71 @@ class TransactionItem(db.Model):
             'transaction_id': self.transaction_id,
             'product_id': self.product_id,
             'product_name': self.product_name,
+            'category': self.category,
             'price': self.price,
             'quantity': self.quantity,
             'subtotal': self.subtotal
         }
+
+class SalesRollup(db.Model):
+    """Pre-aggregated sales totals per hour/day bucket and cashier"""
+    __tablename__ = 'sales_rollups'
+    __table_args__ = (
+        db.UniqueConstraint('granularity', 'bucket', 'cashier', name='uq_sales_rollups_bucket'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    granularity = db.Column(db.String(10), nullable=False)  # 'hour' or 'day'
+    bucket = db.Column(db.DateTime, nullable=False)  # Start of the hour/day
+    cashier = db.Column(db.String(64), nullable=False)
+    transaction_count = db.Column(db.Integer, nullable=False, default=0)
+    subtotal = db.Column(db.Float, nullable=False, default=0)
+    discount = db.Column(db.Float, nullable=False, default=0)
+    total = db.Column(db.Float, nullable=False, default=0)
+
+class ProductSalesRollup(db.Model):
+    """Pre-aggregated product sales per hour/day bucket and category at time of sale"""
+    __tablename__ = 'product_sales_rollups'
+    __table_args__ = (
+        db.UniqueConstraint('granularity', 'bucket', 'product_id', 'product_name', 'category',
+                            name='uq_product_sales_rollups_bucket_category'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    granularity = db.Column(db.String(10), nullable=False)  # 'hour' or 'day'
+    bucket = db.Column(db.DateTime, nullable=False)  # Start of the hour/day
+    product_id = db.Column(db.Integer, nullable=False)
+    product_name = db.Column(db.String(100), nullable=False)
+    category = db.Column(db.String(50), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+
+class CatalogState(db.Model):
+    """Single-row counter bumped on every product change (see catalog.py)"""
+    __tablename__ = 'catalog_state'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class CatalogDeletion(db.Model):
+    """Tombstone for a deleted product, so terminals can drop it on delta sync"""
+    __tablename__ = 'catalog_deletions'
+    
+    product_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    version = db.Column(db.Integer, nullable=False, index=True)
+
+class ReceiptCounter(db.Model):
+    """Last receipt number handed out per outlet and day"""
+    __tablename__ = 'receipt_counters'
+    
+    outlet = db.Column(db.String(20), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    last_number = db.Column(db.Integer, nullable=False, default=0)
+
+class SchemaMigration(db.Model):
+    """Applied schema migrations (see migrations.py)"""
+    __tablename__ = 'schema_migrations'
+    
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(100), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -0,0 +1,269 @@
+"""
+Monthly partitions of the sales tables, and moving old months to the archive.
+
+PostgreSQL: migration 8 turns `transactions` and `transaction_items` into
+tables partitioned by RANGE on the transaction id. IDs start with their
+creation time (see transaction_ids.py), so each month is one contiguous id
+range, and a sale and its items always land in the partitions of the same
+month. The primary key and the items' foreign key keep working without
+adding a date column to `transaction_items`. Rows from before the
+migration (including old `TRX-<unix time>` ids) stay in a DEFAULT
+partition, `<table>_legacy`.
+
+`flask partitions-maintain`, run daily or at least monthly:
+
+* creates the partitions of the current month and the next `ahead` months,
+  so checkouts never land in the default partition;
+* copies every sale dated before the cutoff (the start of the month
+  `keep_months` back) into the cold archive (sales_archive.py), which is
+  read by date;
+* detaches and drops the partitions of months before the cutoff once all
+  their rows are archived: no DELETE, no table bloat, and the remaining
+  partitions keep their indexes small. An id is never older than its
+  sale's date, so these partitions only hold sales dated before the
+  cutoff; a partition still holding a later sale is kept;
+* deletes the sales dated before the cutoff that sit in newer partitions
+  (offline sales synced late) or in the default partition.
+
+SQLite has no partitions. There, maintenance copies old months to the
+archive and deletes them from the live tables, in batches per month.
+
+The unique indexes of a partition only cover its month. Idempotency keys
+and receipt numbers are also written to the unpartitioned
+`transaction_keys` table, which is never archived, so they stay unique
+across all months.
+
+Rollups (rollups.py) are not touched, so the dashboard totals still include
+archived months. The in-memory analytics (analytics.py) only see live rows.
+"""
+import logging
+from datetime import datetime
+from sqlalchemy import and_, func, or_, select
+from models import db, Transaction, TransactionItem
+import db_writer
+import sales_archive
+import transaction_ids
+
+LEGACY_SUFFIX = '_legacy'
+
+# Partitions created ahead of time and full months kept live by default
+MONTHS_AHEAD = 2
+KEEP_MONTHS = 12
+
+# Transactions copied to the archive per round trip, and ids per DELETE
+BATCH_SIZE = 2000
+DELETE_CHUNK = 500
+
+def month_start(moment):
+    return datetime(moment.year, moment.month, 1)
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1)
+
+def bound_id(month):
+    """Smallest transaction id that can be generated on or after the start of a month"""
+    millis = int(month.timestamp() * 1000)
+    return transaction_ids.PREFIX + transaction_ids.encode(
+        millis << (transaction_ids.WORKER_BITS + transaction_ids.SEQUENCE_BITS))
+
+def partition_name(table, month):
+    return f"{table}_p{month:%Y%m}"
+
+def _is_partitioned(connection, table):
+    return connection.exec_driver_sql(
+        "SELECT relkind FROM pg_class WHERE oid = to_regclass(%(table)s)", {'table': table}
+    ).scalar() == 'p'
+
+def _exists(connection, table):
+    return connection.exec_driver_sql("SELECT to_regclass(%(table)s)", {'table': table}).scalar() is not None
+
+def partition_tables(connection):
+    """Migration: partition the sales tables by month (PostgreSQL only, no-op elsewhere)"""
+    if connection.dialect.name != 'postgresql' or _is_partitioned(connection, 'transactions'):
+        return
+
+    # Foreign keys of the items move to the partitioned parent
+    for (name,) in connection.exec_driver_sql(
+            "SELECT conname FROM pg_constraint WHERE conrelid = 'transaction_items'::regclass AND contype = 'f'"
+    ).fetchall():
+        connection.exec_driver_sql(f'ALTER TABLE transaction_items DROP CONSTRAINT "{name}"')
+
+    for table in ('transactions', 'transaction_items'):
+        legacy = table + LEGACY_SUFFIX
+        connection.exec_driver_sql(f'ALTER TABLE {table} RENAME TO {legacy}')
+        # Free the index names (and the primary key's) for the parent
+        for (name,) in connection.exec_driver_sql(
+                "SELECT indexname FROM pg_indexes WHERE tablename = %(table)s", {'table': legacy}
+        ).fetchall():
+            connection.exec_driver_sql(f'ALTER INDEX "{name}" RENAME TO "{name}{LEGACY_SUFFIX}"')
+
+    connection.exec_driver_sql(
+        'CREATE TABLE transactions (LIKE transactions_legacy INCLUDING DEFAULTS) PARTITION BY RANGE (id)')
+    connection.exec_driver_sql('ALTER TABLE transactions ADD PRIMARY KEY (id)')
+    connection.exec_driver_sql(
+        'CREATE TABLE transaction_items (LIKE transaction_items_legacy INCLUDING DEFAULTS) '
+        'PARTITION BY RANGE (transaction_id)')
+    # A primary key of a partitioned table must contain the partition key
+    connection.exec_driver_sql('ALTER TABLE transaction_items ADD PRIMARY KEY (id, transaction_id)')
+    connection.exec_driver_sql('ALTER TABLE transaction_items ADD FOREIGN KEY (transaction_id) REFERENCES transactions (id)')
+    connection.exec_driver_sql('ALTER TABLE transaction_items ADD FOREIGN KEY (product_id) REFERENCES products (id)')
+
+    # Unique indexes must contain the partition key too: the parents get plain
+    # ones and every partition its own unique index (see ensure_partitions)
+    for table in (Transaction.__table__, TransactionItem.__table__):
+        for index in table.indexes:
+            columns = ', '.join(column.name for column in index.columns)
+            connection.exec_driver_sql(f'CREATE INDEX {index.name} ON {table.name} ({columns})')
+
+    sequence = connection.exec_driver_sql("SELECT pg_get_serial_sequence('transaction_items_legacy', 'id')").scalar()
+    if sequence:
+        connection.exec_driver_sql(f'ALTER SEQUENCE {sequence} OWNED BY transaction_items.id')
+
+    primary_key = connection.exec_driver_sql(
+        "SELECT conname FROM pg_constraint WHERE conrelid = 'transaction_items_legacy'::regclass AND contype = 'p'"
+    ).scalar()
+    if primary_key:
+        connection.exec_driver_sql(f'ALTER TABLE transaction_items_legacy DROP CONSTRAINT "{primary_key}"')
+
+    connection.exec_driver_sql('ALTER TABLE transactions ATTACH PARTITION transactions_legacy DEFAULT')
+    connection.exec_driver_sql('ALTER TABLE transaction_items ATTACH PARTITION transaction_items_legacy DEFAULT')
+    ensure_partitions(connection)
+
+def ensure_partitions(connection, ahead=MONTHS_AHEAD, today=None):
+    """Create the partitions of the current and the next `ahead` months; returns their names.
+
+    A month whose ids already sit in the default partition (the month the
+    tables were partitioned in) is skipped; it is archived from there later.
+    """
+    created = []
+    month = month_start(today or datetime.now())
+    for _ in range(ahead + 1):
+        name = partition_name('transactions', month)
+        low, high = bound_id(month), bound_id(add_months(month, 1))
+        if _exists(connection, name):
+            pass
+        elif connection.exec_driver_sql(
+                f"SELECT 1 FROM transactions{LEGACY_SUFFIX} WHERE id >= %(low)s AND id < %(high)s LIMIT 1",
+                {'low': low, 'high': high}).first():
+            logging.info(f"Partition {name} not created: its rows are in the default partition")
+        else:
+            bounds = f"FOR VALUES FROM ('{low}') TO ('{high}')"
+            connection.exec_driver_sql(f'CREATE TABLE {name} PARTITION OF transactions {bounds}')
+            for index in Transaction.__table__.indexes:
+                if index.unique:
+                    columns = ', '.join(column.name for column in index.columns)
+                    connection.exec_driver_sql(f'CREATE UNIQUE INDEX {name}_{columns} ON {name} ({columns})')
+            connection.exec_driver_sql(
+                f"CREATE TABLE {partition_name('transaction_items', month)} PARTITION OF transaction_items {bounds}")
+            created.append(name)
+        month = add_months(month, 1)
+    return created
+
+def month_partitions(connection):
+    """(month, partition name) of the monthly transaction partitions, oldest first"""
+    rows = connection.exec_driver_sql(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'transactions'::regclass").fetchall()
+    partitions = []
+    for (name,) in rows:
+        try:
+            partitions.append((datetime.strptime(name.rsplit('_p', 1)[-1], '%Y%m'), name))
+        except ValueError:
+            continue  # the default partition
+    return sorted(partitions)
+
+def archive_rows(store, *conditions, delete=False):
+    """Copy the transactions matching conditions (with their items) into the archive.
+
+    Rows go to the archive file of the month of their date. With delete, each
+    month's copied rows are then deleted from the live tables; only rows that
+    were copied, so a sale synced meanwhile is never lost. Returns
+    {month: transactions archived}.
+    """
+    first, last = db.session.execute(
+        select(func.min(Transaction.date), func.max(Transaction.date)).where(*conditions)).one()
+    db.session.commit()
+    archived = {}
+    if first is None:
+        return archived
+
+    month = month_start(first)
+    while month <= last:
+        next_month = add_months(month, 1)
+        in_month = conditions + (Transaction.date >= month, Transaction.date < next_month)
+        copied = []
+        with store.writer(sales_archive.month_key(month)) as writer:
+            position = None
+            while True:
+                query = select(Transaction.__table__).where(*in_month)
+                if position:
+                    query = query.where(or_(Transaction.date > position[0],
+                                            and_(Transaction.date == position[0], Transaction.id > position[1])))
+                rows = db.session.execute(
+                    query.order_by(Transaction.date, Transaction.id).limit(BATCH_SIZE)).mappings().all()
+                if not rows:
+                    break
+                ids = [row['id'] for row in rows]
+                items = db.session.execute(select(TransactionItem.__table__).where(
+                    TransactionItem.transaction_id.in_(ids))).mappings().all()
+                writer.add([dict(row) for row in rows], [dict(item) for item in items])
+                copied.extend(ids)
+                position = (rows[-1]['date'], rows[-1]['id'])
+            db.session.commit()
+
+        if delete and copied:
+            db_writer.begin_immediate(db.session)
+            for i in range(0, len(copied), DELETE_CHUNK):
+                chunk = copied[i:i + DELETE_CHUNK]
+                db.session.execute(TransactionItem.__table__.delete().where(
+                    TransactionItem.transaction_id.in_(chunk)))
+                db.session.execute(Transaction.__table__.delete().where(Transaction.id.in_(chunk)))
+            db.session.commit()
+        if copied:
+            archived[sales_archive.month_key(month)] = len(copied)
+            logging.info(f"Archived {len(copied)} transactions of {month:%Y-%m}")
+        month = next_month
+    return archived
+
+def maintain(store, keep_months=KEEP_MONTHS, ahead=MONTHS_AHEAD, today=None):
+    """Create upcoming partitions and archive months older than keep_months.
+
+    Returns {'created': [...], 'dropped': [...], 'archived': {month: count}}.
+    """
+    cutoff = add_months(month_start(today or datetime.now()), -keep_months)
+    result = {'created': [], 'dropped': [], 'archived': {}}
+
+    connection = db.session.connection()
+    if connection.dialect.name == 'postgresql' and _is_partitioned(connection, 'transactions'):
+        result['created'] = ensure_partitions(connection, ahead, today)
+        partitions = month_partitions(connection)
+        db.session.commit()
+
+        for month, name in partitions:
+            if add_months(month, 1) > cutoff:
+                continue
+            in_partition = (Transaction.id >= bound_id(month), Transaction.id < bound_id(add_months(month, 1)))
+            for archived_month, count in archive_rows(store, *in_partition, Transaction.date < cutoff).items():
+                result['archived'][archived_month] = result['archived'].get(archived_month, 0) + count
+            if db.session.execute(select(Transaction.id).where(*in_partition, Transaction.date >= cutoff).limit(1)).first():
+                db.session.commit()
+                logging.warning(f"Partition {name} kept: it holds sales dated after {cutoff:%Y-%m-%d}")
+                continue
+            # Items first: their foreign key points into the transactions partition
+            items = partition_name('transaction_items', month)
+            connection = db.session.connection()
+            connection.exec_driver_sql(f'ALTER TABLE transaction_items DETACH PARTITION {items}')
+            connection.exec_driver_sql(f'ALTER TABLE transactions DETACH PARTITION {name}')
+            connection.exec_driver_sql(f'DROP TABLE {items}')
+            connection.exec_driver_sql(f'DROP TABLE {name}')
+            db.session.commit()
+            result['dropped'].append(name)
+            logging.info(f"Partition {name} archived and dropped")
+    else:
+        db.session.commit()
+
+    # SQLite, and old rows left in the default partition
+    for archived_month, count in archive_rows(store, Transaction.date < cutoff, delete=True).items():
+        result['archived'][archived_month] = result['archived'].get(archived_month, 0) + count
+    return result
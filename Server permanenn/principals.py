@@ -0,0 +1,85 @@
+"""
+Per-process cache of logged-in users for the auth decorators.
+
+require_login/require_admin look users up here instead of querying the
+database on every request. A user's `session_version` is copied into the
+session at login and bumped whenever the account is edited, deactivated or
+changes password; a mismatch means the session has been revoked. Entries
+expire after PRINCIPAL_CACHE_TTL seconds, so changes made by another worker
+process take effect within that window.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from models import db, User
+
+Principal = namedtuple('Principal', ['id', 'username', 'role', 'is_active', 'session_version'])
+
+CACHE_TTL = float(os.environ.get('PRINCIPAL_CACHE_TTL', 5))
+CACHE_SIZE = 1024
+
+class PrincipalCache:
+    """Thread-safe TTL + LRU mapping of user id -> Principal"""
+
+    def __init__(self, ttl=CACHE_TTL, max_size=CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, user_id):
+        """Cached principal, loading it from the database when missing or expired"""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry and entry[1] > now:
+                self.entries.move_to_end(user_id)
+                return entry[0]
+
+        principal = load_principal(user_id)
+        with self.lock:
+            self.entries[user_id] = (principal, now + self.ttl)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return principal
+
+    def invalidate(self, user_id):
+        """Drop a user so the next lookup reads the database"""
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def clear(self):
+        """Drop all cached principals"""
+        with self.lock:
+            self.entries.clear()
+
+def load_principal(user_id):
+    """Read a user's auth-relevant fields, or None if the user does not exist"""
+    user = db.session.get(User, user_id)
+    if user is None:
+        return None
+    return Principal(user.id, user.username, user.role, bool(user.is_active), user.session_version or 0)
+
+cache = PrincipalCache()
+
+def current_principal(session):
+    """Principal for a Flask session, or None if the session is missing or revoked"""
+    user_id = session.get('user_id')
+    if user_id is None:
+        return None
+    principal = cache.get(user_id)
+    if (principal is None or not principal.is_active
+            or principal.session_version != session.get('user_version', 0)):
+        return None
+    return principal
+
+def revoke_sessions(user):
+    """Bump a user's session version so existing sessions stop working.
+
+    Call before committing, then call cache.invalidate(user.id) after the
+    commit so this process does not keep serving the old principal.
+    """
+    user.session_version = (user.session_version or 0) + 1
+    return user.session_version
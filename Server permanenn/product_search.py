@@ -0,0 +1,206 @@
+"""
+In-memory product search and SKU/barcode lookup for the POS.
+
+Each process keeps an index of the catalog:
+
+* by_sku: normalized SKU/barcode -> product, a dict lookup for scanners;
+* prefixes: every prefix (up to PREFIX_LENGTH characters) of every word of
+  a product's name and SKU -> product ids, a flattened trie;
+* trigram postings: every 3-character slice of those padded words ->
+  product ids, for typos.
+
+A query matches the products where each of its words starts a word of the
+product: one dict lookup per query word and a set intersection, so "gaco 3"
+finds "Gacoan Level 3" whatever the size of the catalog. Shorter names rank
+first. When nothing matches that way, products sharing at least
+MIN_SIMILARITY of the query's trigrams are returned instead, most similar
+first, so "gacon" still finds "Gacoan".
+
+The index follows the catalog version (catalog.py). Every search compares
+it with the catalog's and applies only the products changed or deleted
+since then, so an edit, a stock movement or a checkout re-indexes a handful
+of products rather than the whole catalog.
+
+benchmarks/bench_search.py measures keystroke latency on a large catalog.
+"""
+import bisect
+import heapq
+import itertools
+import math
+import threading
+import unicodedata
+from collections import Counter
+from operator import itemgetter
+import catalog
+
+# Share of the query's trigrams a product must contain to match
+MIN_SIMILARITY = 0.5
+
+SKU_MAX_LENGTH = 64
+
+# Longest word prefix indexed; longer query words are checked per product
+PREFIX_LENGTH = 12
+
+EMPTY = frozenset()
+
+# Matches above 1/DENSE_MATCHES of the catalog are ranked by walking the full ranking
+DENSE_MATCHES = 8
+
+# Results returned by /api/products/search by default and at most
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+def normalize_sku(value):
+    """Canonical form of a SKU/barcode as stored and looked up, or None when empty"""
+    value = (value or '').strip().upper()
+    return value or None
+
+def normalize_text(text):
+    """Lowercase words without accents or punctuation"""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ''.join(char if char.isalnum() else ' ' for char in text.lower())
+
+def trigrams(word, prefix=False):
+    """Trigrams of a padded word; a prefix is not closed on the right"""
+    padded = f"  {word}" if prefix else f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def _post(postings, keys, product_id):
+    for key in keys:
+        postings.setdefault(key, set()).add(product_id)
+
+def _unpost(postings, keys, product_id):
+    for key in keys:
+        ids = postings[key]
+        ids.discard(product_id)
+        if not ids:
+            del postings[key]
+
+def _prefixes(words):
+    return {word[:length] for word in words for length in range(1, min(len(word), PREFIX_LENGTH) + 1)}
+
+class ProductIndex:
+    """Prefix, trigram and SKU index over the catalog, updated per catalog version"""
+
+    def __init__(self):
+        self.version = None
+        self.products = {}    # id -> product dict, as in /api/products
+        self.words = {}       # id -> normalized words of name and SKU
+        self.order = {}       # id -> rank among equal matches
+        self.ranked = []      # every order value, sorted
+        self.prefixes = {}    # word prefix -> set of ids
+        self.grams = {}       # id -> trigrams
+        self.postings = {}    # trigram -> set of ids
+        self.categories = {}  # category -> set of ids
+        self.by_sku = {}
+        self.lock = threading.Lock()
+
+    def _add(self, product):
+        product_id = product['id']
+        words = normalize_text(product['name']).split()
+        sku = normalize_sku(product.get('sku'))
+        if sku:
+            words.append(normalize_text(sku).replace(' ', ''))
+            self.by_sku[sku] = product_id
+        grams = set().union(*(trigrams(word) for word in words))
+        _post(self.prefixes, _prefixes(words), product_id)
+        _post(self.postings, grams, product_id)
+        _post(self.categories, [product['category']], product_id)
+        self.products[product_id] = product
+        self.words[product_id] = words
+        self.order[product_id] = (len(product['name']), product['name'].lower(), product_id)
+        bisect.insort(self.ranked, self.order[product_id])
+        self.grams[product_id] = grams
+
+    def _remove(self, product_id):
+        product = self.products.pop(product_id, None)
+        if product is None:
+            return
+        sku = normalize_sku(product.get('sku'))
+        if sku and self.by_sku.get(sku) == product_id:
+            del self.by_sku[sku]
+        _unpost(self.prefixes, _prefixes(self.words.pop(product_id)), product_id)
+        _unpost(self.postings, self.grams.pop(product_id), product_id)
+        _unpost(self.categories, [product['category']], product_id)
+        order = self.order.pop(product_id)
+        del self.ranked[bisect.bisect_left(self.ranked, order)]
+
+    def _rebuild(self):
+        snapshot = catalog.get_snapshot()
+        self.products, self.words, self.order, self.ranked, self.prefixes = {}, {}, {}, [], {}
+        self.grams, self.postings, self.categories, self.by_sku = {}, {}, {}, {}
+        for product in snapshot.products:
+            self._add(product)
+        self.version = snapshot.version
+
+    def refresh(self):
+        """Catch up with the catalog: the changes since our version, or everything the first time"""
+        version = catalog.current_version()
+        if version == self.version:
+            return
+        with self.lock:
+            if self.version is None or version < self.version:
+                self._rebuild()
+            elif version > self.version:
+                products, deleted = catalog.changes_since(self.version)
+                for product_id in deleted:
+                    self._remove(product_id)
+                for product in products:
+                    self._remove(product['id'])
+                    self._add(product)
+                self.version = version
+
+    def lookup(self, code):
+        """Product with this SKU/barcode, or None"""
+        self.refresh()
+        sku = normalize_sku(code)
+        with self.lock:
+            product_id = self.by_sku.get(sku)
+            return self.products.get(product_id) if product_id is not None else None
+
+    def search(self, query, limit=20, category=None):
+        """Best matching products for a partial or misspelt query, best first"""
+        self.refresh()
+        query_words = normalize_text(query).split()
+        if not query_words:
+            return []
+
+        with self.lock:
+            sets = sorted((self.prefixes.get(word[:PREFIX_LENGTH], EMPTY) for word in query_words), key=len)
+            matches = sets[0].intersection(*sets[1:])
+            if category:
+                matches &= self.categories.get(category, EMPTY)
+            long_words = [word for word in query_words if len(word) > PREFIX_LENGTH]
+            if long_words:
+                matches = {product_id for product_id in matches
+                           if all(any(word.startswith(query_word) for word in self.words[product_id])
+                                  for query_word in long_words)}
+            if len(matches) * DENSE_MATCHES > len(self.ranked):
+                # Most products match (short queries): walk the ranking until enough are found
+                found = list(itertools.islice(
+                    (order[-1] for order in self.ranked if order[-1] in matches), limit))
+            else:
+                found = [order[-1] for order in heapq.nsmallest(limit, map(self.order.__getitem__, matches))]
+            if not found and sum(map(len, query_words)) >= 3:
+                found = self._similar(query_words, limit, category)
+            return [self.products[product_id] for product_id in found]
+
+    def _similar(self, query_words, limit, category):
+        """Ids sharing at least MIN_SIMILARITY of the query's trigrams, most similar first"""
+        grams = set()
+        for position, word in enumerate(query_words):
+            grams |= trigrams(word, prefix=position == len(query_words) - 1)
+        needed = max(1, math.ceil(len(grams) * MIN_SIMILARITY))
+
+        shared = Counter()
+        allowed = self.categories.get(category, EMPTY) if category else None
+        for gram in grams:
+            ids = self.postings.get(gram, EMPTY)
+            shared.update(ids & allowed if allowed is not None else ids)
+        # Ties on the count are broken by order among a few times `limit` best
+        best = heapq.nlargest(limit * 4, shared.items(), key=itemgetter(1))
+        ranked = sorted((-count, self.order[product_id]) for product_id, count in best if count >= needed)
+        return [order[-1] for _, order in ranked[:limit]]
+
+index = ProductIndex()
@@ -0,0 +1,175 @@
+"""
+Background receipt rendering with a content-addressed PDF cache.
+
+Receipts are rendered by a small process pool right after checkout commits
+and saved in the receipt store (see receipt_store.py) as
+`receipt_<transaction id>_<content hash>.pdf`. A download then only has to
+send the stored file. If the PDF is not there yet, the request waits for the
+pool (up to a timeout) and falls back to rendering inline when the pool is
+unavailable or late. Late-pool fallbacks are limited to INLINE_RENDERS at a
+time per process, so a stuck pool cannot turn every request thread into a
+renderer.
+"""
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import metrics
+
+# Bump when the receipt layout changes so cached PDFs are re-rendered
+RENDER_VERSION = 1
+
+RENDER_WORKERS = int(os.environ.get('RECEIPT_RENDER_WORKERS', 2))
+RENDER_TIMEOUT = float(os.environ.get('RECEIPT_RENDER_TIMEOUT', 10))
+
+# Inline renders at once per process after the pool missed the timeout
+INLINE_RENDERS = int(os.environ.get('RECEIPT_INLINE_RENDERS', 2))
+
+_executor = None
+_pending = {}  # receipt key -> Future
+_lock = threading.Lock()
+_inline_slots = threading.BoundedSemaphore(max(1, INLINE_RENDERS))
+
+class RenderTimeout(Exception):
+    """The receipt could not be rendered in time, by the pool or inline"""
+
+def receipt_fields(transaction_data):
+    """The values printed on the receipt, normalized so that data built at
+    checkout and data reloaded from the database hash the same"""
+    amount = lambda value: float(value or 0)
+    return {
+        'id': transaction_data['id'],
+        'date': transaction_data['date'],
+        'cashier': transaction_data['cashier'],
+        'receipt_number': transaction_data.get('receipt_number'),
+        'subtotal': amount(transaction_data['subtotal']),
+        'discount': amount(transaction_data['discount']),
+        'total': amount(transaction_data['total']),
+        'payment': amount(transaction_data['payment']),
+        'change': amount(transaction_data['change']),
+        'items': [[
+            item.get('name') or item.get('product_name'),
+            amount(item.get('price')),
+            int(item.get('quantity', 0))
+        ] for item in transaction_data['items']],
+    }
+
+def content_hash(transaction_data):
+    """Stable hash of everything that appears on the receipt"""
+    payload = json.dumps([RENDER_VERSION, receipt_fields(transaction_data)], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+def receipt_key(transaction_data):
+    """Store key of a transaction's receipt PDF: (sale day, file name)"""
+    return (transaction_data['date'][:10], f"receipt_{transaction_data['id']}_{content_hash(transaction_data)}.pdf")
+
+def render_to_store(store, transaction_data, key):
+    """Render a receipt and save it in the store (runs in the render pool).
+
+    Returns the render time in seconds.
+    """
+    # ReportLab is imported on the first render, not when the app boots
+    from receipt_generator import render_receipt_bytes
+    started = time.perf_counter()
+    data = render_receipt_bytes(transaction_data)
+    elapsed = time.perf_counter() - started
+    store.put(key, data)
+    return elapsed
+
+def _record_render_time(future):
+    if not future.cancelled() and future.exception() is None:
+        metrics.RECEIPT_RENDER_SECONDS.observe('pool', value=future.result())
+
+def _get_executor():
+    """Start the render pool on first use ('spawn' so workers hold no DB connections)"""
+    global _executor
+    if RENDER_WORKERS <= 0:
+        return None
+    with _lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=RENDER_WORKERS,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _executor
+
+def _reset_executor():
+    """Drop a broken pool so the next submit starts a fresh one"""
+    global _executor
+    with _lock:
+        _executor = None
+
+def _submit(store, transaction_data, key):
+    """Queue a render unless the same PDF is already being rendered"""
+    executor = _get_executor()
+    if executor is None:
+        return None
+    with _lock:
+        future = _pending.get(key)
+        if future is None:
+            future = executor.submit(render_to_store, store, transaction_data, key)
+            _pending[key] = future
+            future.add_done_callback(lambda _: _pending.pop(key, None))
+            future.add_done_callback(_record_render_time)
+    return future
+
+def prerender(store, transaction_data):
+    """Start rendering a receipt in the background; never raises"""
+    key = receipt_key(transaction_data)
+    if store.exists(key):
+        return
+    try:
+        _submit(store, transaction_data, key)
+    except (BrokenProcessPool, RuntimeError) as e:
+        _reset_executor()
+        logging.warning(f"Receipt prerender skipped for {transaction_data['id']}: {str(e)}")
+
+def _render_inline(store, transaction_data, key):
+    """Render a receipt synchronously in this process and store it"""
+    from receipt_generator import render_receipt_bytes
+    started = time.perf_counter()
+    data = render_receipt_bytes(transaction_data)
+    metrics.RECEIPT_RENDER_SECONDS.observe('inline', value=time.perf_counter() - started)
+    store.put(key, data)
+    return io.BytesIO(data)
+
+def get_pdf(store, transaction_data, timeout=RENDER_TIMEOUT):
+    """Return the receipt PDF as a binary file object, rendering it if needed.
+
+    When the pool does not finish within the timeout the PDF is rendered
+    inline instead. Raises RenderTimeout only when INLINE_RENDERS such
+    renders are already running and none frees up within another timeout.
+    """
+    key = receipt_key(transaction_data)
+    pdf = store.open(key)
+    if pdf is not None:
+        return pdf
+
+    try:
+        future = _submit(store, transaction_data, key)
+        if future is not None:
+            future.result(timeout=timeout)
+            pdf = store.open(key)
+            if pdf is not None:
+                return pdf
+    except FutureTimeoutError:
+        logging.warning(f"Receipt {transaction_data['id']} not rendered by the pool within {timeout}s, rendering inline")
+        if not _inline_slots.acquire(timeout=timeout):
+            raise RenderTimeout(f"Receipt {transaction_data['id']} not rendered within {2 * timeout}s")
+        try:
+            # The pool may have caught up while this request waited for a slot
+            return store.open(key) or _render_inline(store, transaction_data, key)
+        finally:
+            _inline_slots.release()
+    except (BrokenProcessPool, RuntimeError) as e:
+        _reset_executor()
+        logging.warning(f"Receipt render pool unavailable, rendering inline: {str(e)}")
+
+    # No pool (disabled or broken), or the file was evicted right away
+    return _render_inline(store, transaction_data, key)
@@ -0,0 +1,277 @@
+"""
+On-disk store for rendered receipt PDFs.
+
+Receipts live under a configurable root (RECEIPTS_DIR, by default
+instance/receipts next to the app, outside the tracked receipts/ folder),
+sharded by sale day and content hash:
+
+    <root>/2026-10-17/3f/receipt_TRX-..._3fa9c2....pdf[.gz]
+    <root>/archive/2026-10-16.zip
+
+Every write goes to a temporary file that is renamed into place, so readers
+never see a partial PDF and several worker processes can share the root.
+Optionally files are gzip-compressed, and finished days are packed into one
+zip archive per day. Reading a receipt bumps its mtime; when the store grows
+past its size cap the least recently used files and archives are deleted.
+Everything here can be re-rendered from the database, so eviction and the
+occasional lost race between workers only cost a re-render.
+"""
+import gzip
+import io
+import logging
+import os
+import threading
+import time
+import zipfile
+from datetime import date, datetime
+
+DEFAULT_ROOT = os.environ.get('RECEIPTS_DIR',
+                              os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'receipts'))
+
+ARCHIVE_DIR = 'archive'
+TMP_SUFFIX = '.tmp'
+
+# Seconds between automatic maintenance runs (archive + eviction) per process
+MAINTENANCE_INTERVAL = 300
+
+# Temporary files older than this are leftovers of crashed writers
+STALE_TMP_AGE = 3600
+
+# Eviction deletes down to this fraction of the size cap
+EVICTION_TARGET = 0.9
+
+class ReceiptStore:
+    """Sharded, size-capped receipt PDF store"""
+
+    def __init__(self, root=DEFAULT_ROOT, max_bytes=0, compress=False, archive=False):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes  # 0 disables eviction
+        self.compress = compress
+        self.archive = archive
+        self._last_maintenance = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Stores are pickled into render pool workers; locks cannot be
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """Store configured from a Flask config mapping"""
+        return cls(
+            config["RECEIPTS_DIR"],
+            max_bytes=int(config["RECEIPT_STORE_MAX_MB"]) * 1024 * 1024,
+            compress=config["RECEIPT_STORE_COMPRESS"],
+            archive=config["RECEIPT_STORE_ARCHIVE"]
+        )
+
+    def _path(self, key, compressed):
+        """Loose file location of a receipt; keys are (day, file name) pairs"""
+        day, name = key
+        content_hash = name.rsplit('_', 1)[-1].split('.', 1)[0]
+        path = os.path.join(self.root, day, content_hash[:2], name)
+        return path + '.gz' if compressed else path
+
+    def _archive_path(self, day):
+        return os.path.join(self.root, ARCHIVE_DIR, f"{day}.zip")
+
+    def exists(self, key):
+        """Whether the receipt is stored loose or in its daily archive"""
+        if os.path.exists(self._path(key, False)) or os.path.exists(self._path(key, True)):
+            return True
+        archive_path = self._archive_path(key[0])
+        if not os.path.exists(archive_path):
+            return False
+        try:
+            with zipfile.ZipFile(archive_path) as archive:
+                archive.getinfo(key[1])
+            return True
+        except (KeyError, OSError, zipfile.BadZipFile):
+            return False
+
+    def put(self, key, data):
+        """Store PDF bytes atomically; a receipt that is already stored is kept"""
+        if self.exists(key):
+            return
+        path = self._path(key, self.compress)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}{TMP_SUFFIX}"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(gzip.compress(data) if self.compress else data)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.maybe_maintain()
+
+    def open(self, key):
+        """Binary file object with the PDF, or None when it is not stored"""
+        for compressed in (False, True):
+            path = self._path(key, compressed)
+            try:
+                f = open(path, 'rb')
+            except FileNotFoundError:
+                continue
+            self._touch(path)
+            return gzip.GzipFile(fileobj=f) if compressed else f
+
+        archive_path = self._archive_path(key[0])
+        try:
+            with zipfile.ZipFile(archive_path) as archive:
+                data = archive.read(key[1])
+        except (KeyError, OSError, zipfile.BadZipFile):
+            return None
+        self._touch(archive_path)
+        return io.BytesIO(data)
+
+    def _touch(self, path):
+        """Mark a file as recently used for LRU eviction"""
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def maybe_maintain(self):
+        """Run maintenance if this process has not done so recently"""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_maintenance < MAINTENANCE_INTERVAL:
+                return
+            self._last_maintenance = now
+        try:
+            self.maintain()
+        except OSError as e:
+            logging.warning(f"Receipt store maintenance failed: {str(e)}")
+
+    def maintain(self):
+        """Pack finished days into archives (if enabled) and enforce the size cap"""
+        packed = self.pack_archives() if self.archive else 0
+        evicted = self.evict()
+        return packed, evicted
+
+    def _day_dirs(self):
+        """Names of the per-day shard directories"""
+        if not os.path.isdir(self.root):
+            return []
+        days = []
+        for name in os.listdir(self.root):
+            try:
+                datetime.strptime(name, '%Y-%m-%d')
+            except ValueError:
+                continue
+            days.append(name)
+        return sorted(days)
+
+    def _files(self, directory):
+        """(path, stat) of the finished files below a directory, removing stale temp files"""
+        now = time.time()
+        for dirpath, dirnames, filenames in os.walk(directory):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if filename.endswith(TMP_SUFFIX):
+                    if now - stat.st_mtime > STALE_TMP_AGE:
+                        self._remove(path)
+                    continue
+                yield path, stat
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _prune_dirs(self, directory):
+        """Remove empty shard directories bottom-up"""
+        for dirpath, dirnames, filenames in os.walk(directory, topdown=False):
+            if dirpath != self.root and not os.listdir(dirpath):
+                try:
+                    os.rmdir(dirpath)
+                except OSError:
+                    pass
+
+    def pack_archives(self, before=None):
+        """Move loose receipts of days before `before` (default today) into daily zips"""
+        before = (before or date.today()).isoformat()
+        packed = 0
+        for day in self._day_dirs():
+            if day >= before:
+                continue
+            day_dir = os.path.join(self.root, day)
+            files = [path for path, stat in self._files(day_dir)]
+            if not files:
+                self._prune_dirs(day_dir)
+                continue
+
+            archive_path = self._archive_path(day)
+            os.makedirs(os.path.dirname(archive_path), exist_ok=True)
+            tmp_path = f"{archive_path}.{os.getpid()}{TMP_SUFFIX}"
+            compression = zipfile.ZIP_DEFLATED if self.compress else zipfile.ZIP_STORED
+            try:
+                with zipfile.ZipFile(tmp_path, 'w', compression) as archive:
+                    # Keep what an earlier run already packed for this day
+                    if os.path.exists(archive_path):
+                        with zipfile.ZipFile(archive_path) as existing:
+                            for info in existing.infolist():
+                                archive.writestr(info, existing.read(info))
+                    names = set(archive.namelist())
+                    for path in files:
+                        name = os.path.basename(path)
+                        if name.endswith('.gz'):
+                            name = name[:-3]
+                            with gzip.open(path, 'rb') as f:
+                                data = f.read()
+                        else:
+                            with open(path, 'rb') as f:
+                                data = f.read()
+                        if name not in names:
+                            archive.writestr(name, data)
+                            names.add(name)
+                os.replace(tmp_path, archive_path)
+            except (OSError, zipfile.BadZipFile):
+                self._remove(tmp_path)
+                raise
+
+            for path in files:
+                self._remove(path)
+                packed += 1
+            self._prune_dirs(day_dir)
+        return packed
+
+    def usage(self):
+        """(path, size, last used) of every stored file, oldest first"""
+        entries = [(path, stat.st_size, stat.st_mtime) for path, stat in self._files(self.root)]
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def evict(self):
+        """Delete least recently used files until the store fits its size cap"""
+        if not self.max_bytes:
+            return 0
+        entries = self.usage()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return 0
+
+        target = self.max_bytes * EVICTION_TARGET
+        evicted = 0
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            self._remove(path)
+            total -= size
+            evicted += 1
+        for day in self._day_dirs():
+            self._prune_dirs(os.path.join(self.root, day))
+        logging.info(f"Receipt store evicted {evicted} files")
+        return evicted
@@ -0,0 +1,170 @@
+"""
+Read-replica routing for the history and analytics endpoints.
+
+With DATABASE_REPLICA_URL set, the replica is registered as the 'replica'
+bind and db.session is a RoutingSession. Inside a route decorated with
+@read_only(max_staleness=...), plain SELECTs (ORM queries, lazy loads,
+session.execute(select(...))) go to the replica. Everything else stays on
+the primary: flushes, DML, SELECT ... FOR UPDATE, text() statements, routes
+without the decorator, CLI commands and the write queue.
+
+A replica is only used while it is close enough to the primary. Its lag is
+measured at most every LAG_CHECK_SECONDS per process:
+
+* PostgreSQL streaming replica: time since the last replayed transaction,
+  or 0 once everything received has been replayed;
+* anything else (e.g. a second SQLite file kept in sync by litestream,
+  rsync or a plain copy): how far the newest sale on the replica trails
+  the newest sale on the primary.
+
+A route reads from the primary when no replica is configured, the replica
+is unreachable, or it lags more than the route's max_staleness. The choice
+is made once per request, so a page never mixes rows from both. Since the
+lag is sampled, data can be up to max_staleness + LAG_CHECK_SECONDS old.
+A replica that fails in the middle of a request is marked down and the
+route is run again on the primary (read-only routes are safe to repeat).
+
+Locally, two SQLite files are enough:
+
+    cp kasir_gacoan.db replica.db
+    DATABASE_REPLICA_URL=sqlite:///$PWD/replica.db flask --app main replica-status
+"""
+import logging
+import os
+import threading
+import time
+from functools import wraps
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import func, select
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.sql import Select
+import metrics
+
+REPLICA_BIND = 'replica'
+
+# How often each process re-measures the replica lag, and how long a failed
+# replica is left alone before it is tried again
+LAG_CHECK_SECONDS = float(os.environ.get('REPLICA_LAG_CHECK_SECONDS', 5))
+RETRY_SECONDS = float(os.environ.get('REPLICA_RETRY_SECONDS', 30))
+
+# Staleness accepted by read_only() when a route does not declare its own
+DEFAULT_MAX_STALENESS = float(os.environ.get('REPLICA_MAX_STALENESS_SECONDS', 30))
+
+POSTGRES_LAG = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+"""
+
+_monitor = None
+
+class RoutingSession(Session):
+    """db.session that sends the SELECTs of read-only routes to the replica"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and isinstance(clause, Select) and clause._for_update_arg is None
+                and has_app_context() and g.get('read_replica')):
+            engine = self._db.engines.get(REPLICA_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+class LagMonitor:
+    """Measures and caches how far the replica is behind the primary"""
+
+    def __init__(self, db):
+        self.db = db
+        self.lag = None  # seconds, None while the replica is unusable
+        self.checked_at = float('-inf')
+        self.retry_at = float('-inf')
+        self.lock = threading.Lock()
+
+    def measure(self):
+        """Replica lag in seconds; raises when either database cannot be read"""
+        from models import Transaction
+
+        engines = self.db.engines
+        replica = engines[REPLICA_BIND]
+        if replica.dialect.name == 'postgresql':
+            with replica.connect() as connection:
+                return float(connection.exec_driver_sql(POSTGRES_LAG).scalar())
+
+        newest = select(func.max(Transaction.date))
+        with replica.connect() as connection:
+            replica_newest = connection.execute(newest).scalar()
+        with engines[None].connect() as connection:
+            primary_newest = connection.execute(newest).scalar()
+        if primary_newest is None:
+            return 0.0
+        if replica_newest is None:
+            return float('inf')
+        return max((primary_newest - replica_newest).total_seconds(), 0.0)
+
+    def current_lag(self):
+        """Cached lag, re-measured when older than LAG_CHECK_SECONDS.
+
+        Only one thread measures at a time; the others keep using the
+        previous value instead of waiting for it.
+        """
+        now = time.monotonic()
+        if now - self.checked_at < LAG_CHECK_SECONDS or now < self.retry_at:
+            return self.lag
+        if not self.lock.acquire(blocking=False):
+            return self.lag
+        try:
+            try:
+                self.lag = self.measure()
+            except Exception as e:
+                logging.warning(f"Read replica unavailable: {str(e)}")
+                self.mark_down()
+            self.checked_at = time.monotonic()
+        finally:
+            self.lock.release()
+        return self.lag
+
+    def mark_down(self):
+        self.lag = None
+        self.retry_at = time.monotonic() + RETRY_SECONDS
+
+    def usable(self, max_staleness):
+        lag = self.current_lag()
+        return lag is not None and lag <= max_staleness
+
+def read_only(max_staleness=DEFAULT_MAX_STALENESS):
+    """Route decorator: read from the replica if it lags at most max_staleness seconds"""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            monitor = _monitor
+            g.read_replica = monitor is not None and monitor.usable(max_staleness)
+            metrics.REPLICA_REQUESTS.inc(f.__name__, 'replica' if g.read_replica else 'primary')
+            if not g.read_replica:
+                return f(*args, **kwargs)
+            try:
+                return f(*args, **kwargs)
+            except DBAPIError as e:
+                logging.warning(f"Read replica failed, retrying {f.__name__} on the primary: {str(e)}")
+                monitor.mark_down()
+                monitor.db.session.rollback()
+                g.read_replica = False
+                metrics.REPLICA_REQUESTS.inc(f.__name__, 'fallback')
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def status():
+    """Replica state for `flask replica-status`: configured, lag in seconds or None"""
+    if _monitor is None:
+        return {'configured': False, 'lag_seconds': None}
+    _monitor.checked_at = float('-inf')
+    _monitor.retry_at = float('-inf')
+    return {'configured': True, 'lag_seconds': _monitor.current_lag()}
+
+def init_app(app, db):
+    """Start monitoring the replica bind, if one is configured"""
+    global _monitor
+    if REPLICA_BIND in app.config.get('SQLALCHEMY_BINDS', {}):
+        _monitor = LagMonitor(db)
@@ -0,0 +1,227 @@
+"""
+Incrementally maintained sales rollups for the sales-history dashboard.
+
+Checkout adds each sale to hourly and daily buckets (per cashier and per
+product) inside the same database transaction, so the dashboard only has to
+read a handful of pre-aggregated rows instead of scanning `transactions`.
+
+Product buckets are kept per category stored on the sale item, which is
+the product's category at the time of sale, so a product moved to another
+category mid-day gets a row under each. record_sale, rebuild_rollups and
+the Z-report (z_report.py) all follow that rule; items sold before the
+category was stored fall back to the product's current category.
+"""
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from models import db, Product, Transaction, TransactionItem, SalesRollup, ProductSalesRollup
+
+GRANULARITIES = ('hour', 'day')
+
+# Category used when the sold product no longer exists
+UNKNOWN_CATEGORY = 'lainnya'
+
+def bucket_start(moment, granularity):
+    """Truncate a datetime to the start of its hour or day bucket"""
+    if granularity == 'hour':
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def _upsert(model, key, increments, extra=None):
+    """Add increments to the rollup row identified by key, creating it if needed.
+
+    `extra` columns are only written when the row is created.
+    """
+    dialect = db.session.get_bind().dialect.name
+    values = dict(key, **increments, **(extra or {}))
+
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+
+        stmt = insert(model.__table__).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(key.keys()),
+            set_={name: getattr(model.__table__.c, name) + stmt.excluded[name] for name in increments}
+        )
+        db.session.execute(stmt)
+        return
+
+    # Generic fallback: update first, insert when the bucket does not exist yet
+    result = db.session.execute(
+        model.__table__.update()
+        .where(*[getattr(model.__table__.c, name) == value for name, value in key.items()])
+        .values({name: getattr(model.__table__.c, name) + value for name, value in increments.items()})
+    )
+    if result.rowcount == 0:
+        db.session.execute(model.__table__.insert().values(**values))
+
+def record_sale(transaction, items):
+    """Add a sale to the rollups. Must be called before the checkout commit.
+
+    `items` is a list of dicts with product_id, product_name, category,
+    quantity and subtotal keys.
+    """
+    for granularity in GRANULARITIES:
+        bucket = bucket_start(transaction.date, granularity)
+
+        _upsert(SalesRollup, {
+            'granularity': granularity,
+            'bucket': bucket,
+            'cashier': transaction.cashier,
+        }, {
+            'transaction_count': 1,
+            'subtotal': transaction.subtotal,
+            'discount': transaction.discount or 0,
+            'total': transaction.total,
+        })
+
+        for item in items:
+            _upsert(ProductSalesRollup, {
+                'granularity': granularity,
+                'bucket': bucket,
+                'product_id': item['product_id'],
+                'product_name': item['product_name'],
+                'category': item['category'] or UNKNOWN_CATEGORY,
+            }, {
+                'quantity': item['quantity'],
+                'revenue': item['subtotal'],
+            })
+
+def rebuild_rollups(start=None, end=None, batch_size=5000):
+    """Recompute rollups from the transaction history.
+
+    Buckets in the half-open range [start, end) are deleted and rebuilt; with
+    no range the whole history is rebuilt. `start`/`end` should fall on day
+    boundaries so daily buckets are not truncated.
+    """
+    sales_totals = {}
+    product_totals = {}
+
+    categories = dict(db.session.query(Product.id, Product.category).all())
+
+    query = db.session.query(
+        Transaction.id, Transaction.date, Transaction.cashier,
+        Transaction.subtotal, Transaction.discount, Transaction.total
+    )
+    if start:
+        query = query.filter(Transaction.date >= start)
+    if end:
+        query = query.filter(Transaction.date < end)
+
+    for row in query.execution_options(yield_per=batch_size):
+        for granularity in GRANULARITIES:
+            key = (granularity, bucket_start(row.date, granularity), row.cashier)
+            totals = sales_totals.setdefault(key, [0, 0, 0, 0])
+            totals[0] += 1
+            totals[1] += row.subtotal
+            totals[2] += row.discount or 0
+            totals[3] += row.total
+
+    item_query = db.session.query(
+        Transaction.date, TransactionItem.product_id, TransactionItem.product_name,
+        TransactionItem.category, TransactionItem.quantity, TransactionItem.subtotal
+    ).join(TransactionItem, TransactionItem.transaction_id == Transaction.id)
+    if start:
+        item_query = item_query.filter(Transaction.date >= start)
+    if end:
+        item_query = item_query.filter(Transaction.date < end)
+
+    for row in item_query.execution_options(yield_per=batch_size):
+        category = row.category or categories.get(row.product_id) or UNKNOWN_CATEGORY
+        for granularity in GRANULARITIES:
+            key = (granularity, bucket_start(row.date, granularity), row.product_id, row.product_name, category)
+            totals = product_totals.setdefault(key, [0, 0])
+            totals[0] += row.quantity
+            totals[1] += row.subtotal
+
+    for model in (SalesRollup, ProductSalesRollup):
+        delete = model.__table__.delete()
+        if start:
+            delete = delete.where(model.__table__.c.bucket >= start)
+        if end:
+            delete = delete.where(model.__table__.c.bucket < end)
+        db.session.execute(delete)
+
+    sales_rows = [{
+        'granularity': granularity, 'bucket': bucket, 'cashier': cashier,
+        'transaction_count': count, 'subtotal': subtotal, 'discount': discount, 'total': total
+    } for (granularity, bucket, cashier), (count, subtotal, discount, total) in sales_totals.items()]
+
+    product_rows = [{
+        'granularity': granularity, 'bucket': bucket, 'product_id': product_id,
+        'product_name': product_name, 'category': category, 'quantity': quantity, 'revenue': revenue
+    } for (granularity, bucket, product_id, product_name, category), (quantity, revenue) in product_totals.items()]
+
+    for table, rows in ((SalesRollup.__table__, sales_rows), (ProductSalesRollup.__table__, product_rows)):
+        for i in range(0, len(rows), batch_size):
+            db.session.execute(table.insert(), rows[i:i + batch_size])
+
+    db.session.commit()
+    logging.info(f"Rollups rebuilt: {len(sales_rows)} sales rows, {len(product_rows)} product rows")
+    return len(sales_rows), len(product_rows)
+
+def day_range(day):
+    """Half-open [start, end) datetime range covering a calendar day.
+
+    Filtering with ranges instead of wrapping the column (func.date, extract)
+    keeps the date/bucket indexes usable.
+    """
+    start = datetime.combine(day, datetime.min.time())
+    return start, start + timedelta(days=1)
+
+def sales_total(start, end=None):
+    """Total sales in the half-open range [start, end) using daily buckets"""
+    query = db.session.query(func.sum(SalesRollup.total)).filter(
+        SalesRollup.granularity == 'day',
+        SalesRollup.bucket >= start
+    )
+    if end:
+        query = query.filter(SalesRollup.bucket < end)
+    return query.scalar() or 0
+
+def sales_by_bucket(granularity, start, end):
+    """Map of bucket start -> total sales for buckets in [start, end)"""
+    rows = db.session.query(
+        SalesRollup.bucket, func.sum(SalesRollup.total)
+    ).filter(
+        SalesRollup.granularity == granularity,
+        SalesRollup.bucket >= start,
+        SalesRollup.bucket < end
+    ).group_by(SalesRollup.bucket).all()
+    return {bucket: total or 0 for bucket, total in rows}
+
+def daily_series(days, today=None):
+    """Sales per day for the last `days` days, oldest first"""
+    _, end = day_range(today or datetime.now().date())
+    start = end - timedelta(days=days)
+    totals = sales_by_bucket('day', start, end)
+    return [(start + timedelta(days=i), totals.get(start + timedelta(days=i), 0)) for i in range(days)]
+
+def hourly_series(day=None):
+    """Sales per hour for the given day"""
+    start, end = day_range(day or datetime.now().date())
+    totals = sales_by_bucket('hour', start, end)
+    return [(hour, totals.get(start + timedelta(hours=hour), 0)) for hour in range(24)]
+
+def top_products(limit=10):
+    """Best selling products by quantity across all days"""
+    return db.session.query(
+        ProductSalesRollup.product_name,
+        func.sum(ProductSalesRollup.quantity).label('total_quantity'),
+        func.sum(ProductSalesRollup.revenue).label('total_revenue')
+    ).filter(ProductSalesRollup.granularity == 'day').group_by(
+        ProductSalesRollup.product_name
+    ).order_by(func.sum(ProductSalesRollup.quantity).desc()).limit(limit).all()
+
+def category_sales():
+    """Sales and quantity per category across all days"""
+    return db.session.query(
+        ProductSalesRollup.category,
+        func.sum(ProductSalesRollup.revenue).label('total_sales'),
+        func.sum(ProductSalesRollup.quantity).label('total_quantity')
+    ).filter(ProductSalesRollup.granularity == 'day').group_by(
+        ProductSalesRollup.category
+    ).order_by(func.sum(ProductSalesRollup.revenue).desc()).all()
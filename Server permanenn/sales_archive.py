@@ -0,0 +1,389 @@
+"""
+Cold archive of old sales: one compressed SQLite database per month.
+
+    <root>/sales-2025-01.db.gz
+    <root>/manifest.json            months, row counts, date ranges, products
+    <root>/cache/sales-2025-01.db   decompressed copies of recently read months
+
+`flask partitions-maintain` (see partitions.py) moves months that left the
+retention window out of `transactions` and `transaction_items` into these
+files, with the same schema. History reads keep answering for them: the
+archived months overlapping a request are decompressed into the cache
+(once), attached to an in-memory SQLite connection and queried together.
+The history API merges a page of them (find_transactions), the receipt
+pages look one up by id (get), and the exports and the Z-report stream
+them in date order (iter_sales).
+
+Files are written to a temporary name and renamed into place, and rows are
+inserted with INSERT OR IGNORE, so a maintenance run that dies half-way can
+simply be repeated. Item columns added to the schema later (the category
+sold under) are added to older files when they are appended to or copied
+into the cache, empty for the rows they already hold.
+"""
+import gzip
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import groupby
+from sqlalchemy import create_engine, insert
+from sqlalchemy.dialects import sqlite as sqlite_dialect
+from models import Transaction, TransactionItem
+
+DEFAULT_ROOT = os.environ.get('SALES_ARCHIVE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sales_archive'))
+
+CACHE_DIR = 'cache'
+MANIFEST = 'manifest.json'
+TMP_SUFFIX = '.tmp'
+
+# SQLite attaches at most 10 databases per connection by default
+MAX_ATTACHED = 8
+
+TRANSACTION_COLUMNS = ['id', 'date', 'cashier', 'receipt_number', 'subtotal', 'discount', 'total', 'payment', 'change']
+ITEM_COLUMNS = ['id', 'transaction_id', 'product_id', 'product_name', 'category', 'price', 'quantity', 'subtotal']
+
+# SQLAlchemy's storage format for DateTime on SQLite, which the archive files use
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+def month_key(moment):
+    return moment.strftime('%Y-%m')
+
+def _add_missing_columns(execute):
+    """Add the item columns a file archived before they existed lacks"""
+    existing = {row[1] for row in execute('PRAGMA table_info(transaction_items)')}
+    for name in ITEM_COLUMNS:
+        if name not in existing:
+            column_type = TransactionItem.__table__.c[name].type.compile(dialect=sqlite_dialect.dialect())
+            execute(f'ALTER TABLE transaction_items ADD COLUMN {name} {column_type}')
+
+class ArchivedTransaction:
+    """A transaction read back from the archive; quacks like Transaction for the history API"""
+
+    def __init__(self, row, items):
+        values = dict(zip(TRANSACTION_COLUMNS, row))
+        self.id = values['id']
+        self.date = datetime.fromisoformat(values['date'])
+        self.values = values
+        self.items = items
+
+    def __getattr__(self, name):
+        # cashier, total, receipt_number, ... as attributes, for the receipt templates
+        try:
+            return self.__dict__['values'][name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def to_dict(self, items=None):
+        return dict(self.values, date=self.date.isoformat(), items=self.items if items is None else items)
+
+class MonthWriter:
+    """Appends rows to one month's archive; the file is replaced on close"""
+
+    def __init__(self, store, month):
+        self.store = store
+        self.month = month
+        self.work_path = f"{store.path(month)}.{os.getpid()}.work{TMP_SUFFIX}"
+        if os.path.exists(store.path(month)):
+            with gzip.open(store.path(month), 'rb') as src, open(self.work_path, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+        self.engine = create_engine(f"sqlite:///{self.work_path}")
+        for table in (Transaction.__table__, TransactionItem.__table__):
+            table.create(bind=self.engine, checkfirst=True)
+        self.connection = self.engine.connect()
+        _add_missing_columns(self.connection.exec_driver_sql)
+
+    def add(self, transactions, items):
+        """Insert row mappings; rows already archived are skipped"""
+        if transactions:
+            self.connection.execute(insert(Transaction.__table__).prefix_with('OR IGNORE'), transactions)
+        if items:
+            self.connection.execute(insert(TransactionItem.__table__).prefix_with('OR IGNORE'), items)
+
+    def close(self):
+        self.connection.commit()
+        summary = self.connection.exec_driver_sql(
+            'SELECT COUNT(*), MIN(date), MAX(date) FROM transactions').one()
+        item_count = self.connection.exec_driver_sql('SELECT COUNT(*) FROM transaction_items').scalar()
+        product_ids = [row[0] for row in self.connection.exec_driver_sql(
+            'SELECT DISTINCT product_id FROM transaction_items ORDER BY product_id')]
+        self.connection.close()
+        self.engine.dispose()
+
+        path = self.store.path(self.month)
+        tmp_path = f"{path}.{os.getpid()}{TMP_SUFFIX}"
+        try:
+            with open(self.work_path, 'rb') as src, gzip.open(tmp_path, 'wb', compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst)
+            os.replace(tmp_path, path)
+        finally:
+            self.store._remove(tmp_path)
+            self.store._remove(self.work_path)
+        self.store._remove(self.store.cache_path(self.month))
+        self.store.record(self.month, {
+            'transactions': summary[0], 'items': item_count,
+            'first': summary[1], 'last': summary[2], 'product_ids': product_ids,
+        })
+
+    def discard(self):
+        self.connection.close()
+        self.engine.dispose()
+        self.store._remove(self.work_path)
+
+class ArchiveStore:
+    """Monthly sales archive files and the reader used by the history API"""
+
+    def __init__(self, root=DEFAULT_ROOT, cache_months=12):
+        self.root = os.path.abspath(root)
+        self.cache_months = cache_months
+        self._manifest = {}
+        self._manifest_mtime = None
+        self._product_ids = frozenset()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """Store configured from a Flask config mapping"""
+        return cls(config["SALES_ARCHIVE_DIR"], cache_months=int(config["SALES_ARCHIVE_CACHE_MONTHS"]))
+
+    def path(self, month):
+        return os.path.join(self.root, f"sales-{month}.db.gz")
+
+    def cache_path(self, month):
+        return os.path.join(self.root, CACHE_DIR, f"sales-{month}.db")
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def manifest(self):
+        """{month: summary} of the archived months, reloaded when another process changed it"""
+        path = os.path.join(self.root, MANIFEST)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return {}
+        with self._lock:
+            if mtime != self._manifest_mtime:
+                with open(path) as f:
+                    self._manifest = json.load(f)
+                self._manifest_mtime = mtime
+                self._product_ids = frozenset(
+                    product_id for entry in self._manifest.values() for product_id in entry['product_ids'])
+            return self._manifest
+
+    def record(self, month, summary):
+        """Store a month's summary in the manifest"""
+        manifest = dict(self.manifest(), **{month: summary})
+        path = os.path.join(self.root, MANIFEST)
+        tmp_path = f"{path}.{os.getpid()}{TMP_SUFFIX}"
+        with open(tmp_path, 'w') as f:
+            json.dump(dict(sorted(manifest.items())), f, indent=1)
+        os.replace(tmp_path, path)
+
+    @contextmanager
+    def writer(self, month):
+        """MonthWriter for a 'YYYY-MM' month, committed when the block succeeds"""
+        os.makedirs(self.root, exist_ok=True)
+        writer = MonthWriter(self, month)
+        try:
+            yield writer
+        except BaseException:
+            writer.discard()
+            raise
+        writer.close()
+
+    def product_sold(self, product_id):
+        """Whether an archived sale contains the product"""
+        self.manifest()
+        return product_id in self._product_ids
+
+    def _local_copy(self, month):
+        """Decompressed copy of a month, made on first use and kept for the next reads"""
+        path = self.cache_path(month)
+        try:
+            if os.stat(path).st_mtime >= os.stat(self.path(month)).st_mtime:
+                os.utime(path)
+                return path
+        except FileNotFoundError:
+            pass
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}{TMP_SUFFIX}"
+        try:
+            with gzip.open(self.path(month), 'rb') as src, open(tmp_path, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            connection = sqlite3.connect(tmp_path)
+            try:
+                _add_missing_columns(connection.execute)
+                connection.commit()
+            finally:
+                connection.close()
+            os.replace(tmp_path, path)
+        finally:
+            self._remove(tmp_path)
+        self._evict_cache()
+        return path
+
+    def _evict_cache(self):
+        """Keep only the cache_months most recently read copies"""
+        directory = os.path.join(self.root, CACHE_DIR)
+        copies = []
+        for name in os.listdir(directory):
+            if name.endswith('.db'):
+                try:
+                    copies.append((os.stat(os.path.join(directory, name)).st_mtime, name))
+                except FileNotFoundError:
+                    pass
+        for _, name in sorted(copies, reverse=True)[self.cache_months:]:
+            self._remove(os.path.join(directory, name))
+
+    def find_transactions(self, start=None, end=None, cashier=None, product_id=None, after=None, limit=50, floor=None):
+        """Archived transactions, newest first, filtered like /api/transactions.
+
+        `after` is a (date, id) keyset position; `floor` skips rows older than
+        a date the caller already has enough rows above.
+        """
+        upper = min(bound for bound in (end, after and after[0]) if bound) if (end or after) else None
+        lower = max(bound for bound in (start, floor) if bound) if (start or floor) else None
+        months = self._months(lower, upper)[::-1]
+        found = []
+        for index in range(0, len(months), MAX_ATTACHED):
+            chunk = months[index:index + MAX_ATTACHED]
+            # Months are newest first: stop once the next ones cannot beat what we have
+            if len(found) >= limit and self.manifest()[chunk[0]]['last'] < found[limit - 1].date.strftime(DATE_FORMAT):
+                break
+            found.extend(self._query(chunk, end, cashier, product_id, after, limit, lower))
+            found.sort(key=lambda t: (t.date, t.id), reverse=True)
+            del found[limit:]
+        return found
+
+    def get(self, transaction_id, upper=None):
+        """Archived transaction by id, or None.
+
+        `upper` bounds its date (an id is never older than its sale), so only
+        the months up to it are searched, newest first.
+        """
+        months = self._months(None, upper)[::-1]
+        for index in range(0, len(months), MAX_ATTACHED):
+            chunk = months[index:index + MAX_ATTACHED]
+            connection = sqlite3.connect(':memory:')
+            try:
+                for schema in self._attach(connection, chunk):
+                    row = connection.execute(
+                        f"SELECT {', '.join(TRANSACTION_COLUMNS)} FROM {schema}.transactions WHERE id = ?",
+                        (transaction_id,)).fetchone()
+                    if row:
+                        items = connection.execute(
+                            f"SELECT {', '.join(ITEM_COLUMNS)} FROM {schema}.transaction_items "
+                            f"WHERE transaction_id = ? ORDER BY id", (transaction_id,))
+                        return ArchivedTransaction(row, [dict(zip(ITEM_COLUMNS, item)) for item in items])
+            except sqlite3.Error as e:
+                logging.error(f"Sales archive read failed for {chunk}: {str(e)}")
+                raise
+            finally:
+                connection.close()
+        return None
+
+    def _months(self, lower=None, upper=None):
+        """Archived months with rows overlapping [lower, upper], oldest first"""
+        return [month for month, entry in sorted(self.manifest().items())
+                if entry['transactions']
+                and (upper is None or entry['first'] <= upper.strftime(DATE_FORMAT))
+                and (lower is None or entry['last'] >= lower.strftime(DATE_FORMAT))]
+
+    def _attach(self, connection, months):
+        """Attach the months' local copies read-only; returns their schema names"""
+        schemas = []
+        for number, month in enumerate(months):
+            connection.execute(f"ATTACH DATABASE ? AS m{number}", (f"file:{self._local_copy(month)}?mode=ro",))
+            schemas.append(f"m{number}")
+        return schemas
+
+    def iter_sales(self, start=None, end=None, cashier=None):
+        """Stream archived transactions in [start, end), oldest first, with their items"""
+        conditions, parameters = [], []
+        if start:
+            conditions.append('t.date >= ?')
+            parameters.append(start.strftime(DATE_FORMAT))
+        if end:
+            conditions.append('t.date < ?')
+            parameters.append(end.strftime(DATE_FORMAT))
+        if cashier:
+            conditions.append('t.cashier = ?')
+            parameters.append(cashier)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+        columns = ', '.join([f't.{column}' for column in TRANSACTION_COLUMNS] + [f'i.{column}' for column in ITEM_COLUMNS])
+
+        # Months hold disjoint date ranges, so chunks of them come out in order
+        months = self._months(start, end)
+        for index in range(0, len(months), MAX_ATTACHED):
+            chunk = months[index:index + MAX_ATTACHED]
+            connection = sqlite3.connect(':memory:')
+            try:
+                schemas = self._attach(connection, chunk)
+                sql = ' UNION ALL '.join(
+                    f"SELECT {columns} FROM {schema}.transactions t "
+                    f"JOIN {schema}.transaction_items i ON i.transaction_id = t.id{where}" for schema in schemas)
+                width = len(TRANSACTION_COLUMNS)
+                sql += f" ORDER BY 2, 1, {width + 1}"
+                rows = connection.execute(sql, parameters * len(schemas))
+                for _, group in groupby(rows, key=lambda row: row[0]):
+                    group = list(group)
+                    yield ArchivedTransaction(group[0][:width],
+                                              [dict(zip(ITEM_COLUMNS, row[width:])) for row in group])
+            except sqlite3.Error as e:
+                logging.error(f"Sales archive read failed for {chunk}: {str(e)}")
+                raise
+            finally:
+                connection.close()
+
+    def _query(self, months, end, cashier, product_id, after, limit, lower):
+        connection = sqlite3.connect(':memory:')
+        try:
+            schemas = self._attach(connection, months)
+
+            conditions, parameters = [], []
+            if lower:
+                conditions.append('date >= ?')
+                parameters.append(lower.strftime(DATE_FORMAT))
+            if end:
+                conditions.append('date < ?')
+                parameters.append(end.strftime(DATE_FORMAT))
+            if cashier:
+                conditions.append('cashier = ?')
+                parameters.append(cashier)
+            if after:
+                conditions.append('(date < ? OR (date = ? AND id < ?))')
+                parameters.extend([after[0].strftime(DATE_FORMAT), after[0].strftime(DATE_FORMAT), after[1]])
+
+            selects, all_parameters = [], []
+            for schema in schemas:
+                where = list(conditions)
+                if product_id:
+                    where.append(f"EXISTS (SELECT 1 FROM {schema}.transaction_items i "
+                                 f"WHERE i.transaction_id = t.id AND i.product_id = ?)")
+                selects.append(f"SELECT {', '.join(TRANSACTION_COLUMNS)} FROM {schema}.transactions t"
+                               + (f" WHERE {' AND '.join(where)}" if where else ''))
+                all_parameters.extend(parameters + ([product_id] if product_id else []))
+            sql = ' UNION ALL '.join(selects) + ' ORDER BY date DESC, id DESC LIMIT ?'
+            rows = connection.execute(sql, all_parameters + [limit]).fetchall()
+
+            items = {row[0]: [] for row in rows}
+            if rows:
+                placeholders = ', '.join('?' * len(rows))
+                sql = ' UNION ALL '.join(
+                    f"SELECT {', '.join(ITEM_COLUMNS)} FROM {schema}.transaction_items "
+                    f"WHERE transaction_id IN ({placeholders})" for schema in schemas) + ' ORDER BY id'
+                for item in connection.execute(sql, list(items) * len(schemas)):
+                    items[item[1]].append(dict(zip(ITEM_COLUMNS, item)))
+            return [ArchivedTransaction(row, items[row[0]]) for row in rows]
+        except sqlite3.Error as e:
+            logging.error(f"Sales archive read failed for {months}: {str(e)}")
+            raise
+        finally:
+            connection.close()
@@ -1,9 +1,82 @@
 // POS JavaScript functionality
+
+// Local IndexedDB stores of sales: 'pending-sales' wait to be synced to the
+// server, 'failed-sales' were refused by it and need the cashier's attention
+class OfflineQueue {
+    constructor(storeName = 'pending-sales') {
+        this.dbName = 'kasir-gacoan';
+        this.storeName = storeName;
+        this.db = null;
+    }
+
+    open() {
+        if (this.db) {
+            return Promise.resolve(this.db);
+        }
+        return new Promise((resolve, reject) => {
+            if (!window.indexedDB) {
+                reject(new Error('IndexedDB tidak tersedia'));
+                return;
+            }
+            const request = indexedDB.open(this.dbName, 2);
+            request.onupgradeneeded = () => {
+                ['pending-sales', 'failed-sales'].forEach(name => {
+                    if (!request.result.objectStoreNames.contains(name)) {
+                        request.result.createObjectStore(name, { keyPath: 'idempotency_key' });
+                    }
+                });
+            };
+            request.onsuccess = () => {
+                this.db = request.result;
+                resolve(this.db);
+            };
+            request.onerror = () => reject(request.error);
+        });
+    }
+
+    async run(mode, callback) {
+        const db = await this.open();
+        return new Promise((resolve, reject) => {
+            const tx = db.transaction(this.storeName, mode);
+            const request = callback(tx.objectStore(this.storeName));
+            tx.oncomplete = () => resolve(request ? request.result : undefined);
+            tx.onerror = () => reject(tx.error);
+        });
+    }
+
+    add(sale) {
+        return this.run('readwrite', store => store.put(sale));
+    }
+
+    all() {
+        return this.run('readonly', store => store.getAll());
+    }
+
+    remove(keys) {
+        return this.run('readwrite', store => {
+            keys.forEach(key => store.delete(key));
+        });
+    }
+}
+
 class POSSystem {
     constructor() {
         this.cart = [];
         this.products = [];
         this.currentCategory = 'all';
+        this.queue = new OfflineQueue();
+        this.failedSales = new OfflineQueue('failed-sales');
+        this.cashier = null;
+        this.sessionExpiredShown = false;
+        this.syncing = null;
+        this.syncBatchSize = 50;
+        this.syncInterval = 15000;
+        this.catalogVersion = 0;
+        this.catalogRetryDelay = 5000;
+        this.lowStockThreshold = 10;
+        this.searchMatches = null; // ids matching the search box, null when it is empty
+        this.searchRequest = 0;
+        this.searchDelay = 80;
         this.init();
     }
 
@@ -11,14 +84,133 @@ class POSSystem {
         this.loadProducts();
         this.bindEvents();
         this.updateCartDisplay();
+
+        // Push sales queued while offline
+        const backgroundSync = () => this.syncQueue()
+            .then(results => this.reportSyncResults(results))
+            .catch(error => console.error('Background sync error:', error));
+        window.addEventListener('online', backgroundSync);
+        setInterval(backgroundSync, this.syncInterval);
+        backgroundSync();
+        this.renderFailedSales();
+
+        // Stock and product changes pushed by the server
+        this.subscribeCatalog();
     }
 
     loadProducts() {
-        // Products are already loaded in the template
-        // This method can be extended for dynamic loading if needed
+        // Products are rendered by the template; later changes are patched in by subscribeCatalog()
+        const container = document.getElementById('products-container');
+        if (container) {
+            this.catalogVersion = parseInt(container.dataset.catalogVersion) || 0;
+            this.cashier = container.dataset.cashier || null;
+        }
         this.bindProductEvents();
     }
 
+    subscribeCatalog() {
+        if (!window.EventSource) {
+            this.pollCatalog();
+            return;
+        }
+        const source = new EventSource(`/api/catalog/stream?since=${this.catalogVersion}`);
+        source.addEventListener('catalog', (e) => {
+            this.applyCatalogChanges(JSON.parse(e.data));
+        });
+        source.onerror = () => {
+            // EventSource reconnects by itself unless the stream was refused
+            // (e.g. a proxy that buffers it); then fall back to long polling
+            if (source.readyState === EventSource.CLOSED) {
+                this.pollCatalog();
+            }
+        };
+    }
+
+    async pollCatalog() {
+        while (true) {
+            try {
+                const response = await fetch(`/api/catalog/changes?since=${this.catalogVersion}`);
+                if (!response.ok) {
+                    throw new Error(`HTTP ${response.status}`);
+                }
+                this.applyCatalogChanges(await response.json());
+            } catch (error) {
+                await new Promise(resolve => setTimeout(resolve, this.catalogRetryDelay));
+            }
+        }
+    }
+
+    applyCatalogChanges(data) {
+        if (data.version < this.catalogVersion) {
+            return;
+        }
+        this.catalogVersion = data.version;
+        data.products.forEach(product => this.renderProduct(product));
+        data.deleted.forEach(productId => this.removeProduct(productId));
+
+        // Keep the cart within the stock that is left
+        let changed = false;
+        this.cart = this.cart.filter(item => {
+            const product = data.products.find(p => p.id === item.id);
+            if (!product) {
+                return !data.deleted.includes(item.id);
+            }
+            item.stock = product.stock;
+            item.price = product.price;
+            item.name = product.name;
+            changed = true;
+            if (item.quantity > product.stock) {
+                item.quantity = product.stock;
+                this.showAlert(`Stok ${product.name} tinggal ${product.stock}`, 'warning');
+            }
+            return item.quantity > 0;
+        });
+        if (changed || data.deleted.length) {
+            this.updateCartDisplay();
+        }
+    }
+
+    renderProduct(product) {
+        let productCard = document.querySelector(`.product-card[data-product-id="${product.id}"]`);
+        if (!productCard) {
+            const container = document.getElementById('products-container');
+            if (!container) return;
+            const item = document.createElement('div');
+            item.className = 'col-md-6 col-lg-4 mb-3 product-item';
+            item.innerHTML = `
+                <div class="card product-card h-100" data-product-id="${product.id}">
+                    <div class="card-body position-relative">
+                        <h6 class="card-title"></h6>
+                        <p class="card-text">
+                            <strong></strong><br>
+                            <small class="text-muted"></small>
+                        </p>
+                        <button class="btn btn-sm"></button>
+                    </div>
+                </div>
+            `;
+            container.appendChild(item);
+            productCard = item.querySelector('.product-card');
+        }
+
+        const item = productCard.closest('.product-item');
+        item.dataset.category = product.category;
+        item.style.display = this.isVisible(item) ? 'block' : 'none';
+
+        productCard.dataset.productName = product.name;
+        productCard.dataset.productPrice = product.price;
+        productCard.querySelector('.card-title').textContent = product.name;
+        productCard.querySelector('.card-text strong').textContent = this.formatCurrency(product.price);
+        this.setProductStock(productCard, product.stock);
+    }
+
+    removeProduct(productId) {
+        const productCard = document.querySelector(`.product-card[data-product-id="${productId}"]`);
+        if (productCard) {
+            productCard.closest('.product-item').remove();
+        }
+    }
+
     bindEvents() {
         // Category filter events
         document.querySelectorAll('input[name="category"]').forEach(radio => {
@@ -27,6 +219,22 @@ class POSSystem {
             });
         });
 
+        // Product search and barcode scanner input
+        const searchInput = document.getElementById('product-search');
+        if (searchInput) {
+            let timer = null;
+            searchInput.addEventListener('input', () => {
+                clearTimeout(timer);
+                timer = setTimeout(() => this.searchProducts(searchInput.value), this.searchDelay);
+            });
+            searchInput.addEventListener('keydown', (e) => {
+                if (e.key !== 'Enter') return;
+                e.preventDefault();
+                clearTimeout(timer);
+                this.scanProduct(searchInput);
+            });
+        }
+
         // Payment amount input
         const paymentInput = document.getElementById('payment-amount');
         if (paymentInput) {
@@ -43,6 +251,14 @@ class POSSystem {
             });
         }
 
+        // Thermal print button in the receipt modal
+        const printReceiptBtn = document.getElementById('print-receipt-btn');
+        if (printReceiptBtn) {
+            printReceiptBtn.addEventListener('click', () => {
+                this.printReceipt(printReceiptBtn.dataset.transactionId);
+            });
+        }
+
         // Clear cart button
         const clearCartBtn = document.getElementById('clear-cart-btn');
         if (clearCartBtn) {
@@ -53,27 +269,84 @@ class POSSystem {
     }
 
     bindProductEvents() {
-        // Add to cart buttons
-        document.querySelectorAll('.add-to-cart-btn').forEach(btn => {
-            btn.addEventListener('click', (e) => {
-                e.preventDefault();
-                const productCard = e.target.closest('.product-card');
-                this.addToCart(productCard);
-            });
+        // Add to cart buttons, delegated so patched and new cards keep working
+        const container = document.getElementById('products-container');
+        if (!container) return;
+        container.addEventListener('click', (e) => {
+            const button = e.target.closest('.add-to-cart-btn');
+            if (!button) return;
+            e.preventDefault();
+            this.addToCart(button.closest('.product-card'));
         });
     }
 
+    isVisible(item) {
+        if (this.currentCategory !== 'all' && item.dataset.category !== this.currentCategory) {
+            return false;
+        }
+        if (this.searchMatches === null) {
+            return true;
+        }
+        const productCard = item.querySelector('.product-card');
+        return this.searchMatches.has(parseInt(productCard.dataset.productId));
+    }
+
     filterProducts(category) {
         this.currentCategory = category;
         const productItems = document.querySelectorAll('.product-item');
         
         productItems.forEach(item => {
-            if (category === 'all' || item.dataset.category === category) {
-                item.style.display = 'block';
+            item.style.display = this.isVisible(item) ? 'block' : 'none';
+        });
+    }
+
+    async searchProducts(query) {
+        // Responses can arrive out of order; only the latest one is applied
+        const request = ++this.searchRequest;
+        if (!query.trim()) {
+            this.searchMatches = null;
+            this.filterProducts(this.currentCategory);
+            return [];
+        }
+        try {
+            const response = await fetch(`/api/products/search?q=${encodeURIComponent(query)}&limit=100`);
+            const data = await response.json();
+            if (request === this.searchRequest) {
+                this.searchMatches = new Set(data.products.map(product => product.id));
+                this.filterProducts(this.currentCategory);
+            }
+            return data.products;
+        } catch (error) {
+            console.error('Search error:', error);
+            return [];
+        }
+    }
+
+    async scanProduct(searchInput) {
+        // Enter: exact SKU/barcode first, otherwise the single search match
+        const code = searchInput.value.trim();
+        if (!code) return;
+        let product = null;
+        try {
+            const response = await fetch(`/api/products/lookup?code=${encodeURIComponent(code)}`);
+            if (response.ok) {
+                product = (await response.json()).product;
             } else {
-                item.style.display = 'none';
+                const products = await this.searchProducts(code);
+                product = products.length === 1 ? products[0] : null;
             }
-        });
+        } catch (error) {
+            console.error('Lookup error:', error);
+        }
+
+        const productCard = product && document.querySelector(`.product-card[data-product-id="${product.id}"]`);
+        if (!productCard) {
+            this.showAlert('Produk tidak ditemukan', 'warning');
+            return;
+        }
+        this.addToCart(productCard);
+        searchInput.value = '';
+        this.searchProducts('');
     }
 
     addToCart(productCard) {
@@ -253,24 +526,55 @@ class POSSystem {
         checkoutBtn.innerHTML = '<i class="fas fa-spinner fa-spin me-2"></i>Memproses...';
         checkoutBtn.disabled = true;
 
+        // Commit the sale locally first so the cashier is never blocked by the network
+        const sale = {
+            idempotency_key: this.generateIdempotencyKey(),
+            cashier: this.cashier,
+            cart_items: this.cart.map(item => ({ ...item })),
+            payment_amount: paymentAmount,
+            created_at: new Date().toISOString()
+        };
+
         try {
-            const response = await fetch('/api/checkout', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({
-                    cart_items: this.cart,
-                    payment_amount: paymentAmount
-                })
-            });
+            let queued = true;
+            try {
+                await this.queue.add(sale);
+            } catch (error) {
+                console.warn('Offline queue unavailable, sending directly:', error);
+                queued = false;
+            }
 
-            const result = await response.json();
+            if (queued) {
+                this.updateProductStock();
+                this.clearCart();
+            }
 
-            if (result.success) {
-                this.showReceiptModal(result);
+            const results = await this.syncQueue(queued ? [] : [sale]);
+            const result = results[sale.idempotency_key];
+            this.reportSyncResults(results, sale.idempotency_key);
+
+            if (!queued) {
+                if (!result || (result.status !== 'created' && result.status !== 'duplicate')) {
+                    // Neither queued nor recorded: keep the cart so the sale is not lost
+                    this.showAlert(result && result.message
+                        ? `Transaksi gagal: ${result.message}. Keranjang tidak dihapus.`
+                        : 'Transaksi gagal disimpan: penyimpanan offline tidak tersedia dan server tidak menerimanya. Keranjang tidak dihapus, silakan coba lagi.',
+                        'danger');
+                    return;
+                }
                 this.updateProductStock();
                 this.clearCart();
+            }
+
+            if (!result) {
+                this.showAlert('Transaksi disimpan dan akan disinkronkan saat koneksi tersedia', 'info');
+            } else if (result.status === 'created' || result.status === 'duplicate') {
+                this.showReceiptModal({
+                    transaction_id: result.transaction_id,
+                    total: result.total ?? total,
+                    payment: result.payment ?? paymentAmount,
+                    change: result.change ?? (paymentAmount - total)
+                });
             } else {
                 this.showAlert(result.message || 'Checkout gagal!', 'danger');
             }
@@ -284,6 +588,139 @@ class POSSystem {
         }
     }
 
+    generateIdempotencyKey() {
+        if (window.crypto && crypto.randomUUID) {
+            return crypto.randomUUID();
+        }
+        return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+    }
+
+    reportSyncResults(results, currentKey = null) {
+        // Sales synced in the background can still fail, e.g. when stock ran out meanwhile
+        const failed = Object.values(results).filter(result =>
+            result.idempotency_key !== currentKey && (result.status === 'conflict' || result.status === 'rejected'));
+        if (failed.length) {
+            this.showAlert(`${failed.length} transaksi tertunda gagal, lihat "Perlu Perhatian"`, 'warning');
+        }
+    }
+
+    async renderFailedSales() {
+        // Refused sales stay listed until the cashier dismisses them
+        const panel = document.getElementById('failed-sales');
+        if (!panel) return;
+        let sales = [];
+        try {
+            sales = await this.failedSales.all();
+        } catch (error) {
+            // No IndexedDB: nothing was kept
+        }
+        panel.style.display = sales.length ? 'block' : 'none';
+        document.getElementById('failed-sales-count').textContent = sales.length;
+        const list = document.getElementById('failed-sales-list');
+        list.innerHTML = '';
+        sales.sort((a, b) => a.created_at.localeCompare(b.created_at)).forEach(sale => {
+            const total = sale.cart_items.reduce((sum, item) => sum + item.price * item.quantity, 0);
+            const item = document.createElement('li');
+            item.className = 'list-group-item d-flex justify-content-between align-items-start';
+            item.innerHTML = `
+                <div>
+                    <div class="fw-bold"></div>
+                    <small class="text-muted"></small><br>
+                    <small class="text-danger"></small>
+                </div>
+                <button class="btn btn-sm btn-outline-secondary" title="Hapus"><i class="fas fa-times"></i></button>
+            `;
+            item.querySelector('.fw-bold').textContent = this.formatCurrency(total);
+            item.querySelector('.text-muted').textContent =
+                `${new Date(sale.created_at).toLocaleString('id-ID')} - ${sale.cashier || '-'}`;
+            item.querySelector('.text-danger').textContent = sale.failure_message || '';
+            item.querySelector('button').addEventListener('click', async () => {
+                if (!confirm('Hapus transaksi gagal ini dari daftar?')) return;
+                await this.failedSales.remove([sale.idempotency_key]);
+                this.renderFailedSales();
+            });
+            list.appendChild(item);
+        });
+    }
+
+    syncQueue(extraSales = []) {
+        // Only one sync at a time; later callers wait for the running one
+        if (this.syncing) {
+            return this.syncing.then(() => this.syncQueue(extraSales));
+        }
+        this.syncing = this.sendQueuedSales(extraSales).finally(() => {
+            this.syncing = null;
+        });
+        return this.syncing;
+    }
+
+    async sendQueuedSales(extraSales) {
+        const results = {};
+        let pending = extraSales;
+        try {
+            pending = (await this.queue.all()).concat(extraSales);
+        } catch (error) {
+            // No IndexedDB: only the sales passed in can be sent
+        }
+        // Sales rung up by another cashier wait for that cashier's next login
+        pending = pending.filter(sale => !sale.cashier || sale.cashier === this.cashier);
+
+        for (let i = 0; i < pending.length; i += this.syncBatchSize) {
+            const batch = pending.slice(i, i + this.syncBatchSize);
+            let response;
+            try {
+                response = await fetch('/api/checkout/batch', {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json',
+                    },
+                    body: JSON.stringify({ sales: batch })
+                });
+            } catch (error) {
+                // Offline: keep everything queued for the next attempt
+                break;
+            }
+            // An expired session answers with the login page instead of JSON
+            const contentType = response.headers.get('Content-Type') || '';
+            if (!response.ok || !contentType.includes('application/json')) {
+                if (response.redirected && !this.sessionExpiredShown) {
+                    this.sessionExpiredShown = true;
+                    this.showAlert('Sesi login berakhir. Transaksi tertunda tetap tersimpan, silakan login ulang.', 'warning');
+                }
+                break;
+            }
+
+            const data = await response.json();
+            const done = [];
+            const failed = [];
+            data.results.forEach(result => {
+                results[result.idempotency_key] = result;
+                if (result.status === 'created' || result.status === 'duplicate') {
+                    done.push(result.idempotency_key);
+                } else if (result.status === 'conflict' || result.status === 'rejected') {
+                    const sale = batch.find(s => s.idempotency_key === result.idempotency_key);
+                    if (sale) {
+                        failed.push({ ...sale, failure_message: result.message });
+                    }
+                    done.push(result.idempotency_key);
+                }
+                // 'wrong_cashier' and 'error' stay queued
+            });
+            try {
+                for (const sale of failed) {
+                    await this.failedSales.add(sale);
+                }
+                await this.queue.remove(done);
+            } catch (error) {
+                // Nothing was queued locally
+            }
+        }
+        if (Object.keys(results).length) {
+            this.renderFailedSales();
+        }
+        return results;
+    }
+
     showReceiptModal(result) {
         const modal = new bootstrap.Modal(document.getElementById('receiptModal'));
         
@@ -310,10 +747,27 @@ class POSSystem {
         // Update receipt links
         document.getElementById('preview-receipt-btn').href = `/receipt/preview/${result.transaction_id}`;
         document.getElementById('download-receipt-btn').href = `/receipt/pdf/${result.transaction_id}`;
+        document.getElementById('print-receipt-btn').dataset.transactionId = result.transaction_id;
 
         modal.show();
     }
 
+    async printReceipt(transactionId) {
+        if (!transactionId) return;
+        try {
+            const response = await fetch(`/api/receipt/${transactionId}/print`, { method: 'POST' });
+            const result = await response.json();
+            if (result.success) {
+                this.showAlert('Struk dikirim ke printer', 'success');
+            } else {
+                this.showAlert(result.message || 'Gagal mencetak struk', 'danger');
+            }
+        } catch (error) {
+            console.error('Print error:', error);
+            this.showAlert('Gagal mencetak struk', 'danger');
+        }
+    }
+
     clearCart() {
         this.cart = [];
         this.updateCartDisplay();
@@ -328,43 +782,48 @@ class POSSystem {
     updateProductStock() {
         // Update product stock display in real-time after checkout
         this.cart.forEach(cartItem => {
-            const productCard = document.querySelector(`[data-product-id="${cartItem.id}"]`);
+            const productCard = document.querySelector(`.product-card[data-product-id="${cartItem.id}"]`);
             if (productCard) {
-                const currentStock = parseInt(productCard.dataset.productStock);
-                const newStock = currentStock - cartItem.quantity;
-                
-                // Update stock display
-                productCard.dataset.productStock = newStock;
-                const stockDisplay = productCard.querySelector('.card-text small');
-                if (stockDisplay) {
-                    stockDisplay.textContent = `Stok: ${newStock}`;
-                }
-                
-                // Update button and badge based on new stock
-                const addButton = productCard.querySelector('.add-to-cart-btn');
-                const stockBadge = productCard.querySelector('.low-stock-badge');
-                
-                if (newStock <= 0) {
-                    productCard.classList.add('border-danger');
-                    if (addButton) {
-                        addButton.innerHTML = '<i class="fas fa-times me-1"></i>Habis';
-                        addButton.disabled = true;
-                        addButton.className = 'btn btn-secondary btn-sm';
-                    }
-                    if (stockBadge) {
-                        stockBadge.textContent = 'Habis';
-                        stockBadge.className = 'badge bg-danger low-stock-badge';
-                    }
-                } else if (newStock <= 10) {
-                    if (stockBadge) {
-                        stockBadge.textContent = 'Stok Rendah';
-                        stockBadge.className = 'badge bg-warning low-stock-badge';
-                    }
-                }
+                this.setProductStock(productCard, parseInt(productCard.dataset.productStock) - cartItem.quantity);
             }
         });
     }
 
+    setProductStock(productCard, stock) {
+        // Stock text, badge, border and add button for one product card
+        productCard.dataset.productStock = stock;
+        const stockDisplay = productCard.querySelector('.card-text small');
+        if (stockDisplay) {
+            stockDisplay.textContent = `Stok: ${stock}`;
+        }
+        productCard.classList.toggle('border-danger', stock <= 0);
+
+        let stockBadge = productCard.querySelector('.low-stock-badge');
+        if (stock > this.lowStockThreshold) {
+            if (stockBadge) stockBadge.remove();
+        } else {
+            if (!stockBadge) {
+                stockBadge = document.createElement('span');
+                productCard.querySelector('.card-body').prepend(stockBadge);
+            }
+            stockBadge.textContent = stock <= 0 ? 'Habis' : 'Stok Rendah';
+            stockBadge.className = `badge ${stock <= 0 ? 'bg-danger' : 'bg-warning'} low-stock-badge`;
+        }
+
+        const addButton = productCard.querySelector('.card-body > button');
+        if (addButton) {
+            if (stock <= 0) {
+                addButton.innerHTML = '<i class="fas fa-times me-1"></i>Habis';
+                addButton.disabled = true;
+                addButton.className = 'btn btn-secondary btn-sm';
+            } else {
+                addButton.innerHTML = '<i class="fas fa-plus me-1"></i>Tambah';
+                addButton.disabled = false;
+                addButton.className = 'btn btn-primary btn-sm add-to-cart-btn';
+            }
+        }
+    }
+
     showAlert(message, type) {
         // Create alert element
         const alertDiv = document.createElement('div');
@@ -0,0 +1,224 @@
+"""
+Bulk generator of realistic sales history for scale testing.
+
+Sales follow the outlet's day: quiet mornings, a lunch and a dinner rush,
+busier weekends. Product popularity is Zipf-skewed, cashiers work morning
+and evening shifts, and totals, discounts and change follow the checkout
+rules. Rows are written in large batches through the raw DBAPI cursor
+(COPY on Postgres, executemany elsewhere) instead of the ORM, and the
+rollups are rebuilt once at the end.
+"""
+import csv
+import io
+import logging
+import random
+import time
+from datetime import datetime, timedelta
+from checkout import calculate_totals
+from models import db, Product, Transaction, TransactionItem, User
+import rollups
+import transaction_ids
+
+# Relative number of sales per hour of the day (outlet open 10:00-22:00)
+HOURLY_WEIGHTS = {
+    10: 2, 11: 6, 12: 10, 13: 8, 14: 4, 15: 3,
+    16: 4, 17: 7, 18: 10, 19: 9, 20: 6, 21: 3,
+}
+
+# Relative traffic per weekday (Monday = 0)
+WEEKDAY_FACTORS = (0.85, 0.8, 0.85, 0.9, 1.1, 1.35, 1.3)
+
+# Number of distinct products per sale, and quantity per product
+ITEMS_PER_SALE = {1: 35, 2: 35, 3: 18, 4: 8, 5: 4}
+QUANTITIES = {1: 70, 2: 22, 3: 8}
+
+# Notes a customer pays with, smallest first
+CASH_DENOMINATIONS = (5000, 10000, 20000, 50000, 100000)
+
+TRANSACTION_COLUMNS = ('id', 'date', 'cashier', 'subtotal', 'discount', 'total', 'payment', 'change')
+ITEM_COLUMNS = ('transaction_id', 'product_id', 'product_name', 'category', 'price', 'quantity', 'subtotal')
+
+class SalesGenerator:
+    """Deterministic (per seed) stream of synthetic sales"""
+
+    def __init__(self, products, cashiers, seed=None, zipf_exponent=1.1):
+        if not products or not cashiers:
+            raise ValueError("Need at least one product and one cashier")
+        self.rng = random.Random(seed)
+        self.products = list(products)
+        self.cashiers = list(cashiers)
+
+        # Popularity: rank products randomly, weight rank r by 1 / r^s
+        ranked = self.products[:]
+        self.rng.shuffle(ranked)
+        self.ranked_products = ranked
+        weights = [1 / (rank ** zipf_exponent) for rank in range(1, len(ranked) + 1)]
+        self.product_weights = self._cumulative(weights)
+
+        self.hours = list(HOURLY_WEIGHTS)
+        self.hour_weights = self._cumulative(HOURLY_WEIGHTS.values())
+        self.item_counts = list(ITEMS_PER_SALE)
+        self.item_count_weights = self._cumulative(ITEMS_PER_SALE.values())
+        self.quantities = list(QUANTITIES)
+        self.quantity_weights = self._cumulative(QUANTITIES.values())
+
+        # Half the cashiers work the morning shift, the rest the evening
+        middle = max(1, len(self.cashiers) // 2)
+        self.shifts = (self.cashiers[:middle], self.cashiers[middle:] or self.cashiers[:middle])
+
+        # IDs encode the sale time; a per-run worker id keeps separate runs
+        # over the same period from colliding
+        self.worker_id = self.rng.randrange(transaction_ids.MAX_WORKER_ID + 1)
+        self.last_millis = 0
+        self.sequence = 0
+
+    @staticmethod
+    def _cumulative(weights):
+        total = 0
+        cumulative = []
+        for weight in weights:
+            total += weight
+            cumulative.append(total)
+        return cumulative
+
+    def sales_on(self, day, average):
+        """Number of sales on a day, around `average` adjusted for the weekday"""
+        expected = average * WEEKDAY_FACTORS[day.weekday()]
+        return max(0, int(self.rng.gauss(expected, expected * 0.1)))
+
+    def _transaction_id(self, moment):
+        """ID encoding the sale time, unique within the generated data"""
+        millis = int(moment.timestamp() * 1000)
+        if millis <= self.last_millis:
+            millis = self.last_millis
+            self.sequence += 1
+            if self.sequence > transaction_ids.MAX_SEQUENCE:
+                millis += 1
+                self.sequence = 0
+        else:
+            self.sequence = 0
+        self.last_millis = millis
+        value = ((millis << (transaction_ids.WORKER_BITS + transaction_ids.SEQUENCE_BITS))
+                 | (self.worker_id << transaction_ids.SEQUENCE_BITS) | self.sequence)
+        return transaction_ids.PREFIX + transaction_ids.encode(value)
+
+    def _payment(self, total):
+        """Cash handed over: exact, or rounded up to a common note"""
+        if self.rng.random() < 0.3:
+            return total
+        for note in CASH_DENOMINATIONS:
+            if self.rng.random() < 0.5 and note >= total:
+                return note
+        largest = CASH_DENOMINATIONS[-1]
+        return -(-total // largest) * largest
+
+    def day(self, day, average):
+        """Yield (transaction row, item rows) for one day, in time order"""
+        rng = self.rng
+        sales = self.sales_on(day, average)
+        hours = rng.choices(self.hours, cum_weights=self.hour_weights, k=sales)
+        moments = sorted(
+            datetime(day.year, day.month, day.day, hour, rng.randrange(60), rng.randrange(60), rng.randrange(1000000))
+            for hour in hours
+        )
+        counts = rng.choices(self.item_counts, cum_weights=self.item_count_weights, k=sales)
+
+        for moment, count in zip(moments, counts):
+            shift = self.shifts[0] if moment.hour < 16 else self.shifts[1]
+            picked = {}
+            for product in rng.choices(self.ranked_products, cum_weights=self.product_weights, k=count):
+                quantity = rng.choices(self.quantities, cum_weights=self.quantity_weights)[0]
+                picked[product[0]] = (product, picked.get(product[0], (None, 0))[1] + quantity)
+
+            cart = [{'id': product[0], 'name': product[1], 'price': product[2], 'category': product[3],
+                     'quantity': quantity} for product, quantity in picked.values()]
+            subtotal, discount, total = calculate_totals(cart)
+            payment = self._payment(total)
+            transaction_id = self._transaction_id(moment)
+
+            yield (
+                (transaction_id, moment, rng.choice(shift), subtotal, discount, total, payment, payment - total),
+                [(transaction_id, item['id'], item['name'], item['category'], item['price'], item['quantity'],
+                  item['price'] * item['quantity']) for item in cart]
+            )
+
+def _copy_rows(cursor, table, columns, rows):
+    """Load rows with Postgres COPY FROM STDIN"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows(rows)
+    buffer.seek(0)
+    column_list = ', '.join(f'"{column}"' for column in columns)
+    cursor.copy_expert(f'COPY {table} ({column_list}) FROM STDIN WITH (FORMAT csv)', buffer)
+
+def _write_batch(transactions, items):
+    """Insert one batch of rows through the session's DBAPI connection"""
+    connection = db.session.connection()
+    dialect = connection.dialect
+    if dialect.name == 'postgresql':
+        cursor = connection.connection.dbapi_connection.cursor()
+        try:
+            _copy_rows(cursor, Transaction.__tablename__, TRANSACTION_COLUMNS, transactions)
+            _copy_rows(cursor, TransactionItem.__tablename__, ITEM_COLUMNS, items)
+        finally:
+            cursor.close()
+        return
+
+    if dialect.name == 'sqlite':
+        # SQLite stores DateTime as text in SQLAlchemy's format
+        transactions = [(row[0], row[1].strftime('%Y-%m-%d %H:%M:%S.%f')) + row[2:] for row in transactions]
+        cursor = connection.connection.dbapi_connection.cursor()
+        try:
+            for table, columns, rows in ((Transaction.__tablename__, TRANSACTION_COLUMNS, transactions),
+                                         (TransactionItem.__tablename__, ITEM_COLUMNS, items)):
+                column_list = ', '.join(f'"{column}"' for column in columns)
+                placeholders = ', '.join('?' for _ in columns)
+                cursor.executemany(f'INSERT INTO {table} ({column_list}) VALUES ({placeholders})', rows)
+        finally:
+            cursor.close()
+        return
+
+    # Other drivers: Core executemany
+    db.session.execute(Transaction.__table__.insert(), [dict(zip(TRANSACTION_COLUMNS, row)) for row in transactions])
+    db.session.execute(TransactionItem.__table__.insert(), [dict(zip(ITEM_COLUMNS, row)) for row in items])
+
+def generate_sales(start, days, per_day, seed=None, batch_size=50000, progress=None):
+    """Generate `days` days of sales starting at `start` (a date).
+
+    Each batch of about `batch_size` item rows is committed on its own.
+    Returns (transactions, items) counts.
+    """
+    products = [(p.id, p.name, p.price, p.category) for p in Product.query.order_by(Product.id)]
+    cashiers = [u.username for u in User.query.filter_by(role='cashier').order_by(User.id)]
+    generator = SalesGenerator(products, cashiers, seed=seed)
+
+    transaction_rows, item_rows = [], []
+    transaction_count = item_count = 0
+    started = time.perf_counter()
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        for transaction_row, items in generator.day(day, per_day):
+            transaction_rows.append(transaction_row)
+            item_rows.extend(items)
+            if len(item_rows) >= batch_size:
+                _write_batch(transaction_rows, item_rows)
+                db.session.commit()
+                transaction_count += len(transaction_rows)
+                item_count += len(item_rows)
+                transaction_rows, item_rows = [], []
+                if progress:
+                    progress(day, transaction_count, item_count)
+
+    if transaction_rows:
+        _write_batch(transaction_rows, item_rows)
+        db.session.commit()
+        transaction_count += len(transaction_rows)
+        item_count += len(item_rows)
+
+    logging.info(f"Generated {transaction_count} transactions / {item_count} items "
+                 f"in {time.perf_counter() - started:.1f}s")
+
+    # Dashboard rollups for the generated period
+    period_start = datetime(start.year, start.month, start.day)
+    rollups.rebuild_rollups(period_start, period_start + timedelta(days=days))
+    return transaction_count, item_count
@@ -0,0 +1,139 @@
+"""
+Plain-text and ESC/POS receipts for 58mm/80mm thermal printers.
+
+Uses the same transaction dict as ReceiptGenerator.generate_pdf but skips
+ReportLab entirely: the receipt is laid out as fixed-width text and wrapped
+in a handful of ESC/POS control codes.
+"""
+import os
+import socket
+import textwrap
+from datetime import datetime
+from currency import format_currency
+
+# Characters per line in the printer's default font
+PAPER_WIDTHS = {58: 32, 80: 48}
+
+# ESC/POS control codes
+ESC_INIT = b'\x1b@'
+ESC_ALIGN_LEFT = b'\x1ba\x00'
+ESC_ALIGN_CENTER = b'\x1ba\x01'
+ESC_BOLD_ON = b'\x1bE\x01'
+ESC_BOLD_OFF = b'\x1bE\x00'
+GS_DOUBLE_SIZE = b'\x1d!\x11'
+GS_NORMAL_SIZE = b'\x1d!\x00'
+ESC_FEED_4 = b'\x1bd\x04'
+GS_PARTIAL_CUT = b'\x1dV\x42\x00'
+
+# Code page used for text bytes (most printers default to PC437)
+ENCODING = 'cp437'
+
+class ThermalReceiptRenderer:
+    """Render receipts as fixed-width text or raw ESC/POS bytes"""
+
+    def __init__(self, paper_mm=58):
+        if paper_mm not in PAPER_WIDTHS:
+            raise ValueError(f"Unsupported paper width: {paper_mm}mm")
+        self.width = PAPER_WIDTHS[paper_mm]
+
+    def columns(self, left, right):
+        """Left and right aligned text on one line"""
+        space = max(self.width - len(left) - len(right), 1)
+        return f"{left}{' ' * space}{right}"
+
+    def wrap(self, text, indent=''):
+        """Wrap long text (e.g. product names) to the paper width"""
+        return textwrap.wrap(str(text), self.width, subsequent_indent=indent) or ['']
+
+    def centered(self, text):
+        """Wrapped lines of text, each centered"""
+        return [(None, line.center(self.width).rstrip()) for line in self.wrap(text)]
+
+    def layout(self, transaction_data):
+        """Receipt as a list of (style, line) pairs; style is None, 'bold' or 'title'"""
+        date = datetime.fromisoformat(transaction_data['date'].replace('Z', '+00:00'))
+        rule = '-' * self.width
+
+        lines = [('title', 'KASIR GACOAN')]
+        lines.extend(self.centered('Sistem Point of Sale'))
+        lines.extend([
+            (None, rule),
+            (None, self.columns('No:', transaction_data['id'])),
+        ])
+        if transaction_data.get('receipt_number'):
+            lines.append((None, self.columns('Struk:', transaction_data['receipt_number'])))
+        lines.extend([
+            (None, self.columns('Tanggal:', date.strftime('%d/%m/%Y %H:%M'))),
+            (None, self.columns('Kasir:', transaction_data['cashier'])),
+            (None, rule),
+        ])
+
+        for item in transaction_data['items']:
+            # Handle both dict with 'name' and dict with 'product_name' keys
+            item_name = item.get('name') or item.get('product_name', 'Unknown Item')
+            item_price = item.get('price', 0)
+            item_quantity = item.get('quantity', 0)
+
+            lines.extend((None, line) for line in self.wrap(item_name, '  '))
+            lines.append((None, self.columns(
+                f"  {item_quantity} x {format_currency(item_price)}",
+                format_currency(item_price * item_quantity)
+            )))
+
+        lines.append((None, rule))
+        lines.append((None, self.columns('Subtotal', format_currency(transaction_data['subtotal']))))
+        if transaction_data['discount'] > 0:
+            lines.append((None, self.columns('Diskon', f"-{format_currency(transaction_data['discount'])}")))
+        lines.extend([
+            ('bold', self.columns('TOTAL', format_currency(transaction_data['total']))),
+            (None, self.columns('Bayar', format_currency(transaction_data['payment']))),
+            (None, self.columns('Kembalian', format_currency(transaction_data['change']))),
+            (None, rule),
+        ])
+        lines.extend(self.centered('Terima kasih atas kunjungan Anda!'))
+        lines.extend(self.centered('Selamat menikmati!'))
+        return lines
+
+    def render_text(self, transaction_data):
+        """Receipt as plain text"""
+        return '\n'.join(
+            line.center(self.width).rstrip() if style == 'title' else line
+            for style, line in self.layout(transaction_data)
+        ) + '\n'
+
+    def render_escpos(self, transaction_data):
+        """Receipt as raw ESC/POS bytes, ending with a paper cut"""
+        out = [ESC_INIT]
+        for style, line in self.layout(transaction_data):
+            text = line.encode(ENCODING, errors='replace') + b'\n'
+            if style == 'title':
+                out.extend([ESC_ALIGN_CENTER, GS_DOUBLE_SIZE, ESC_BOLD_ON, text,
+                            ESC_BOLD_OFF, GS_NORMAL_SIZE, ESC_ALIGN_LEFT])
+            elif style == 'bold':
+                out.extend([ESC_BOLD_ON, text, ESC_BOLD_OFF])
+            else:
+                out.append(text)
+        out.extend([ESC_FEED_4, GS_PARTIAL_CUT])
+        return b''.join(out)
+
+def send_to_printer(data, target, job_name='receipt'):
+    """Send raw bytes to a printer.
+
+    target is either `tcp://host:port` (network printer, usually port 9100),
+    a directory (a spool picked up by a print daemon) or a device/file path
+    such as /dev/usb/lp0.
+    """
+    if target.startswith('tcp://'):
+        host, _, port = target[len('tcp://'):].partition(':')
+        with socket.create_connection((host, int(port or 9100)), timeout=5) as conn:
+            conn.sendall(data)
+    elif os.path.isdir(target):
+        # Atomic rename so the spooler never picks up a partial job
+        path = os.path.join(target, f"{job_name}.bin")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    else:
+        with open(target, 'ab') as f:
+            f.write(data)
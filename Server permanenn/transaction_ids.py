@@ -0,0 +1,197 @@
+"""
+Collision-free transaction IDs and per-outlet daily receipt numbers.
+
+IDs look like `TRX-01JAB3C4D5E6F7G8`: 16 Crockford base32 characters holding
+an 80-bit value made of
+
+    48 bits  milliseconds since the Unix epoch
+    16 bits  worker id
+    16 bits  per-millisecond sequence
+
+so they sort by creation time (as strings too, since the width is fixed) and
+never collide as long as every process has its own worker id.
+
+A worker id is a host id (high 10 bits) and a slot (low 6 bits). Each
+process leases a free slot when it generates its first ID, by holding an
+exclusive lock on one of WORKER_SLOTS files in WORKER_LOCK_DIR, so forked
+gunicorn workers on one host never share an id, and a slot is freed when its
+process exits. Set WORKER_ID (the host id, 0-1023) to a different value on
+every host in multi-host deployments; otherwise it is derived from the
+hostname, which is only safe with a single host.
+"""
+import os
+import socket
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime
+from sqlalchemy import select
+from models import db, ReceiptCounter
+
+PREFIX = 'TRX-'
+
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'  # Crockford base32
+ENCODED_LENGTH = 16  # 80 bits / 5 bits per character
+
+WORKER_BITS = 16
+SEQUENCE_BITS = 16
+MAX_WORKER_ID = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+# Worker id = host id << SLOT_BITS | slot leased by the process
+SLOT_BITS = 6
+WORKER_SLOTS = 1 << SLOT_BITS
+MAX_HOST_ID = MAX_WORKER_ID >> SLOT_BITS
+
+LOCK_DIR = os.environ.get('WORKER_LOCK_DIR', os.path.join(tempfile.gettempdir(), 'kasir-gacoan-worker-ids'))
+
+def host_id():
+    """Host id from WORKER_ID, or derived from the hostname"""
+    configured = os.environ.get('WORKER_ID')
+    if configured is not None:
+        host = int(configured)
+        if not 0 <= host <= MAX_HOST_ID:
+            raise ValueError(f"WORKER_ID must be between 0 and {MAX_HOST_ID}")
+        return host
+    return zlib.crc32(socket.gethostname().encode()) & MAX_HOST_ID
+
+def _try_lock(f):
+    try:
+        import fcntl
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except ImportError:
+        import msvcrt
+        msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+
+def lease_slot(lock_dir=LOCK_DIR):
+    """Lock a free slot file; returns (slot, open file). The lock lasts until the file is closed."""
+    os.makedirs(lock_dir, exist_ok=True)
+    for slot in range(WORKER_SLOTS):
+        f = open(os.path.join(lock_dir, f"slot-{slot:02d}.lock"), 'a+')
+        try:
+            _try_lock(f)
+        except OSError:
+            f.close()
+            continue
+        return slot, f
+    raise RuntimeError(f"All {WORKER_SLOTS} transaction id slots in {lock_dir} are taken")
+
+def encode(value):
+    """Encode an 80-bit integer as fixed-width Crockford base32"""
+    chars = []
+    for _ in range(ENCODED_LENGTH):
+        value, remainder = divmod(value, 32)
+        chars.append(ALPHABET[remainder])
+    return ''.join(reversed(chars))
+
+def decode(transaction_id):
+    """Split an ID back into (created datetime, worker id, sequence)"""
+    value = 0
+    for char in transaction_id[len(PREFIX):]:
+        value = value * 32 + ALPHABET.index(char)
+    sequence = value & MAX_SEQUENCE
+    worker_id = (value >> SEQUENCE_BITS) & MAX_WORKER_ID
+    millis = value >> (WORKER_BITS + SEQUENCE_BITS)
+    return datetime.fromtimestamp(millis / 1000), worker_id, sequence
+
+def created_at(transaction_id):
+    """Creation time of an ID, also of legacy `TRX-<unix time>` ones; None when unknown"""
+    body = transaction_id[len(PREFIX):] if transaction_id.startswith(PREFIX) else ''
+    if len(body) == ENCODED_LENGTH and all(char in ALPHABET for char in body):
+        return decode(transaction_id)[0]
+    if body.isdigit():
+        return datetime.fromtimestamp(int(body))
+    return None
+
+class TransactionIdGenerator:
+    """Thread-safe, monotonic ID generator for one process"""
+
+    def __init__(self, worker_id=None):
+        self.worker_id = worker_id  # leased on first use when None
+        self.lease = None
+        self.lock = threading.Lock()
+        self.last_millis = 0
+        self.sequence = 0
+
+    def release(self):
+        """Give the leased slot back (it is also freed when the process exits)"""
+        if self.lease is not None:
+            self.lease.close()
+            self.lease = None
+
+    def next_id(self):
+        """Return the next ID; unique and increasing within this generator"""
+        with self.lock:
+            if self.worker_id is None:
+                slot, self.lease = lease_slot()
+                self.worker_id = host_id() << SLOT_BITS | slot
+            millis = int(time.time() * 1000)
+            if millis <= self.last_millis:
+                # Same millisecond, or the clock went backwards: keep counting
+                # from the last timestamp so IDs stay monotonic.
+                millis = self.last_millis
+                self.sequence += 1
+                if self.sequence > MAX_SEQUENCE:
+                    millis += 1
+                    self.sequence = 0
+            else:
+                self.sequence = 0
+            self.last_millis = millis
+
+            value = (millis << (WORKER_BITS + SEQUENCE_BITS)) | (self.worker_id << SEQUENCE_BITS) | self.sequence
+        return PREFIX + encode(value)
+
+_generator = TransactionIdGenerator()
+
+def _reset_after_fork():
+    """Forked workers (gunicorn preload) must not share the parent's worker id.
+
+    The inherited lease file is closed in the child only; the parent keeps
+    its slot and the child leases its own on first use.
+    """
+    global _generator
+    if _generator.lease is not None:
+        _generator.lease.close()
+    _generator = TransactionIdGenerator()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+def next_id():
+    """Next transaction ID for this process"""
+    return _generator.next_id()
+
+def next_receipt_number(outlet, day):
+    """Allocate the next human-friendly receipt number for an outlet and day.
+
+    Runs inside the caller's database transaction, so the counter only
+    advances when the sale commits. Example: `GCN-20241017-0042`.
+    """
+    table = ReceiptCounter.__table__
+    dialect = db.session.get_bind().dialect.name
+
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+
+        stmt = insert(table).values(outlet=outlet, day=day, last_number=1)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['outlet', 'day'],
+            set_={'last_number': table.c.last_number + 1}
+        ).returning(table.c.last_number)
+        number = db.session.execute(stmt).scalar_one()
+    else:
+        result = db.session.execute(
+            table.update()
+            .where(table.c.outlet == outlet, table.c.day == day)
+            .values(last_number=table.c.last_number + 1)
+        )
+        if result.rowcount == 0:
+            db.session.execute(table.insert().values(outlet=outlet, day=day, last_number=1))
+        number = db.session.execute(
+            select(table.c.last_number).where(table.c.outlet == outlet, table.c.day == day)
+        ).scalar_one()
+
+    return f"{outlet}-{day.strftime('%Y%m%d')}-{number:04d}"
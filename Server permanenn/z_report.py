@@ -0,0 +1,263 @@
+"""
+End-of-day / shift Z-report with every receipt of the period in one PDF.
+
+The summary page is built from a few aggregate queries. The receipts are
+then read through a server-side cursor and turned into flowables only as
+ReportLab consumes them, so a busy day never holds every sale (or every
+flowable) in memory at once. Sales of months moved to the sales archive
+(sales_archive.py) are added to the figures and merged into the receipts
+by date, so a report over an archived period is complete.
+"""
+import heapq
+import logging
+from datetime import datetime
+from itertools import groupby
+from sqlalchemy import select, func
+from reportlab.lib import colors
+from reportlab.lib.units import inch
+from reportlab.platypus import Table, TableStyle, Paragraph, Spacer, PageBreak
+from models import db, Product, Transaction, TransactionItem
+from receipt_generator import ReceiptGenerator
+from rollups import UNKNOWN_CATEGORY
+
+# Rows fetched from the database per round trip
+FETCH_SIZE = 1000
+
+class _FlowableStream(list):
+    """List facade over an iterator of flowable lists.
+
+    SimpleDocTemplate.build consumes its story by checking len() and
+    deleting the first element; refilling the list from the iterator
+    whenever it runs empty keeps only one receipt's flowables alive.
+    """
+
+    def __init__(self, chunks):
+        super().__init__()
+        self.chunks = iter(chunks)
+
+    def __len__(self):
+        while not list.__len__(self):
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.extend(chunk)
+        return list.__len__(self)
+
+def _filters(stmt, start, end, cashier):
+    """Restrict a statement to the half-open range [start, end) and one cashier"""
+    stmt = stmt.where(Transaction.date >= start, Transaction.date < end)
+    if cashier:
+        stmt = stmt.where(Transaction.cashier == cashier)
+    return stmt
+
+def _add_archived(summary, archive, start, end, cashier):
+    """Fold the archived sales of the period into a summary"""
+    product_categories = None
+    cashiers = {row['cashier']: row for row in summary['cashiers']}
+    categories = {row['category']: row for row in summary['categories']}
+    receipts = [summary['first_receipt'], summary['last_receipt']]
+    for transaction in archive.iter_sales(start, end, cashier):
+        values = transaction.values
+        summary['transaction_count'] += 1
+        for field in ('subtotal', 'discount', 'total', 'payment', 'change'):
+            summary[field] += values[field] or 0
+        if values['receipt_number']:
+            receipts.append(values['receipt_number'])
+        row = cashiers.setdefault(values['cashier'], {'cashier': values['cashier'], 'transaction_count': 0,
+                                                       'discount': 0, 'total': 0})
+        row['transaction_count'] += 1
+        row['discount'] += values['discount'] or 0
+        row['total'] += values['total']
+        for item in transaction.items:
+            category = item['category']
+            if not category:
+                # Sold before items stored their category: the product's current one
+                if product_categories is None:
+                    product_categories = dict(db.session.execute(select(Product.id, Product.category)).all())
+                category = product_categories.get(item['product_id']) or UNKNOWN_CATEGORY
+            row = categories.setdefault(category, {'category': category, 'quantity': 0, 'revenue': 0})
+            row['quantity'] += item['quantity']
+            row['revenue'] += item['subtotal']
+
+    receipts = [receipt for receipt in receipts if receipt]
+    summary['first_receipt'] = min(receipts) if receipts else None
+    summary['last_receipt'] = max(receipts) if receipts else None
+    summary['cashiers'] = sorted(cashiers.values(), key=lambda row: row['cashier'])
+    summary['categories'] = sorted(categories.values(), key=lambda row: row['revenue'], reverse=True)
+    return summary
+
+def summarize(start, end, cashier=None, archive=None):
+    """Z-report figures for the period as a dict; archive is the sales ArchiveStore"""
+    totals = db.session.execute(_filters(select(
+        func.count(Transaction.id),
+        func.coalesce(func.sum(Transaction.subtotal), 0),
+        func.coalesce(func.sum(Transaction.discount), 0),
+        func.coalesce(func.sum(Transaction.total), 0),
+        func.coalesce(func.sum(Transaction.payment), 0),
+        func.coalesce(func.sum(Transaction.change), 0),
+        func.min(Transaction.receipt_number),
+        func.max(Transaction.receipt_number)
+    ), start, end, cashier)).one()
+
+    cashiers = db.session.execute(_filters(select(
+        Transaction.cashier,
+        func.count(Transaction.id),
+        func.sum(Transaction.discount),
+        func.sum(Transaction.total)
+    ), start, end, cashier).group_by(Transaction.cashier).order_by(Transaction.cashier)).all()
+
+    # The category stored at sale time, like the dashboard rollups (rollups.py)
+    category = func.coalesce(TransactionItem.category, Product.category, UNKNOWN_CATEGORY)
+    categories = db.session.execute(_filters(select(
+        category,
+        func.sum(TransactionItem.quantity),
+        func.sum(TransactionItem.subtotal)
+    ).join(Transaction, TransactionItem.transaction_id == Transaction.id)
+     .outerjoin(Product, TransactionItem.product_id == Product.id),
+        start, end, cashier).group_by(category).order_by(func.sum(TransactionItem.subtotal).desc())).all()
+
+    summary = {
+        'start': start,
+        'end': end,
+        'cashier': cashier,
+        'transaction_count': totals[0],
+        'subtotal': totals[1],
+        'discount': totals[2],
+        'total': totals[3],
+        'payment': totals[4],
+        'change': totals[5],
+        'first_receipt': totals[6],
+        'last_receipt': totals[7],
+        'cashiers': [{'cashier': row[0], 'transaction_count': row[1], 'discount': row[2] or 0, 'total': row[3] or 0}
+                     for row in cashiers],
+        'categories': [{'category': row[0], 'quantity': row[1] or 0, 'revenue': row[2] or 0}
+                       for row in categories],
+    }
+    return _add_archived(summary, archive, start, end, cashier) if archive is not None else summary
+
+def iter_receipts(start, end, cashier=None):
+    """Stream the period's sales as receipt dicts (same shape as Transaction.to_dict)"""
+    stmt = _filters(select(
+        Transaction.id, Transaction.date, Transaction.cashier, Transaction.receipt_number,
+        Transaction.subtotal, Transaction.discount, Transaction.total, Transaction.payment,
+        Transaction.change, TransactionItem.product_name, TransactionItem.price, TransactionItem.quantity
+    ).join(TransactionItem, TransactionItem.transaction_id == Transaction.id), start, end, cashier)
+    stmt = stmt.order_by(Transaction.date, Transaction.id, TransactionItem.id)
+
+    result = db.session.execute(stmt.execution_options(stream_results=True, yield_per=FETCH_SIZE))
+    try:
+        for transaction_id, group in groupby(result, key=lambda row: row.id):
+            rows = list(group)
+            first = rows[0]
+            yield {
+                'id': first.id,
+                'date': first.date.isoformat(),
+                'cashier': first.cashier,
+                'receipt_number': first.receipt_number,
+                'subtotal': first.subtotal,
+                'discount': first.discount or 0,
+                'total': first.total,
+                'payment': first.payment,
+                'change': first.change,
+                'items': [{'product_name': row.product_name, 'price': row.price, 'quantity': row.quantity}
+                          for row in rows],
+            }
+    finally:
+        result.close()
+
+def iter_all_receipts(start, end, cashier=None, archive=None):
+    """Live and archived receipts of the period merged in (date, id) order"""
+    receipts = iter_receipts(start, end, cashier)
+    if archive is None:
+        return receipts
+    archived = (transaction.to_dict(items=[{key: item[key] for key in ('product_name', 'price', 'quantity')}
+                                           for item in transaction.items])
+                for transaction in archive.iter_sales(start, end, cashier))
+    archived = (dict(receipt, discount=receipt['discount'] or 0) for receipt in archived)
+    return heapq.merge(archived, receipts, key=lambda receipt: (receipt['date'], receipt['id']))
+
+class ZReportGenerator(ReceiptGenerator):
+    """Z-report summary followed by every receipt of the period, in one PDF"""
+
+    def table(self, rows, col_widths, header=True):
+        """Summary table in the receipt's table style"""
+        table = Table(rows, colWidths=col_widths)
+        style = [
+            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+            ('ALIGN', (1, 0), (-1, -1), 'RIGHT'),
+            ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
+            ('FONTSIZE', (0, 0), (-1, -1), 10),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+        ]
+        if header:
+            style.extend([
+                ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+                ('GRID', (0, 0), (-1, -1), 1, colors.black),
+            ])
+        table.setStyle(TableStyle(style))
+        return table
+
+    def build_summary(self, summary):
+        """Flowables of the Z-report summary page"""
+        period = f"{summary['start'].strftime('%d/%m/%Y %H:%M')} - {summary['end'].strftime('%d/%m/%Y %H:%M')}"
+        story = [
+            Paragraph("KASIR GACOAN", self.title_style),
+            Paragraph("Laporan Penutupan (Z-Report)", self.header_style),
+        ]
+
+        info_data = [
+            ['Periode:', period],
+            ['Kasir:', summary['cashier'] or 'Semua kasir'],
+            ['Dicetak:', datetime.now().strftime('%d/%m/%Y %H:%M:%S')],
+        ]
+        if summary['first_receipt']:
+            info_data.append(['No. Struk:', f"{summary['first_receipt']} - {summary['last_receipt']}"])
+        story.append(self.table(info_data, [2*inch, 4*inch], header=False))
+        story.append(Spacer(1, 20))
+
+        story.append(self.table([
+            ['Ringkasan', ''],
+            ['Jumlah transaksi', str(summary['transaction_count'])],
+            ['Penjualan kotor', self.format_currency(summary['subtotal'])],
+            ['Diskon', f"-{self.format_currency(summary['discount'])}"],
+            ['Penjualan bersih', self.format_currency(summary['total'])],
+            ['Uang diterima', self.format_currency(summary['payment'])],
+            ['Kembalian', f"-{self.format_currency(summary['change'])}"],
+            ['Kas masuk', self.format_currency(summary['payment'] - summary['change'])],
+        ], [3*inch, 2*inch]))
+        story.append(Spacer(1, 20))
+
+        story.append(self.table([['Kasir', 'Transaksi', 'Diskon', 'Total']] + [[
+            row['cashier'],
+            str(row['transaction_count']),
+            self.format_currency(row['discount']),
+            self.format_currency(row['total'])
+        ] for row in summary['cashiers']], [2.4*inch, 1*inch, 1.4*inch, 1.4*inch]))
+        story.append(Spacer(1, 20))
+
+        story.append(self.table([['Kategori', 'Qty', 'Penjualan']] + [[
+            row['category'].title(),
+            str(row['quantity']),
+            self.format_currency(row['revenue'])
+        ] for row in summary['categories']], [2.4*inch, 1*inch, 2.8*inch]))
+        return story
+
+    def _story(self, summary, receipts):
+        """Summary first, then one page per receipt"""
+        yield self.build_summary(summary)
+        for transaction_data in receipts:
+            yield [PageBreak()] + self.build_story(transaction_data)
+
+    def generate_report(self, start, end, output, cashier=None, archive=None):
+        """Write the report for [start, end) to a file path or binary file object.
+
+        archive is the sales ArchiveStore holding older months, if any.
+        Returns the summary dict.
+        """
+        summary = summarize(start, end, cashier, archive)
+        doc = self.create_document(output)
+        doc.build(_FlowableStream(self._story(summary, iter_all_receipts(start, end, cashier, archive))))
+        logging.info(f"Z-report generated: {summary['transaction_count']} transactions, {start} - {end}")
+        return summary